@@ -2,15 +2,36 @@ from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from backend.routes import books, user, collections
+from backend.routes import books, user, collections, metrics, images
+from backend.services import db
 from backend.services.db import close_db, db_connect
+from backend.services.http_client import close_http, http_connect
+from backend.services import tasks
+from backend.services.suggest import build_suggest_index
+from backend.services.image_cache import cover_index, remove_partial_downloads, shutdown_thumbnail_pool
+from backend.services.image_sweeper import ImageCacheSweeper
 from pathlib import Path
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    await db_connect()
+    sweeper = None
+    if await db_connect():
+        # typeahead works (just emptier) until this finishes, don't hold up startup
+        tasks.spawn(build_suggest_index(db.database), name="build-suggest-index")
+        sweeper = tasks.spawn(ImageCacheSweeper(db.database).run_forever(), name="image-cache-sweeper")
+    await http_connect()
+    # leftovers of downloads a crash interrupted, never served but they take up space
+    remove_partial_downloads()
+    # covers are probed the old way (stat + Mongo) until the scan is done
+    tasks.spawn(cover_index().load(), name="load-cover-index")
     yield
+    if sweeper:
+        # loops forever, tasks.shutdown would sit out its whole timeout on it
+        sweeper.cancel()
+    await tasks.shutdown()
+    shutdown_thumbnail_pool()
+    await close_http()
     await close_db()
 
 app = FastAPI(title="BookStore API", lifespan=lifespan)
@@ -28,9 +49,15 @@ app.add_middleware(
 static_dir = Path("static/images")
 static_dir.mkdir(parents=True, exist_ok=True)
 
+# Flat /static/images/{cover_id}.jpg URLs from before sharding, must come before the mounts
+app.include_router(images.router, prefix="/static/images", tags=["Images"])
+# Sharded covers, evicted ones redirect to OpenLibrary
+app.mount("/static/images", images.CoverFiles(directory=str(static_dir)), name="covers")
+
 # Mount static files for cached images
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 app.include_router(books.router, prefix="/books", tags=["Books"])
 app.include_router(user.router, prefix="/user", tags=["User"])
-app.include_router(collections.router, prefix="/collections", tags=["Collections"])
\ No newline at end of file
+app.include_router(collections.router, prefix="/collections", tags=["Collections"])
+app.include_router(metrics.router, prefix="/metrics", tags=["Metrics"])
\ No newline at end of file
@@ -1,12 +1,63 @@
-from fastapi import APIRouter
-from backend.services import db
-from backend.services.openbook import OpenBookAPI
+from fastapi import APIRouter, HTTPException, Query, status
+from fastapi.responses import StreamingResponse
+from backend.services import db, http_client
+import json
+from backend.services.openbook import OpenBookAPI, parse_enrich, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from backend.services.suggest import suggest_index
+from backend.services.refine import make_filters, parse_sort, parse_facets
 
 router = APIRouter()
 
+def _enrich_param(enrich: str) -> tuple:
+    try:
+        return parse_enrich(enrich)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e))
+
+def _refine_params(sort: str, facets: str) -> tuple:
+    try:
+        return parse_sort(sort), parse_facets(facets)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e))
+
+# Must be declared before /{book_name}, otherwise "suggest" is taken as a book name
+@router.get("/suggest")
+async def suggest_books(
+    prefix: str = Query(..., min_length=1),
+    limit: int = Query(10, ge=1, le=50)
+):
+    """
+    Typeahead suggestions for the search box, answered from an in-memory prefix index
+    (no Mongo / OpenLibrary call). No auth required.
+
+    Response Format:
+    {
+        "prefix": <string>,
+        "suggestions": [
+            {"text": <string>, "kind": "query" | "title" | "author"},
+            etc etc
+        ]
+    }
+
+    Ranked by how often the text was searched / showed up in results.
+    """
+    return {"prefix": prefix, "suggestions": suggest_index.suggest(prefix, limit)}
+
 @router.get("/{book_name}")
-async def search_book(book_name: str, page: int = 1):
-    api = OpenBookAPI(db.database)
+async def search_book(
+    book_name: str,
+    page: int = 1,
+    enrich: str = "all",
+    page_size: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    year_from: int = None,
+    year_to: int = None,
+    genre: str = None,
+    author: str = None,
+    sort: str = "relevance",
+    facets: str = "",
+    deadline_ms: int = Query(None, ge=0, le=60000)
+):
+    api = OpenBookAPI(db.database, http_client.get_client())
     """
     Returns a list of books that match the search query. No auth required.
 
@@ -30,10 +81,70 @@ async def search_book(book_name: str, page: int = 1):
 
     Query Parameters:
         page (int) — Pagination index (1-based).
+        enrich (str) — Which enrichments to run: "all" (default), "none", or a comma list
+                       of "description" / "image". Skipped ones come back as "".
+        page_size (int) — Results per page (default 100), passed to OpenLibrary as limit.
+        year_from, year_to (int) — Keep books published in this range (inclusive).
+        genre (str) — Keep books with this genre (case / punctuation insensitive).
+        author (str) — Keep books whose author name contains this.
+        sort (str) — "relevance" (default), "year", "title" or "author", "-" in front to reverse.
+        facets (str) — "all" or a comma list of "genre" / "decade" / "author" to get value counts.
+        deadline_ms (int) — Latency budget for a cold search (server default SEARCH_DEADLINE_MS, 0 = wait).
+                            What isn't ready in time is listed in "pending": ["description", "image"]
+                            with those fields left "", or ["results"] if the search itself wasn't back.
+                            The rest keeps going server side, so asking again shortly after gets it cached.
+
+        With any of the above the search runs over the local catalog (topped up with
+        OpenLibrary's matches for the filtered query) and is paginated after filtering,
+        so "count" is the filtered total. "facets": {<facet>: [{"value": <string>, "count": <int>}, ...]}
+        counts every matching book, not just this page.
 
     Notes:
         - If no books are found, "results" will be an empty list.
         - If OpenLibrary rate limits or returns invalid data,
           this endpoint will return an empty list and count=0.
+        - While OpenLibrary's circuit breaker is open and nothing cached / local matches,
+          the response is {"count": 0, "results": [], "degraded": true}.
+    """
+    levels = _enrich_param(enrich)
+    sort_key, facet_names = _refine_params(sort, facets)
+
+    filters = make_filters(year_from, year_to, genre, author)
+
+    if filters or sort_key[0] != "relevance" or facet_names:
+        return await api.refined_search(book_name, page, enrich=levels, page_size=page_size, filters=filters,
+                                        sort=sort_key, facets=facet_names, deadline_ms=deadline_ms)
+    return await api.search(book_name, page, enrich=levels, page_size=page_size, deadline_ms=deadline_ms)
+
+@router.get("/{book_name}/stream")
+async def search_book_stream(
+    book_name: str,
+    page: int = 1,
+    enrich: str = "all",
+    page_size: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE)
+):
+    """
+    Streaming version of the search, as NDJSON (one JSON object per line). No auth required.
+
+    Lines:
+        {"type": "results", "count": <int>, "results": [...]}
+            Same shape as GET /books/{book_name}. On a cold search "sypnosis" and
+            "image" start out as "" and are filled in by the patches below.
+        {"type": "patch", "bID": <string>, "sypnosis": <string>}
+        {"type": "patch", "bID": <string>, "image": <string>}
+            Sent as each description / cover resolves, in completion order.
+        {"type": "done"}
+
+    Query Parameters:
+        page (int) — Pagination index (1-based).
+        enrich (str) — Same as GET /books/{book_name}, only the chosen enrichments get patches.
+        page_size (int) — Same as GET /books/{book_name}.
     """
-    return await api.search(book_name, page)
\ No newline at end of file
+    api = OpenBookAPI(db.database, http_client.get_client())
+    levels = _enrich_param(enrich)
+
+    async def lines():
+        async for event in api.search_stream(book_name, page, enrich=levels, page_size=page_size):
+            yield json.dumps(event) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
@@ -0,0 +1,64 @@
+import asyncio
+from pathlib import Path, PurePath
+from fastapi import APIRouter, HTTPException, status
+from fastapi.responses import FileResponse, RedirectResponse
+from fastapi.staticfiles import StaticFiles
+from starlette.exceptions import HTTPException as StarletteHTTPException
+from backend.services.image_cache import CACHE_DIR, cover_relpath, parse_filename, shard
+
+router = APIRouter()
+
+# OpenLibrary's closest size to each rendition, its S is far below our 160px
+OPENLIBRARY_SIZES = {"s": "M", "m": "M", "l": "L"}
+
+
+def openlibrary_redirect(cover_id: str, variant: str = None) -> RedirectResponse:
+    """Where a cover that isn't cached any more is sent instead of a 404"""
+    size = OPENLIBRARY_SIZES.get(variant.split(".")[0], "L") if variant else "L"
+    return RedirectResponse(
+        f"https://covers.openlibrary.org/b/id/{cover_id}-{size}.jpg",
+        status_code=status.HTTP_307_TEMPORARY_REDIRECT
+    )
+
+
+# Mounted at /static/images ahead of the /static mount in main.py. Only matches flat names,
+# sharded paths (/static/images/ab/cd/...) go to CoverFiles below.
+@router.get("/{filename}")
+async def legacy_image(filename: str):
+    """
+    Covers used to live flat in static/images, and those URLs are stored in the books
+    catalog and in clients. Serves the file from its sharded home (or the flat one
+    while unmigrated). A cover that isn't cached any more redirects to OpenLibrary.
+    """
+    parsed = parse_filename(filename)
+    if parsed is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    cover_id, variant = parsed
+
+    cache_dir = Path(CACHE_DIR)
+    for path in (cache_dir / cover_relpath(cover_id, variant), cache_dir / filename):
+        if await asyncio.to_thread(path.is_file):
+            return FileResponse(path)
+
+    return openlibrary_redirect(cover_id, variant)
+
+
+class CoverFiles(StaticFiles):
+    """
+    StaticFiles for the sharded layout, /static/images/ab/cd/{cover_id}.jpg and its renditions.
+    Those URLs are stored in the catalog and search cache, so once eviction has removed the
+    file they redirect to OpenLibrary like the flat route instead of a 404.
+    """
+
+    async def get_response(self, path: str, scope):
+        try:
+            return await super().get_response(path, scope)
+        except StarletteHTTPException as e:
+            if e.status_code != status.HTTP_404_NOT_FOUND:
+                raise
+            parts = PurePath(path).parts
+            parsed = parse_filename(parts[-1]) if len(parts) == 3 else None
+            # only a cover's own shard, anything else under static/images stays a 404
+            if parsed is None or "/".join(parts[:2]) != shard(parsed[0]):
+                raise
+            return openlibrary_redirect(*parsed)
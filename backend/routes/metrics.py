@@ -0,0 +1,22 @@
+from fastapi import APIRouter
+from backend.services.openbook import search_cache_stats
+from backend.services.scheduler import scheduler
+from backend.services.suggest import suggest_index
+from backend.services.image_cache import cover_index
+from backend.services.image_sweeper import sweep_stats
+
+router = APIRouter()
+
+@router.get("/")
+async def get_metrics():
+    """
+    Process-local counters for the caching / upstream layers. No auth required.
+    Each uvicorn worker reports its own numbers.
+    """
+    return {
+        "search_cache": search_cache_stats(),
+        "outbound": scheduler.stats(),
+        "suggest": suggest_index.stats(),
+        "cover_index": cover_index().stats(),
+        "image_sweeper": dict(sweep_stats),
+    }
@@ -0,0 +1,136 @@
+import os
+import time
+from collections import deque
+
+BREAKER_WINDOW = float(os.getenv("BREAKER_WINDOW", "30"))
+# Don't judge a host on a handful of calls
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", "10"))
+BREAKER_FAILURE_RATE = float(os.getenv("BREAKER_FAILURE_RATE", "0.5"))
+# A call slower than this counts as slow, too many slow calls trip the breaker too
+BREAKER_SLOW_CALL = float(os.getenv("BREAKER_SLOW_CALL", "5"))
+BREAKER_SLOW_RATE = float(os.getenv("BREAKER_SLOW_RATE", "0.8"))
+BREAKER_OPEN_SECONDS = float(os.getenv("BREAKER_OPEN_SECONDS", "30"))
+BREAKER_HALF_OPEN_PROBES = int(os.getenv("BREAKER_HALF_OPEN_PROBES", "2"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a host whose breaker is open"""
+
+    def __init__(self, host: str, retry_in: float):
+        super().__init__(f"circuit open for {host}, retry in {retry_in:.1f}s")
+        self.host = host
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """
+    Per-host breaker over a rolling time window.
+      closed     calls go through, trips to open on too many errors or slow calls
+      open       calls fail right away for open_seconds
+      half_open  a few probe calls go through, all succeeding closes it, any failure reopens
+    """
+
+    def __init__(self, host: str, window: float = BREAKER_WINDOW, min_calls: int = BREAKER_MIN_CALLS,
+                 failure_rate: float = BREAKER_FAILURE_RATE, slow_call: float = BREAKER_SLOW_CALL,
+                 slow_rate: float = BREAKER_SLOW_RATE, open_seconds: float = BREAKER_OPEN_SECONDS,
+                 half_open_probes: int = BREAKER_HALF_OPEN_PROBES):
+        self.host = host
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call = slow_call
+        self.slow_rate = slow_rate
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+
+        self.state = CLOSED
+        self._calls = deque()  # (finished_at, failed, slow)
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+
+        self.opened = 0
+        self.rejected = 0
+
+    def _retry_in(self) -> float:
+        return max(0.0, self._opened_at + self.open_seconds - time.monotonic())
+
+    def available(self) -> bool:
+        """Would a call go through right now. Doesn't take a probe slot."""
+        if self.state == OPEN:
+            return self._retry_in() == 0
+        if self.state == HALF_OPEN:
+            return self._probes_in_flight + self._probe_successes < self.half_open_probes
+        return True
+
+    def before_call(self):
+        """Raises CircuitOpenError if the call must not go out. Pair with record() or cancel()."""
+        if self.state == OPEN:
+            if self._retry_in() > 0:
+                self.rejected += 1
+                raise CircuitOpenError(self.host, self._retry_in())
+            self.state = HALF_OPEN
+            self._probes_in_flight = 0
+            self._probe_successes = 0
+
+        if self.state == HALF_OPEN:
+            if self._probes_in_flight + self._probe_successes >= self.half_open_probes:
+                self.rejected += 1
+                raise CircuitOpenError(self.host, 0.0)
+            self._probes_in_flight += 1
+
+    def record(self, failed: bool, elapsed: float):
+        slow = elapsed >= self.slow_call
+        if self.state == HALF_OPEN:
+            self._probes_in_flight = max(0, self._probes_in_flight - 1)
+            if failed or slow:
+                self._open()
+                return
+            self._probe_successes += 1
+            if self._probe_successes >= self.half_open_probes:
+                self.state = CLOSED
+                self._calls.clear()
+            return
+
+        if self.state == OPEN:
+            # a call that started before we tripped, nothing to learn from it
+            return
+
+        now = time.monotonic()
+        self._calls.append((now, failed, slow))
+        while self._calls and self._calls[0][0] < now - self.window:
+            self._calls.popleft()
+
+        total = len(self._calls)
+        if total < self.min_calls:
+            return
+        failures = sum(1 for _, f, _ in self._calls if f)
+        slows = sum(1 for _, _, s in self._calls if s)
+        if failures / total >= self.failure_rate or slows / total >= self.slow_rate:
+            self._open()
+
+    def cancel(self):
+        """The call never finished (cancelled), give its probe slot back"""
+        if self.state == HALF_OPEN:
+            self._probes_in_flight = max(0, self._probes_in_flight - 1)
+
+    def _open(self):
+        self.state = OPEN
+        self._opened_at = time.monotonic()
+        self._calls.clear()
+        self.opened += 1
+
+    def stats(self) -> dict:
+        total = len(self._calls)
+        return {
+            "state": self.state,
+            "calls_in_window": total,
+            "failure_rate": round(sum(1 for _, f, _ in self._calls if f) / total, 4) if total else 0.0,
+            "retry_in": round(self._retry_in(), 2) if self.state == OPEN else 0.0,
+            "opened": self.opened,
+            "rejected": self.rejected,
+        }
@@ -1,9 +1,24 @@
 from pymongo.server_api import ServerApi
+from pymongo.errors import OperationFailure
 from motor.motor_asyncio import AsyncIOMotorClient
 
 client = None
 database = None
 
+
+async def ensure_ttl_index(collection, field: str, seconds: int):
+    """Create a TTL index, or retune it in place if it already exists with another expiry."""
+    try:
+        await collection.create_index(field, expireAfterSeconds=seconds)
+    except OperationFailure as e:
+        # IndexOptionsConflict, same key different expireAfterSeconds
+        if e.code != 85:
+            raise
+        await collection.database.command(
+            "collMod", collection.name,
+            index={"keyPattern": {field: 1}, "expireAfterSeconds": seconds}
+        )
+
 async def db_connect():
     global client, database
 
@@ -15,9 +30,20 @@ async def db_connect():
         await client.admin.command('ping')
         print("Pinged your deployment. Connection successful.")
 
+        # Entries from before page_size existed were fetched with OpenLibrary's default of 100
+        try:
+            await database.search_cache.update_many(
+                {"page_size": {"$exists": False}},
+                {"$set": {"page_size": 100}}
+            )
+            if "title_1_page_1" in await database.search_cache.index_information():
+                await database.search_cache.drop_index("title_1_page_1")
+        except Exception as e:
+            print(f"Warning: Could not migrate search_cache to page_size: {e}")
+
         # Shit gets super slow without indexes...
         try:
-            await database.search_cache.create_index([("title", 1), ("page", 1)], unique=True)
+            await database.search_cache.create_index([("title", 1), ("page", 1), ("page_size", 1)], unique=True)
         except Exception as e:
             if "duplicate key" in str(e).lower():
                 print("Nuking duplicate search_cache entries...")
@@ -26,34 +52,57 @@ async def db_connect():
                 pipeline = [
                     {"$sort": {"_id": -1}},
                     {"$group": {
-                        "_id": {"title": "$title", "page": "$page"},
-                        "doc_id": {"$first": "$_id"},
-                        "data": {"$first": "$data"}
+                        "_id": {"title": "$title", "page": "$page", "page_size": "$page_size"},
+                        "doc": {"$first": "$$ROOT"}
                     }}
                 ]
                 unique_docs = await database.search_cache.aggregate(pipeline).to_list(None)
 
                 await database.search_cache.delete_many({})
                 if unique_docs:
-                    await database.search_cache.insert_many([
-                        {
-                            "title": doc["_id"]["title"],
-                            "page": doc["_id"]["page"],
-                            "data": doc["data"]
-                        }
-                        for doc in unique_docs
-                    ])
-                    
-                await database.search_cache.create_index([("title", 1), ("page", 1)], unique=True)
+                    await database.search_cache.insert_many([doc["doc"] for doc in unique_docs])
+
+                await database.search_cache.create_index([("title", 1), ("page", 1), ("page_size", 1)], unique=True)
                 print("search_cache index created after cleanup")
             else:
                 print(f"Warning: Could not create search_cache index: {e}")
 
+        try:
+            await database.search_leases.create_index("expires_at", expireAfterSeconds=0)
+        except Exception as e:
+            print(f"Warning: Could not create search_leases index: {e}")
+
+        try:
+            await database.books.create_index("bID", unique=True)
+            # for SEARCH_MODE local search, see services/local_search.py
+            from backend.services.local_search import TEXT_INDEX_WEIGHTS
+            await database.books.create_index(
+                [(field, "text") for field in TEXT_INDEX_WEIGHTS],
+                weights=TEXT_INDEX_WEIGHTS,
+                name="books_text"
+            )
+            # most searched first when seeding typeahead, see services/suggest.py
+            await database.books.create_index([("search_hits", -1)])
+            # cover eviction and the shard-images migration point catalog entries at new URLs by cover_id
+            await database.books.create_index("cover_id")
+        except Exception as e:
+            print(f"Warning: Could not create books index: {e}")
+
         try:
             await database.descriptions.create_index("work_id", unique=True)
         except Exception as e:
             print(f"Warning: Could not create descriptions index: {e}")
 
+        # Hard expiry for cached data, the soft TTL refresh lives in services/openbook.py
+        from backend.services.openbook import SEARCH_HARD_TTL, DESCRIPTION_HARD_TTL
+        try:
+            await ensure_ttl_index(database.search_cache, "fetched_at", SEARCH_HARD_TTL)
+            await ensure_ttl_index(database.descriptions, "fetched_at", DESCRIPTION_HARD_TTL)
+            # negative entries for missing works carry their own expiry
+            await database.descriptions.create_index("expires_at", expireAfterSeconds=0)
+        except Exception as e:
+            print(f"Warning: Could not create cache TTL indexes: {e}")
+
         try:
             await database.users.create_index("uName", unique=True)
         except Exception as e:
@@ -66,6 +115,8 @@ async def db_connect():
 
         try:
             await database.image_cache.create_index("cover_id", unique=True)
+            # LRU order for the eviction sweeper
+            await database.image_cache.create_index("last_accessed")
         except Exception as e:
             print(f"Warning: Could not create image_cache index: {e}")
 
@@ -0,0 +1,118 @@
+import asyncio
+import os
+import httpx
+
+# Pool tuning, override through env when running more workers / bigger boxes
+MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+MAX_CONNECTIONS_PER_HOST = int(os.getenv("HTTP_MAX_CONNECTIONS_PER_HOST", "20"))
+KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "10"))
+HTTP2 = os.getenv("HTTP_HTTP2", "1") == "1"
+
+client = None
+
+
+class _ReleasingStream(httpx.AsyncByteStream):
+    """Response stream that gives the host slot back once the body is closed"""
+
+    def __init__(self, stream, release):
+        self._stream = stream
+        self._release = release
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            self._release()
+
+
+class HostLimitedTransport(httpx.AsyncBaseTransport):
+    """
+    Wraps a transport and caps in-flight requests per host.
+    httpx only limits the pool as a whole, so without this one slow host
+    (covers.openlibrary.org) can eat every connection in the pool.
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, max_per_host: int):
+        self._transport = transport
+        self._max_per_host = max_per_host
+        self._semaphores: dict[str, asyncio.Semaphore] = {}
+
+    def _semaphore(self, host: str) -> asyncio.Semaphore:
+        sem = self._semaphores.get(host)
+        if sem is None:
+            sem = asyncio.Semaphore(self._max_per_host)
+            self._semaphores[host] = sem
+        return sem
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        sem = self._semaphore(request.url.host)
+        await sem.acquire()
+
+        released = False
+
+        def release():
+            nonlocal released
+            if not released:
+                released = True
+                sem.release()
+
+        try:
+            response = await self._transport.handle_async_request(request)
+        except BaseException:
+            release()
+            raise
+
+        if response.is_closed:
+            # Body was already read into memory, nothing left on the wire
+            release()
+        else:
+            response.stream = _ReleasingStream(response.stream, release)
+        return response
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+
+def create_client() -> httpx.AsyncClient:
+    limits = httpx.Limits(
+        max_connections=MAX_CONNECTIONS,
+        max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=KEEPALIVE_EXPIRY,
+    )
+    transport = HostLimitedTransport(
+        httpx.AsyncHTTPTransport(http2=HTTP2, limits=limits),
+        MAX_CONNECTIONS_PER_HOST,
+    )
+    return httpx.AsyncClient(
+        transport=transport,
+        timeout=TIMEOUT,
+        follow_redirects=True,
+    )
+
+
+def get_client() -> httpx.AsyncClient:
+    """Shared pooled client. Created lazily so scripts/tests work without the app lifespan."""
+    global client
+    if client is None:
+        client = create_client()
+    return client
+
+
+async def http_connect():
+    global client
+    client = create_client()
+    print(f"HTTP client ready (http2={HTTP2}, max_connections={MAX_CONNECTIONS})")
+
+
+async def close_http():
+    global client
+    if client:
+        await client.aclose()
+        client = None
+        print("Closed HTTP client")
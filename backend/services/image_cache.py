@@ -1,17 +1,371 @@
-import httpx
+import asyncio
 import os
+import re
+import time
+import uuid
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
 import hashlib
+from pymongo import UpdateOne
+from backend.services import http_client
+from backend.services import tasks
+from backend.services.scheduler import scheduler, ENRICHMENT
+from backend.services.util import process_pool
+
+# Pillow is optional, without it only the original JPEG is cached and served
+try:
+    from PIL import Image, features
+except ImportError:
+    Image = None
+
+# Covers are a few hundred KB, anything far bigger is not a cover
+IMAGE_MAX_BYTES = int(os.getenv("IMAGE_MAX_BYTES", str(10 * 1024 * 1024)))
+IMAGE_CHUNK_SIZE = 64 * 1024
+IMAGE_CONTENT_TYPES = ("image/jpeg", "image/png", "image/gif", "image/webp")
+# Partial downloads, renamed into place only once complete
+TEMP_SUFFIX = ".part"
+
+# Layout: {CACHE_DIR}/ab/cd/{cover_id}.jpg where abcd... is sha256(cover_id), so no directory
+# grows past a few dozen files. Identical bytes (OpenLibrary's placeholder covers) are
+# hard-linked to one copy under BLOB_DIR/ keyed by their sha256.
+CACHE_DIR = "static/images"
+BLOB_DIR = "_blobs"
+IMAGE_DEDUPE = os.getenv("IMAGE_DEDUPE", "1") == "1"
+
+# Thumbnails: {cover_id}-{size}.{format} next to the original, widths are upper bounds
+THUMB_WIDTHS = {"s": 160, "m": 320, "l": 640}
+THUMB_QUALITY = int(os.getenv("THUMB_QUALITY", "75"))
+THUMB_WORKERS = int(os.getenv("THUMB_WORKERS", "2"))
+# Best first, avif only if this Pillow build can write it
+THUMB_FORMATS = tuple(
+    f for f in os.getenv("THUMB_FORMATS", "webp").split(",")
+    if f and Image is not None and features.check(f)
+)
+THUMBNAILS_ENABLED = os.getenv("THUMBNAILS", "1") == "1" and bool(THUMB_FORMATS)
+MIME_TYPES = {"webp": "image/webp", "avif": "image/avif"}
+
+# "8739161.jpg" or "8739161-s.webp", anything else (and any path trickery) doesn't parse
+_FILENAME = re.compile(r"^(?P<cover_id>[A-Za-z0-9_]+)(?:\.jpg|-(?P<variant>[a-z]+\.(?:webp|avif)))$")
+
+
+def shard(cover_id: str) -> str:
+    """"8739161" -> "ab/cd", the first two bytes of sha256(cover_id) in hex"""
+    digest = hashlib.sha256(cover_id.encode()).hexdigest()
+    return f"{digest[:2]}/{digest[2:4]}"
+
+
+def cover_filename(cover_id: str, variant: str = None) -> str:
+    return f"{cover_id}-{variant}" if variant else f"{cover_id}.jpg"
+
+
+def cover_relpath(cover_id: str, variant: str = None) -> str:
+    return f"{shard(cover_id)}/{cover_filename(cover_id, variant)}"
+
+
+def cover_url(cover_id: str, variant: str = None) -> str:
+    return f"/static/images/{cover_relpath(cover_id, variant)}"
+
+
+def parse_filename(name: str):
+    """Returns (cover_id, variant or None), or None if name isn't a cover file"""
+    match = _FILENAME.match(name)
+    return (match["cover_id"], match["variant"]) if match else None
+
+
+def blob_path(cache_dir, digest: str) -> Path:
+    return Path(cache_dir) / BLOB_DIR / digest[:2] / digest[2:4] / digest
+
+
+def share_blob(path: Path, blob: Path) -> bool:
+    """
+    Make path and blob the same file (hard links) so identical covers are stored once.
+    Returns True if these bytes were already stored. Swaps path atomically, never
+    leaves it missing. Filesystems without hard links just keep the plain copy.
+    """
+    try:
+        blob.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            os.link(path, blob)
+            return False
+        except FileExistsError:
+            pass
+        temp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}{TEMP_SUFFIX}")
+        os.link(blob, temp_path)
+        os.replace(temp_path, path)
+        return True
+    except OSError:
+        return False
+
+
+def release_blob(blob: Path) -> bool:
+    """Delete a blob once no cover links to it any more"""
+    try:
+        if blob.stat().st_nlink <= 1:
+            blob.unlink()
+            return True
+    except FileNotFoundError:
+        pass
+    return False
+
+
+class InvalidImageError(Exception):
+    """The cover response isn't something we want on disk"""
+
+
+class CoverIndex:
+    """
+    Cover ids present in one cache directory, so a page of covers costs set lookups instead of a
+    stat() each plus a Mongo query for the misses. A plain set rather than a Bloom filter: a few
+    hundred thousand short ids is tens of MB and there are no false positives to re-check.
+    Filled once at startup by scanning the directory, then kept in step by downloads / evictions.
+    Until load() has run, `loaded` is False and callers fall back to probing disk and Mongo.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = Path(cache_dir)
+        self.loaded = False
+        self._ids: set[str] = set()
+        self._variants: dict[str, set] = {}  # cover_id -> {"s.webp", ...}
+        # covers Pillow couldn't render, not retried on every hit until the file is replaced
+        self._render_failed: set[str] = set()
+        # cover_id -> last time it was served, flushed to image_cache.last_accessed in batches
+        self._touched: dict[str, float] = {}
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+    def _scan(self) -> tuple[set, dict]:
+        ids = set()
+        variants = {}
+        for root, dirs, files in os.walk(self.cache_dir):
+            depth = len(Path(root).relative_to(self.cache_dir).parts)
+            # only ab/cd/ holds covers, flat leftovers from the old layout wait for the migration
+            dirs[:] = [d for d in dirs if d != BLOB_DIR and depth < 2]
+            if depth != 2:
+                continue
+            for name in files:
+                parsed = parse_filename(name)
+                if parsed is None:
+                    continue
+                cover_id, variant = parsed
+                if variant is None:
+                    ids.add(cover_id)
+                elif variant.split(".")[0] in THUMB_WIDTHS:
+                    variants.setdefault(cover_id, set()).add(variant)
+        return ids, variants
+
+    async def load(self) -> int:
+        """One directory scan on a thread. Writes that land meanwhile are kept."""
+        ids, variants = await asyncio.to_thread(self._scan)
+        self._ids |= ids
+        for cover_id, names in variants.items():
+            self._variants.setdefault(cover_id, set()).update(names)
+        self.loaded = True
+        return len(self._ids)
+
+    def __contains__(self, cover_id: str) -> bool:
+        return cover_id in self._ids
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def add(self, cover_id: str):
+        self._ids.add(cover_id)
+
+    def discard(self, cover_id: str):
+        self._ids.discard(cover_id)
+        self._variants.pop(cover_id, None)
+        self._render_failed.discard(cover_id)
+
+    def add_variants(self, cover_id: str, names):
+        self._variants.setdefault(cover_id, set()).update(names)
+
+    def variants(self, cover_id: str) -> set:
+        return self._variants.get(cover_id, set())
+
+    def mark_render_failed(self, cover_id: str):
+        self._render_failed.add(cover_id)
+
+    def render_failed(self, cover_id: str) -> bool:
+        return cover_id in self._render_failed
+
+    def touch(self, cover_id: str):
+        self._touched[cover_id] = time.time()
+
+    def drain_touches(self) -> dict[str, float]:
+        touched, self._touched = self._touched, {}
+        return touched
+
+    def stats(self) -> dict:
+        return {
+            "loaded": self.loaded,
+            "entries": len(self._ids),
+            "with_thumbnails": len(self._variants),
+            "render_failed": len(self._render_failed),
+            "pending_touches": len(self._touched),
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale": self.stale,
+        }
+
+
+_cover_indexes: dict[Path, CoverIndex] = {}
+
+
+def cover_index(cache_dir=CACHE_DIR) -> CoverIndex:
+    """The process-wide index for a cache directory, services come and go per request"""
+    key = Path(cache_dir).resolve()
+    index = _cover_indexes.get(key)
+    if index is None:
+        index = _cover_indexes[key] = CoverIndex(cache_dir)
+    return index
+
+
+def remove_partial_downloads(cache_dir=CACHE_DIR, min_age: float = 3600) -> int:
+    """
+    Delete temp files a crash left behind. Only old ones, another worker sharing
+    the directory may be mid-download right now.
+    """
+    removed = 0
+    cutoff = time.time() - min_age
+    for path in Path(cache_dir).rglob(f"*{TEMP_SUFFIX}"):
+        try:
+            if path.stat().st_mtime > cutoff:
+                continue
+            path.unlink()
+            removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
+
+
+def render_thumbnails(source: str, cover_id: str, widths: dict, formats: tuple, quality: int) -> dict:
+    """
+    Runs in the process pool. Writes every {cover_id}-{size}.{format} rendition next to
+    source (temp file + rename) and returns {"s.webp": bytes written, ...}.
+    """
+    directory = os.path.dirname(source)
+    written = {}
+    with Image.open(source) as original:
+        # JPEG can decode straight at a fraction of the size, much cheaper than a full decode
+        original.draft("RGB", (max(widths.values()), max(widths.values()) * 2))
+        original = original.convert("RGB")
+        for size, width in widths.items():
+            rendition = original.copy()
+            # never upscales, a small cover just gets the same size twice
+            rendition.thumbnail((width, width * 2), Image.LANCZOS)
+            for fmt in formats:
+                path = os.path.join(directory, f"{cover_id}-{size}.{fmt}")
+                temp_path = f"{path}.{os.getpid()}{TEMP_SUFFIX}"
+                rendition.save(temp_path, format=fmt.upper(), quality=quality)
+                os.replace(temp_path, path)
+                written[f"{size}.{fmt}"] = os.path.getsize(path)
+    return written
+
+
+_thumbnail_pool = None
+# cover ids being rendered right now, so a busy page doesn't queue the same cover twice
+_rendering: set[str] = set()
+
+
+def _get_thumbnail_pool() -> ProcessPoolExecutor:
+    global _thumbnail_pool
+    if _thumbnail_pool is None:
+        _thumbnail_pool = process_pool(THUMB_WORKERS)
+    return _thumbnail_pool
+
+
+def shutdown_thumbnail_pool():
+    global _thumbnail_pool
+    if _thumbnail_pool is not None:
+        _thumbnail_pool.shutdown(wait=False, cancel_futures=True)
+        _thumbnail_pool = None
+
+
+def _check_headers(response) -> int:
+    """Validates content type and length up front, returns the expected size (None if not sent)"""
+    content_type = response.headers.get("Content-Type", "").split(";")[0].strip().lower()
+    if content_type not in IMAGE_CONTENT_TYPES:
+        raise InvalidImageError(f"unexpected content type {content_type or 'none'}")
+    length = response.headers.get("Content-Length")
+    # with a Content-Encoding the length is of the encoded body, not what we write
+    if length is None or response.headers.get("Content-Encoding", "identity") != "identity":
+        return None
+    try:
+        length = int(length)
+    except ValueError:
+        raise InvalidImageError(f"bad Content-Length {length}")
+    if length <= 0 or length > IMAGE_MAX_BYTES:
+        raise InvalidImageError(f"Content-Length {length} out of range")
+    return length
+
+
+def _commit(f, temp_path: Path, cache_path: Path, blob: Path = None):
+    """fsync the temp file, then atomically swap it in, readers never see a half-written cover"""
+    f.flush()
+    os.fsync(f.fileno())
+    f.close()
+    os.replace(temp_path, cache_path)
+    if blob is not None:
+        share_blob(cache_path, blob)
+    # make the rename itself durable, not available everywhere (Windows)
+    try:
+        fd = os.open(cache_path.parent, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _discard(f, temp_path: Path):
+    f.close()
+    try:
+        temp_path.unlink()
+    except FileNotFoundError:
+        pass
 
 class ImageCacheService:
-    def __init__(self, db, cache_dir="static/images"):
+    def __init__(self, db, cache_dir=CACHE_DIR, client=None):
         self.db = db
+        self.client = client or http_client.get_client()
         self.cache_dir = Path(cache_dir)
         self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.index = cover_index(self.cache_dir)
 
     def _get_cache_path(self, cover_id: str) -> Path:
         """Generate local file path for cached image"""
-        return self.cache_dir / f"{cover_id}.jpg"
+        return self.cache_dir / cover_relpath(cover_id)
+
+    def _local_url(self, cover_id: str) -> str:
+        return cover_url(cover_id)
+
+    def touch(self, cover_id: str):
+        """Mark a cover as just served, for LRU eviction"""
+        if cover_id:
+            self.index.touch(cover_id)
+
+    def srcset(self, cover_id: str) -> list[dict]:
+        """The cached renditions of a cover, best format first and smallest first within it"""
+        names = self.index.variants(cover_id) if cover_id else ()
+        variants = []
+        for fmt in sorted(MIME_TYPES, key=lambda f: f != "avif"):
+            for size, width in THUMB_WIDTHS.items():
+                if f"{size}.{fmt}" in names:
+                    variants.append({
+                        "url": cover_url(cover_id, f"{size}.{fmt}"),
+                        "width": width,
+                        "type": MIME_TYPES[fmt],
+                    })
+        return variants
+
+    def _original_url(self, cover_id: str) -> str:
+        return f"https://covers.openlibrary.org/b/id/{cover_id}-L.jpg"
 
     async def get_image_url(self, cover_id: str, base_url: str) -> str:
         """
@@ -21,64 +375,230 @@ class ImageCacheService:
         if not cover_id:
             return ""
 
-        cache_path = self._get_cache_path(cover_id)
+        urls = await self.get_image_urls([cover_id])
+        return urls[cover_id]
+
+    async def get_image_urls(self, cover_ids: list[str], priority: int = ENRICHMENT) -> dict[str, str]:
+        """
+        Batched version of get_image_url: one image_cache query for everything not on disk,
+        downloads only the real misses and writes their metadata back in one bulk write.
+        """
+        found, missing = await self.lookup_images(cover_ids)
+        if not missing:
+            return found
+
+        downloads = await asyncio.gather(*[self.download_image(cid, priority=priority) for cid in missing])
+
+        docs = []
+        for cid, (url, doc) in zip(missing, downloads):
+            found[cid] = url
+            if doc:
+                docs.append(doc)
+        await self.store_images(docs)
+
+        return found
+
+    async def lookup_images(self, cover_ids: list[str]) -> tuple[dict[str, str], list[str]]:
+        """Returns ({cover_id: url} for cached covers, [cover_ids that need downloading])"""
+        cover_ids = list(dict.fromkeys(cid for cid in cover_ids if cid))
+        if self.index.loaded:
+            return self._lookup_indexed(cover_ids)
 
+        found = {}
+        not_on_disk = []
         # Check if image is already cached locally
-        if cache_path.exists():
-            return f"/static/images/{cover_id}.jpg"
+        for cid in cover_ids:
+            if self._get_cache_path(cid).exists():
+                found[cid] = self._local_url(cid)
+                self.index.touch(cid)
+            else:
+                not_on_disk.append(cid)
 
-        # Check database cache
-        cached = await self.db.image_cache.find_one({"cover_id": cover_id})
-        if cached and cached.get("local_path"):
-            local_path = Path(cached["local_path"])
-            if local_path.exists():
-                return f"/static/images/{cover_id}.jpg"
+        if not not_on_disk:
+            return found, []
 
-        # Download and cache image
-        try:
-            original_url = f"https://covers.openlibrary.org/b/id/{cover_id}-L.jpg"
-            async with httpx.AsyncClient(timeout=10.0) as client:
-                response = await client.get(original_url)
-                response.raise_for_status()
+        # Check database cache, all at once
+        cursor = self.db.image_cache.find(
+            {"cover_id": {"$in": not_on_disk}},
+            {"cover_id": 1, "local_path": 1}
+        )
+        async for cached in cursor:
+            local_path = cached.get("local_path")
+            if local_path and Path(local_path).exists():
+                cid = cached["cover_id"]
+                # not migrated yet, the legacy URL route still finds it in the flat layout
+                sharded = Path(local_path) == self._get_cache_path(cid)
+                found[cid] = self._local_url(cid) if sharded else f"/static/images/{cover_filename(cid)}"
 
-                # Save to local file
-                cache_path.write_bytes(response.content)
+        return found, [cid for cid in not_on_disk if cid not in found]
 
-                # Save metadata to database
-                await self.db.image_cache.insert_one({
-                    "cover_id": cover_id,
-                    "local_path": str(cache_path),
-                    "original_url": original_url,
-                    "size_bytes": len(response.content)
-                })
+    def _lookup_indexed(self, cover_ids: list[str]) -> tuple[dict[str, str], list[str]]:
+        """Misses are a set probe, only hits touch the disk to confirm the file is still there"""
+        found = {}
+        missing = []
+        for cid in cover_ids:
+            if cid in self.index:
+                if self._get_cache_path(cid).exists():
+                    self.index.hits += 1
+                    self.index.touch(cid)
+                    found[cid] = self._local_url(cid)
+                    if not self.index.variants(cid):
+                        # cached before thumbnails existed (or Pillow was added later)
+                        self._queue_thumbnails(cid)
+                    continue
+                # deleted behind our back (by hand, another worker's eviction)
+                self.index.stale += 1
+                self.index.discard(cid)
+            self.index.misses += 1
+            missing.append(cid)
+        return found, missing
+
+    async def download_image(self, cover_id: str, priority: int = ENRICHMENT) -> tuple[str, dict]:
+        """
+        Download and save one cover. Returns (url, metadata doc to store),
+        or (original url, None) if it couldn't be cached.
+        """
+        original_url = self._original_url(cover_id)
+        try:
+            cache_path = self._get_cache_path(cover_id)
+            if self.index.loaded and await asyncio.to_thread(cache_path.exists):
+                # another worker downloaded it since our scan, one stat() beats a download
+                self.index.add(cover_id)
+                return self._local_url(cover_id), None
+            # the slot is held while the body streams, so slow covers can't pile up past the limit
+            async with scheduler.stream(self.client, "GET", original_url, priority=priority) as response:
+                response.raise_for_status()
+                size, digest = await self._save_stream(response, cache_path)
+            self.index.add(cover_id)
 
-                return f"/static/images/{cover_id}.jpg"
+            doc = {
+                "cover_id": cover_id,
+                "local_path": str(cache_path),
+                "original_url": original_url,
+                "size_bytes": size,
+                "content_hash": digest,
+                "last_accessed": datetime.utcnow()
+            }
+            # the JPEG is servable now, the renditions land in image_cache when they're done
+            self._queue_thumbnails(cover_id)
+            return self._local_url(cover_id), doc
 
         except Exception as e:
             print(f"Failed to cache image {cover_id}: {e}")
             # Return original URL as fallback
-            return f"https://covers.openlibrary.org/b/id/{cover_id}-L.jpg"
+            return original_url, None
 
-    async def batch_cache_images(self, cover_ids: list[str]) -> dict[str, str]:
+    async def _save_stream(self, response, cache_path: Path) -> tuple[int, str]:
         """
-        Cache multiple images in parallel and return mapping of cover_id to URL.
+        Streams the body into a temp file next to cache_path, all file IO on a thread so a
+        big cover doesn't stall the event loop. Only a complete, validated file is renamed in.
+        Returns (size, sha256 of the body).
         """
-        import asyncio
+        expected = _check_headers(response)
+        await asyncio.to_thread(cache_path.parent.mkdir, parents=True, exist_ok=True)
+        temp_path = cache_path.with_name(f"{cache_path.name}.{uuid.uuid4().hex}{TEMP_SUFFIX}")
+        f = await asyncio.to_thread(open, temp_path, "wb")
+        digest = hashlib.sha256()
 
-        # Filter out empty/None cover_ids
-        valid_ids = [cid for cid in cover_ids if cid]
+        def write(chunk):
+            f.write(chunk)
+            digest.update(chunk)
 
-        # Get URLs for all images (will cache if needed)
-        tasks = [self.get_image_url(cid, None) for cid in valid_ids]
-        urls = await asyncio.gather(*tasks, return_exceptions=True)
+        try:
+            size = 0
+            async for chunk in response.aiter_bytes(IMAGE_CHUNK_SIZE):
+                size += len(chunk)
+                if size > IMAGE_MAX_BYTES:
+                    raise InvalidImageError(f"body over {IMAGE_MAX_BYTES} bytes")
+                await asyncio.to_thread(write, chunk)
+            if size == 0 or (expected is not None and size != expected):
+                raise InvalidImageError(f"got {size} bytes, expected {expected}")
+            blob = blob_path(self.cache_dir, digest.hexdigest()) if IMAGE_DEDUPE else None
+            await asyncio.to_thread(_commit, f, temp_path, cache_path, blob)
+        except BaseException:
+            await asyncio.to_thread(_discard, f, temp_path)
+            raise
+        return size, digest.hexdigest()
 
-        # Build mapping
-        result = {}
-        for i, cid in enumerate(valid_ids):
-            if not isinstance(urls[i], Exception):
-                result[cid] = urls[i]
-            else:
-                # Fallback to original URL
-                result[cid] = f"https://covers.openlibrary.org/b/id/{cid}-L.jpg"
+    def _queue_thumbnails(self, cover_id: str):
+        """Render in the background unless it's underway or already failed for this file"""
+        if not THUMBNAILS_ENABLED or cover_id in _rendering or self.index.render_failed(cover_id):
+            return
+        _rendering.add(cover_id)
+        tasks.spawn(self._backfill_thumbnails(cover_id), name=f"thumbnails:{cover_id}")
+
+    async def make_thumbnails(self, cover_id: str) -> dict:
+        """Renders the thumbnails in the process pool, {} if that fails (the JPEG is still served)"""
+        loop = asyncio.get_running_loop()
+        try:
+            rendered = await loop.run_in_executor(
+                _get_thumbnail_pool(), render_thumbnails,
+                str(self._get_cache_path(cover_id)), cover_id, THUMB_WIDTHS, THUMB_FORMATS, THUMB_QUALITY
+            )
+        except BrokenProcessPool as e:
+            # a worker died, not this cover's fault: start a fresh pool and let a later hit retry
+            print(f"Thumbnail pool broke rendering {cover_id}: {e}")
+            shutdown_thumbnail_pool()
+            return {}
+        except Exception as e:
+            print(f"Failed to render thumbnails for {cover_id}: {e}")
+            self.index.mark_render_failed(cover_id)
+            return {}
+        self.index.add_variants(cover_id, rendered)
+        return rendered
+
+    async def _backfill_thumbnails(self, cover_id: str):
+        """
+        Render in the background and record the renditions. size_bytes covers everything on
+        disk for the cover, thumbnail_bytes is the renditions' share of it, so this can land
+        before or after store_images and a re-render replaces the old share instead of adding.
+        """
+        try:
+            rendered = await self.make_thumbnails(cover_id)
+            if rendered:
+                thumbnail_bytes = sum(rendered.values())
+                await self.db.image_cache.update_one(
+                    {"cover_id": cover_id},
+                    [{"$set": {
+                        "variants": sorted(rendered),
+                        "thumbnail_bytes": thumbnail_bytes,
+                        "size_bytes": {"$add": [
+                            {"$subtract": [{"$ifNull": ["$size_bytes", 0]}, {"$ifNull": ["$thumbnail_bytes", 0]}]},
+                            thumbnail_bytes
+                        ]}
+                    }}],
+                    upsert=True
+                )
+        finally:
+            _rendering.discard(cover_id)
 
-        return result
+    async def store_images(self, docs: list[dict]):
+        """Save metadata for freshly downloaded covers in a single bulk upsert"""
+        if not docs:
+            return
+        await self.db.image_cache.bulk_write(
+            [
+                UpdateOne(
+                    {"cover_id": doc["cover_id"]},
+                    # thumbnails rendered before this write already counted theirs
+                    [{"$set": {
+                        **{k: {"$literal": v} for k, v in doc.items() if k != "size_bytes"},
+                        "size_bytes": {"$add": [doc.get("size_bytes") or 0, {"$ifNull": ["$thumbnail_bytes", 0]}]}
+                    }}],
+                    upsert=True
+                )
+                for doc in docs
+            ],
+            ordered=False
+        )
+
+    async def batch_cache_images(self, cover_ids: list[str], priority: int = ENRICHMENT) -> dict[str, str]:
+        """
+        Cache multiple images in parallel and return mapping of cover_id to URL.
+        """
+        try:
+            return await self.get_image_urls(cover_ids, priority)
+        except Exception as e:
+            print(f"Failed to batch cache images: {e}")
+            # Fallback to original URLs
+            return {cid: self._original_url(cid) for cid in cover_ids if cid}
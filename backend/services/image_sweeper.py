@@ -0,0 +1,145 @@
+"""
+Keeps static/images under a byte budget. Every IMAGE_SWEEP_INTERVAL seconds each worker
+flushes the covers it served to image_cache.last_accessed, then one worker (behind a lease)
+adds up image_cache.size_bytes and, past IMAGE_CACHE_MAX_BYTES, deletes the least recently
+used covers down to IMAGE_CACHE_LOW_WATER of the budget. Files go first, metadata after,
+so a crash in between leaves metadata pointing at nothing (harmless), never untracked files.
+"""
+import asyncio
+import os
+from datetime import datetime
+from pathlib import Path
+from pymongo import UpdateOne
+from backend.services.image_cache import cover_index, cover_relpath, blob_path, release_blob, CACHE_DIR
+from backend.services.singleflight import MongoLease
+
+IMAGE_CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+# Evict down to this fraction of the budget so we don't sweep again right away
+IMAGE_CACHE_LOW_WATER = float(os.getenv("IMAGE_CACHE_LOW_WATER", "0.9"))
+IMAGE_SWEEP_INTERVAL = float(os.getenv("IMAGE_SWEEP_INTERVAL", "300"))
+IMAGE_SWEEP_BATCH = int(os.getenv("IMAGE_SWEEP_BATCH", "500"))
+
+SWEEP_LEASE_KEY = "image-cache-sweep"
+
+sweep_stats = {"sweeps": 0, "evicted": 0, "freed_bytes": 0, "touches_flushed": 0, "last_total_bytes": None}
+
+
+def _delete_files(paths: list, blobs: list) -> int:
+    removed = 0
+    for path in paths:
+        try:
+            os.remove(path)
+            removed += 1
+        except FileNotFoundError:
+            pass
+    # a placeholder shared by other covers stays until the last of them goes
+    for blob in blobs:
+        release_blob(blob)
+    return removed
+
+
+class ImageCacheSweeper:
+    def __init__(self, database, cache_dir=CACHE_DIR, max_bytes: int = IMAGE_CACHE_MAX_BYTES,
+                 low_water: float = IMAGE_CACHE_LOW_WATER, batch_size: int = IMAGE_SWEEP_BATCH):
+        self.db = database
+        self.cache_dir = Path(cache_dir)
+        self.index = cover_index(cache_dir)
+        self.max_bytes = max_bytes
+        self.low_water = low_water
+        self.batch_size = batch_size
+        self.lease = MongoLease(database.search_leases, ttl=IMAGE_SWEEP_INTERVAL)
+
+    async def run_forever(self, interval: float = IMAGE_SWEEP_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                # a Mongo hiccup shouldn't end the loop for good
+                print(f"Image cache sweep failed: {e}")
+
+    async def sweep(self) -> dict:
+        await self.flush_touches()
+        if not await self.lease.acquire(SWEEP_LEASE_KEY):
+            return {"evicted": 0, "freed_bytes": 0, "skipped": True}
+        try:
+            return await self.evict()
+        finally:
+            await self.lease.release(SWEEP_LEASE_KEY)
+
+    async def flush_touches(self) -> int:
+        """One unordered bulk write for everything served since the last flush"""
+        touched = self.index.drain_touches()
+        if not touched:
+            return 0
+        await self.db.image_cache.bulk_write(
+            [
+                # $max so a late flush from another worker can't move last_accessed back
+                UpdateOne({"cover_id": cid}, {"$max": {"last_accessed": datetime.utcfromtimestamp(at)}})
+                for cid, at in touched.items()
+            ],
+            ordered=False
+        )
+        sweep_stats["touches_flushed"] += len(touched)
+        return len(touched)
+
+    async def total_bytes(self) -> int:
+        cursor = self.db.image_cache.aggregate([{"$group": {"_id": None, "total": {"$sum": "$size_bytes"}}}])
+        async for row in cursor:
+            return row["total"]
+        return 0
+
+    async def evict(self) -> dict:
+        sweep_stats["sweeps"] += 1
+        total = await self.total_bytes()
+        sweep_stats["last_total_bytes"] = total
+        if total <= self.max_bytes:
+            return {"evicted": 0, "freed_bytes": 0}
+
+        target = self.max_bytes * self.low_water
+        evicted = freed = 0
+        # never touched (null last_accessed) sorts first, those go before anything recently used
+        cursor = self.db.image_cache.find(
+            {}, {"cover_id": 1, "local_path": 1, "size_bytes": 1, "variants": 1, "content_hash": 1}
+        ).sort([("last_accessed", 1)])
+
+        batch = []
+        async for doc in cursor:
+            batch.append(doc)
+            total -= doc.get("size_bytes") or 0
+            if len(batch) >= self.batch_size or total <= target:
+                evicted += len(batch)
+                freed += await self._evict_batch(batch)
+                batch = []
+            if total <= target:
+                break
+        if batch:
+            evicted += len(batch)
+            freed += await self._evict_batch(batch)
+
+        sweep_stats["evicted"] += evicted
+        sweep_stats["freed_bytes"] += freed
+        print(f"Image cache: evicted {evicted} covers, freed {freed} bytes")
+        return {"evicted": evicted, "freed_bytes": freed}
+
+    async def _evict_batch(self, docs: list) -> int:
+        cover_ids = [doc["cover_id"] for doc in docs]
+        paths = []
+        blobs = []
+        for doc in docs:
+            original = Path(doc.get("local_path") or self.cache_dir / cover_relpath(doc["cover_id"]))
+            paths.append(original)
+            if doc.get("content_hash"):
+                blobs.append(blob_path(self.cache_dir, doc["content_hash"]))
+            for name in doc.get("variants") or []:
+                paths.append(original.with_name(f"{doc['cover_id']}-{name}"))
+            self.index.discard(doc["cover_id"])
+
+        await asyncio.to_thread(_delete_files, paths, blobs)
+        await self.db.image_cache.delete_many({"cover_id": {"$in": cover_ids}})
+        # catalog entries pointed at the local copy, send them back to OpenLibrary's
+        await self.db.books.update_many(
+            {"cover_id": {"$in": cover_ids}, "image": {"$regex": "^/static/images/"}},
+            [{"$set": {"image": {"$concat": ["https://covers.openlibrary.org/b/id/", "$cover_id", "-L.jpg"]}}}]
+        )
+        return sum(doc.get("size_bytes") or 0 for doc in docs)
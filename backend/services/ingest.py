@@ -0,0 +1,324 @@
+"""
+Offline bulk load of OpenLibrary data dumps (https://openlibrary.org/developers/dumps)
+into the books catalog and the descriptions cache. Run from the repo root, e.g.
+
+    python -m backend.services.ingest \
+        --authors ol_dump_authors_latest.txt.gz \
+        --works ol_dump_works_latest.txt.gz \
+        --editions ol_dump_editions_latest.txt.gz
+
+Files are read as gzip streams line by line, parsed in a process pool and written in
+large unordered bulk upserts. Progress is checkpointed per file in Mongo so an
+interrupted run picks up where it stopped (--restart ignores the checkpoints).
+Authors go first so works can resolve author names, editions last to fill in missing
+publish years and covers.
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import re
+import time
+from collections import deque
+from datetime import datetime
+from pymongo import UpdateOne
+from backend.services import db
+from backend.services.openbook import DUMP_SOURCE
+from backend.services.util import process_pool, split_author
+
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "5000"))
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", str(os.cpu_count() or 2)))
+# Seconds between progress lines
+INGEST_REPORT_EVERY = float(os.getenv("INGEST_REPORT_EVERY", "10"))
+
+KINDS = ("authors", "works", "editions")
+
+# Four digits without a leading zero, so placeholder dates like "0000" are no year at all
+_YEAR = re.compile(r"\b([1-9]\d{3})\b")
+
+
+def _key_id(key: str) -> str:
+    """"/works/OL45804W" -> "OL45804W" """
+    return (key or "").rstrip("/").split("/")[-1]
+
+
+def _year(value) -> int:
+    match = _YEAR.search(value or "")
+    return int(match.group(1)) if match else None
+
+
+def _text(value) -> str:
+    """Dump text fields are either a plain string or {"type": "/type/text", "value": ...}"""
+    if isinstance(value, dict):
+        value = value.get("value")
+    return value if isinstance(value, str) else ""
+
+
+def parse_author(record: dict):
+    name = record.get("name") or record.get("personal_name")
+    if not name:
+        return None
+    return {"_id": _key_id(record["key"]), "name": name}
+
+
+def parse_work(record: dict):
+    title = record.get("title")
+    if not title:
+        return None
+
+    author_keys = []
+    for author in record.get("authors") or []:
+        key = (author.get("author") or {}).get("key") if isinstance(author, dict) else None
+        if key:
+            author_keys.append(_key_id(key))
+
+    subjects = record.get("subjects") or []
+    covers = [c for c in record.get("covers") or [] if isinstance(c, int) and c > 0]
+
+    return {
+        "bID": _key_id(record["key"]),
+        "title": title,
+        "date": _year(record.get("first_publish_date")),
+        "genre": subjects[0] if subjects and isinstance(subjects[0], str) else "",
+        "cover_id": str(covers[0]) if covers else None,
+        "author_key": author_keys[0] if author_keys else None,
+        "description": _text(record.get("description")),
+    }
+
+
+def parse_edition(record: dict):
+    works = record.get("works") or []
+    if not works or not isinstance(works[0], dict) or not works[0].get("key"):
+        return None
+    covers = [c for c in record.get("covers") or [] if isinstance(c, int) and c > 0]
+    year = _year(record.get("publish_date"))
+    if year is None and not covers:
+        return None
+    return {
+        "bID": _key_id(works[0]["key"]),
+        "date": year,
+        "cover_id": str(covers[0]) if covers else None,
+    }
+
+
+PARSERS = {"authors": parse_author, "works": parse_work, "editions": parse_edition}
+
+
+def parse_chunk(kind: str, lines: list) -> list:
+    """
+    Runs in the process pool. Dump rows are tab separated:
+    type, key, revision, last_modified, JSON. Bad rows are skipped.
+    """
+    parse = PARSERS[kind]
+    rows = []
+    for line in lines:
+        try:
+            record = json.loads(line.rsplit("\t", 1)[-1])
+            row = parse(record)
+        except (ValueError, KeyError, TypeError, AttributeError):
+            continue
+        if row is not None:
+            rows.append(row)
+    return rows
+
+
+def read_chunks(path: str, batch_size: int, skip: int = 0):
+    """
+    Yields (lines read so far, [lines]) from a gzipped dump without loading it.
+    The first `skip` lines are read past, gzip can't seek so resuming still decompresses them.
+    """
+    opener = gzip.open if path.endswith(".gz") else open
+    read = 0
+    chunk = []
+    with opener(path, "rt", encoding="utf-8", errors="replace") as f:
+        for line in f:
+            read += 1
+            if read <= skip:
+                continue
+            chunk.append(line)
+            if len(chunk) >= batch_size:
+                yield read, chunk
+                chunk = []
+    if chunk:
+        yield read, chunk
+
+
+class Ingestor:
+    def __init__(self, database, executor, batch_size: int = INGEST_BATCH_SIZE,
+                 max_pending: int = None, report_every: float = INGEST_REPORT_EVERY):
+        self.db = database
+        self.executor = executor
+        self.batch_size = batch_size
+        # parsed chunks waiting to be written, bounds memory to a few batches
+        self.max_pending = max_pending or getattr(executor, "_max_workers", 4) * 2
+        self.report_every = report_every
+
+    async def run(self, kind: str, path: str, restart: bool = False) -> dict:
+        # size in the id so next month's "..._latest" dump doesn't count as done
+        checkpoint_id = f"{kind}:{os.path.basename(path)}:{os.path.getsize(path)}"
+        checkpoint = None if restart else await self.db.ingest_checkpoints.find_one({"_id": checkpoint_id})
+        if checkpoint and checkpoint.get("done"):
+            print(f"{kind}: {path} already ingested, skipping (--restart to redo)")
+            return {"kind": kind, "lines": checkpoint["lines"], "rows": 0, "skipped": True}
+
+        skip = checkpoint["lines"] if checkpoint else 0
+        if skip:
+            print(f"{kind}: resuming {path} after line {skip}")
+
+        loop = asyncio.get_running_loop()
+        pending = deque()
+        rows = 0
+        lines = skip
+        started = time.monotonic()
+        last_report = started
+
+        async def drain_one():
+            nonlocal rows, lines, last_report
+            read, future = pending.popleft()
+            parsed = await future
+            await self._write(kind, parsed)
+            rows += len(parsed)
+            lines = read
+            # only ever checkpoint a prefix of the file that is fully written
+            await self.db.ingest_checkpoints.update_one(
+                {"_id": checkpoint_id},
+                {"$set": {"lines": lines, "done": False, "updated_at": datetime.utcnow()}},
+                upsert=True
+            )
+            now = time.monotonic()
+            if now - last_report >= self.report_every:
+                print(f"{kind}: {lines} lines, {rows} rows, {rows / (now - started):.0f} rows/s")
+                last_report = now
+
+        # the gzip stream is read on a thread so the event loop keeps writing meanwhile
+        chunks = read_chunks(path, self.batch_size, skip)
+        while True:
+            item = await loop.run_in_executor(None, next, chunks, None)
+            if item is None:
+                break
+            read, chunk = item
+            pending.append((read, loop.run_in_executor(self.executor, parse_chunk, kind, chunk)))
+            if len(pending) >= self.max_pending:
+                await drain_one()
+
+        while pending:
+            await drain_one()
+
+        await self.db.ingest_checkpoints.update_one(
+            {"_id": checkpoint_id},
+            {"$set": {"lines": lines, "done": True, "updated_at": datetime.utcnow()}},
+            upsert=True
+        )
+        elapsed = max(time.monotonic() - started, 1e-9)
+        print(f"{kind}: done, {lines} lines, {rows} rows in {elapsed:.0f}s ({rows / elapsed:.0f} rows/s)")
+        return {"kind": kind, "lines": lines, "rows": rows, "rows_per_sec": rows / elapsed}
+
+    async def _write(self, kind: str, rows: list):
+        if not rows:
+            return
+        if kind == "authors":
+            await self._write_authors(rows)
+        elif kind == "works":
+            await self._write_works(rows)
+        else:
+            await self._write_editions(rows)
+
+    async def _write_authors(self, rows: list):
+        await self.db.authors.bulk_write(
+            [UpdateOne({"_id": row["_id"]}, {"$set": {"name": row["name"]}}, upsert=True) for row in rows],
+            ordered=False
+        )
+
+    async def _write_works(self, rows: list):
+        # one $in per batch instead of keeping every author name in memory
+        author_keys = list({row["author_key"] for row in rows if row["author_key"]})
+        names = {}
+        if author_keys:
+            async for author in self.db.authors.find({"_id": {"$in": author_keys}}):
+                names[author["_id"]] = author["name"]
+
+        now = datetime.utcnow()
+        books = []
+        descriptions = []
+        for row in rows:
+            authorF, authorL = split_author(names.get(row["author_key"], ""))
+            book = {
+                "bID": row["bID"],
+                "title": row["title"],
+                "authorF": authorF,
+                "authorL": authorL,
+                "genre": row["genre"],
+                "updated_at": now,
+            }
+            # an image a search already cached stays, ingest never knows local URLs
+            on_insert = {"image": ""}
+            # don't wipe what a search or an earlier editions pass already filled in
+            for field, value, empty in (
+                ("date", row["date"], None),
+                ("cover_id", row["cover_id"], None),
+                ("sypnosis", row["description"], "No Description Available"),
+            ):
+                if value:
+                    book[field] = value
+                else:
+                    on_insert[field] = empty
+            books.append(UpdateOne({"bID": row["bID"]}, {"$set": book, "$setOnInsert": on_insert}, upsert=True))
+
+            # cached even when empty, so get_description_cached doesn't go upstream for it.
+            # No fetched_at: dump text is neither revalidated nor hard-expired (see lookup_descriptions),
+            # and it replaces any negative entry left by an earlier upstream 404
+            descriptions.append(UpdateOne(
+                {"work_id": row["bID"]},
+                {
+                    "$set": {"description": row["description"], "source": DUMP_SOURCE, "ingested_at": now},
+                    "$unset": {"fetched_at": "", "missing": "", "expires_at": ""}
+                },
+                upsert=True
+            ))
+
+        await asyncio.gather(
+            self.db.books.bulk_write(books, ordered=False),
+            self.db.descriptions.bulk_write(descriptions, ordered=False)
+        )
+
+    async def _write_editions(self, rows: list):
+        # Editions only fill in what the work doesn't have: a year and a cover.
+        # Conditional updates rather than upserts, an edition never creates a book.
+        operations = []
+        for row in rows:
+            if row["date"] is not None:
+                operations.append(UpdateOne({"bID": row["bID"], "date": None}, {"$set": {"date": row["date"]}}))
+            if row["cover_id"]:
+                operations.append(UpdateOne({"bID": row["bID"], "cover_id": None}, {"$set": {"cover_id": row["cover_id"]}}))
+        if operations:
+            await self.db.books.bulk_write(operations, ordered=False)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Load OpenLibrary dumps into the local catalog")
+    for kind in KINDS:
+        parser.add_argument(f"--{kind}", help=f"path to the {kind} dump (.txt.gz)")
+    parser.add_argument("--workers", type=int, default=INGEST_WORKERS)
+    parser.add_argument("--batch-size", type=int, default=INGEST_BATCH_SIZE)
+    parser.add_argument("--restart", action="store_true", help="ignore checkpoints and start over")
+    args = parser.parse_args()
+
+    files = [(kind, getattr(args, kind)) for kind in KINDS if getattr(args, kind)]
+    if not files:
+        parser.error("nothing to ingest, pass at least one of --authors / --works / --editions")
+
+    if not await db.db_connect():
+        return
+
+    try:
+        with process_pool(args.workers) as executor:
+            ingestor = Ingestor(db.database, executor, batch_size=args.batch_size)
+            for kind, path in files:
+                print(await ingestor.run(kind, path, restart=args.restart))
+    finally:
+        await db.close_db()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
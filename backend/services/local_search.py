@@ -0,0 +1,72 @@
+import os
+from backend.services.memory_cache import TTLCache
+from backend.services.util import text_search
+from backend.services.refine import catalog_pipeline, facet_counts
+
+# Where /books/{book_name} gets its results on a search_cache miss:
+#   upstream_first  OpenLibrary, the local catalog only if that fails (default)
+#   local_first     the local catalog, OpenLibrary only if it has nothing
+#   race            both at once, first non-empty answer wins, OpenLibrary still fills the cache
+SEARCH_MODES = ("upstream_first", "local_first", "race")
+SEARCH_MODE = os.getenv("SEARCH_MODE", "upstream_first")
+if SEARCH_MODE not in SEARCH_MODES:
+    raise ValueError(f"SEARCH_MODE must be one of {', '.join(SEARCH_MODES)}, got {SEARCH_MODE!r}")
+
+# Catalog changes all the time (searches, ingest), keep local answers only briefly
+LOCAL_MEMORY_MAX_ENTRIES = int(os.getenv("LOCAL_SEARCH_MEMORY_MAX_ENTRIES", "1024"))
+LOCAL_MEMORY_TTL = float(os.getenv("LOCAL_SEARCH_MEMORY_TTL", "60"))
+
+# Relative weights of the fields in the books text index, see db_connect
+TEXT_INDEX_WEIGHTS = {"title": 10, "authorL": 3, "authorF": 1}
+
+local_memory = TTLCache(max_entries=LOCAL_MEMORY_MAX_ENTRIES, ttl=LOCAL_MEMORY_TTL)
+local_stats = {"searches": 0, "empty": 0, "errors": 0, "served": 0}
+
+
+async def search_catalog(db, book_title: str, page: int, page_size: int) -> tuple[int, list]:
+    """
+    Full-text search over the books catalog with Mongo's text index, ranked by textScore.
+    Returns (count, books) in the same shape _search_upstream produces.
+    """
+    query = {"$text": {"$search": text_search(book_title)}}
+    projection = {"_id": 0, "updated_at": 0, "search_hits": 0, "score": {"$meta": "textScore"}}
+
+    local_stats["searches"] += 1
+    cursor = (
+        db.books.find(query, projection)
+        .sort([("score", {"$meta": "textScore"})])
+        .skip((page - 1) * page_size)
+        .limit(page_size)
+    )
+    books = []
+    async for book in cursor:
+        book.pop("score", None)
+        books.append(book)
+
+    if not books:
+        local_stats["empty"] += 1
+        return 0, []
+
+    if page == 1 and len(books) < page_size:
+        count = len(books)
+    else:
+        count = await db.books.count_documents(query)
+    return count, books
+
+
+async def refine_catalog(db, book_title: str, page: int, page_size: int, filters: dict, sort: tuple,
+                         facets: tuple) -> tuple[int, list, dict]:
+    """
+    Filtered / sorted / faceted search over the whole catalog in one aggregation.
+    Returns (filtered total, the page of books, facet counts).
+    """
+    local_stats["searches"] += 1
+    cursor = db.books.aggregate(catalog_pipeline(book_title, filters, sort, facets, page, page_size))
+    row = {}
+    async for row in cursor:
+        break
+
+    total = row.get("total") or [{"n": 0}]
+    if not total[0]["n"]:
+        local_stats["empty"] += 1
+    return total[0]["n"], row.get("results", []), facet_counts(row, facets)
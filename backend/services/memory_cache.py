@@ -0,0 +1,101 @@
+import json
+import time
+from collections import OrderedDict
+
+
+def estimate_size(value) -> int:
+    """Rough byte size of a JSON-ish value, good enough for budgeting"""
+    return len(json.dumps(value, default=str))
+
+
+class TTLCache:
+    """
+    In-process cache with a TTL and LRU eviction bounded by entry count and byte size.
+    Not shared between workers, so keep the TTL short enough that staleness doesn't matter.
+    """
+
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 64 * 1024 * 1024, ttl: float = 300.0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+
+        # key -> (expires_at, size, value), oldest first
+        self._data: OrderedDict = OrderedDict()
+        self.bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        entry = self._data.get(key)
+        return entry is not None and entry[0] > time.monotonic()
+
+    def get(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+
+        expires_at, _, value = entry
+        if expires_at <= time.monotonic():
+            self._remove(key)
+            self.misses += 1
+            return default
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl: float = None, size: int = None):
+        if size is None:
+            size = estimate_size(value)
+        if size > self.max_bytes:
+            # would just evict everything else and then itself
+            return
+
+        if key in self._data:
+            self._remove(key)
+
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        self._data[key] = (expires_at, size, value)
+        self.bytes += size
+
+        while len(self._data) > self.max_entries or self.bytes > self.max_bytes:
+            oldest = next(iter(self._data))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def invalidate(self, key=None, predicate=None) -> int:
+        """Drop one key, every key matching predicate(key), or everything if neither is given."""
+        if key is not None:
+            if key in self._data:
+                self._remove(key)
+                return 1
+            return 0
+
+        keys = [k for k in self._data if predicate is None or predicate(k)]
+        for k in keys:
+            self._remove(k)
+        return len(keys)
+
+    def _remove(self, key):
+        _, size, _ = self._data.pop(key)
+        self.bytes -= size
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._data),
+            "bytes": self.bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+        }
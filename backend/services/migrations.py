@@ -0,0 +1,169 @@
+"""
+One-off data migrations. Run from the repo root, e.g.
+
+    python -m backend.services.migrations merge-search-cache
+    python -m backend.services.migrations normalize-search-cache
+    python -m backend.services.migrations shard-images
+"""
+import argparse
+import asyncio
+import hashlib
+import os
+from datetime import datetime
+from pathlib import Path
+from pymongo import UpdateOne, UpdateMany
+from backend.services import db
+from backend.services.image_cache import (
+    CACHE_DIR, IMAGE_DEDUPE, blob_path, cover_relpath, cover_url, parse_filename, share_blob
+)
+from backend.services.util import canonical_query
+
+
+async def merge_search_cache_duplicates(database) -> dict:
+    """
+    Re-key search_cache on canonical_query() titles. Entries that collapse onto the same
+    (title, page, page_size) are merged, keeping the most enriched and then the freshest one.
+    """
+    groups = {}
+    cursor = database.search_cache.find({}, {"title": 1, "page": 1, "page_size": 1, "fetched_at": 1, "enriched": 1})
+    async for doc in cursor:
+        key = (canonical_query(doc["title"]), doc["page"], doc.get("page_size", 100))
+        groups.setdefault(key, []).append(doc)
+
+    def rank(doc):
+        # no enriched field means it predates enrichment levels, i.e. fully enriched
+        enriched = doc.get("enriched", ["description", "image"])
+        return (len(enriched), doc.get("fetched_at") or datetime.min)
+
+    merged = 0
+    renamed = 0
+    for (title, _, _), docs in groups.items():
+        if len(docs) == 1 and docs[0]["title"] == title:
+            continue
+
+        docs.sort(key=rank, reverse=True)
+        keeper, losers = docs[0], docs[1:]
+
+        # delete first, the unique index would reject the rename otherwise
+        if losers:
+            await database.search_cache.delete_many({"_id": {"$in": [d["_id"] for d in losers]}})
+            merged += len(losers)
+        if keeper["title"] != title:
+            await database.search_cache.update_one({"_id": keeper["_id"]}, {"$set": {"title": title}})
+            renamed += 1
+
+    return {"groups": len(groups), "merged": merged, "renamed": renamed}
+
+
+async def normalize_search_cache(database) -> dict:
+    """
+    Move books embedded in old search_cache pages into the books catalog and shrink
+    the pages down to {count, bids}. Safe to re-run, already converted pages are skipped.
+    """
+    converted = 0
+    books = 0
+    cursor = database.search_cache.find({"data": {"$exists": True}}, {"data": 1})
+    async for doc in cursor:
+        results = doc["data"].get("results", [])
+        if results:
+            now = datetime.utcnow()
+            # embedded copies may be older than what the catalog has, never overwrite
+            await database.books.bulk_write(
+                [
+                    UpdateOne({"bID": book["bID"]}, {"$setOnInsert": {**book, "updated_at": now}}, upsert=True)
+                    for book in results
+                ],
+                ordered=False
+            )
+            books += len(results)
+
+        await database.search_cache.update_one(
+            {"_id": doc["_id"]},
+            {
+                "$set": {"count": doc["data"].get("count", 0), "bids": [book["bID"] for book in results]},
+                "$unset": {"data": ""}
+            }
+        )
+        converted += 1
+
+    return {"converted": converted, "books": books}
+
+
+def _shard_files(cache_dir: Path, dedupe: bool) -> tuple[list, int]:
+    """Moves flat cover files into ab/cd/. Returns ([(cover_id, new path, sha256 or None)], duplicates)."""
+    moved = []
+    duplicates = 0
+    with os.scandir(cache_dir) as entries:
+        names = [entry.name for entry in entries if entry.is_file()]
+    for name in names:
+        parsed = parse_filename(name)
+        if parsed is None:
+            continue
+        cover_id, variant = parsed
+        target = cache_dir / cover_relpath(cover_id, variant)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        # same filesystem, a rename; a cover downloaded since the new layout went live wins
+        if target.exists():
+            os.remove(cache_dir / name)
+            continue
+        os.replace(cache_dir / name, target)
+
+        digest = None
+        if variant is None:
+            digest = hashlib.sha256(target.read_bytes()).hexdigest()
+            if dedupe and share_blob(target, blob_path(cache_dir, digest)):
+                duplicates += 1
+            moved.append((cover_id, target, digest))
+    return moved, duplicates
+
+
+async def shard_images(database, cache_dir=CACHE_DIR, dedupe: bool = IMAGE_DEDUPE, batch_size: int = 1000) -> dict:
+    """
+    Re-home covers from the flat static/images/{cover_id}.jpg layout into sharded directories,
+    hard-linking identical files to one copy. image_cache.local_path and catalog image URLs are
+    updated to the new paths; the old URLs keep working anyway through routes/images.py.
+    """
+    cache_dir = Path(cache_dir)
+    moved, duplicates = await asyncio.to_thread(_shard_files, cache_dir, dedupe)
+
+    for start in range(0, len(moved), batch_size):
+        batch = moved[start:start + batch_size]
+        await database.image_cache.bulk_write(
+            [
+                UpdateOne({"cover_id": cid}, {"$set": {"local_path": str(path), "content_hash": digest}})
+                for cid, path, digest in batch
+            ],
+            ordered=False
+        )
+        await database.books.bulk_write(
+            [
+                UpdateMany({"cover_id": cid, "image": f"/static/images/{cid}.jpg"}, {"$set": {"image": cover_url(cid)}})
+                for cid, _, _ in batch
+            ],
+            ordered=False
+        )
+
+    return {"covers": len(moved), "duplicates": duplicates}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="BookStore data migrations")
+    parser.add_argument("migration", choices=["merge-search-cache", "normalize-search-cache", "shard-images"])
+    args = parser.parse_args()
+
+    if not await db.db_connect():
+        return
+
+    try:
+        if args.migration == "merge-search-cache":
+            print(await merge_search_cache_duplicates(db.database))
+        elif args.migration == "normalize-search-cache":
+            print(await normalize_search_cache(db.database))
+        elif args.migration == "shard-images":
+            print(await shard_images(db.database))
+    finally:
+        await db.close_db()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,131 +1,990 @@
-from backend.services.util import sanitize_string
+from backend.services.util import canonical_query, sanitize_string, split_author
 from backend.services.image_cache import ImageCacheService
-import httpx
+from backend.services import http_client
+from backend.services.singleflight import SingleFlight, MongoLease
+from backend.services.memory_cache import TTLCache
+from backend.services import tasks
+from backend.services.suggest import suggest_index
+from backend.services import local_search
+from backend.services.local_search import local_memory, local_stats
+from backend.services.scheduler import scheduler, TokenBucket, INTERACTIVE, ENRICHMENT, PREFETCH
+from backend.services.breaker import CircuitOpenError
+from backend.services.refine import upstream_terms
+from pymongo import UpdateOne
+from datetime import datetime, timedelta
 import asyncio
+import httpx
+import os
+from urllib.parse import quote_plus
+
+# Coordinate cold searches across uvicorn workers through a lease doc in Mongo
+SEARCH_LEASES = os.getenv("SEARCH_LEASES", "1") == "1"
+
+# In-process tier in front of db.search_cache
+SEARCH_MEMORY_MAX_ENTRIES = int(os.getenv("SEARCH_MEMORY_MAX_ENTRIES", "2048"))
+SEARCH_MEMORY_MAX_BYTES = int(os.getenv("SEARCH_MEMORY_MAX_BYTES", str(128 * 1024 * 1024)))
+SEARCH_MEMORY_TTL = float(os.getenv("SEARCH_MEMORY_TTL", "300"))
+
+# Stale-while-revalidate: past the soft TTL we still serve the cached doc but refresh it
+# in the background, the hard TTL is a Mongo TTL index on fetched_at (see db_connect)
+SEARCH_SOFT_TTL = float(os.getenv("SEARCH_SOFT_TTL", str(24 * 3600)))
+SEARCH_HARD_TTL = int(os.getenv("SEARCH_HARD_TTL", str(30 * 24 * 3600)))
+DESCRIPTION_SOFT_TTL = float(os.getenv("DESCRIPTION_SOFT_TTL", str(30 * 24 * 3600)))
+DESCRIPTION_HARD_TTL = int(os.getenv("DESCRIPTION_HARD_TTL", str(180 * 24 * 3600)))
+# Works OpenLibrary says don't exist are remembered for this long (expires_at TTL index)
+DESCRIPTION_MISSING_TTL = int(os.getenv("DESCRIPTION_MISSING_TTL", str(24 * 3600)))
+# descriptions.source of docs loaded by services/ingest.py, they have no fetched_at so
+# neither TTL applies; a later upstream fetch of the work turns them into normal entries
+DUMP_SOURCE = "dump"
+# Shown for works that have no description (or don't exist). A work we simply couldn't
+# fetch keeps "" instead, so it gets another try rather than the placeholder for good.
+NO_DESCRIPTION = "No Description Available"
+
+# Only ask OpenLibrary for what we actually keep, full docs carry huge isbn/edition_key arrays.
+# subject still comes back whole (upstream can't slice it), we only keep subject[0].
+SEARCH_FIELDS = "key,title,author_name,first_publish_year,cover_i,subject"
+DEFAULT_PAGE_SIZE = int(os.getenv("SEARCH_PAGE_SIZE", "100"))
+MAX_PAGE_SIZE = int(os.getenv("SEARCH_MAX_PAGE_SIZE", "100"))
+
+# Speculative prefetch of page N+1 after a cold search, budgeted per process
+PREFETCH_ENABLED = os.getenv("SEARCH_PREFETCH", "1") == "1"
+PREFETCH_MAX_IN_FLIGHT = int(os.getenv("SEARCH_PREFETCH_MAX_IN_FLIGHT", "4"))
+PREFETCH_PER_MINUTE = float(os.getenv("SEARCH_PREFETCH_PER_MINUTE", "60"))
+
+# Latency budget for a cold search (upstream search + enrichment), 0 turns it off.
+# Whatever isn't done by then comes back as "pending" and keeps filling the cache in the background.
+SEARCH_DEADLINE_MS = int(os.getenv("SEARCH_DEADLINE_MS", "5000"))
+
+# Enrichment levels, callers that only need titles/authors can skip the fan-out
+ENRICHMENTS = ("description", "image")
+
+# Process-wide, OpenBookAPI itself is created per request
+_search_flight = SingleFlight()
+_description_flight = SingleFlight()
+search_memory = TTLCache(SEARCH_MEMORY_MAX_ENTRIES, SEARCH_MEMORY_MAX_BYTES, SEARCH_MEMORY_TTL)
+search_mongo_stats = {"hits": 0, "misses": 0, "stale": 0, "upgrades": 0}
+prefetch_budget = TokenBucket(PREFETCH_PER_MINUTE / 60, PREFETCH_MAX_IN_FLIGHT)
+prefetch_stats = {"queued": 0, "in_flight": 0, "dropped_busy": 0, "dropped_budget": 0, "already_cached": 0}
+upstream_stats = {"failures": 0, "local_fallbacks": 0, "degraded": 0}
+deadline_stats = {"partial": 0, "no_results": 0}
+description_stats = {"found": 0, "missing": 0, "transient": 0, "negative_hits": 0}
+
+# How an upstream answer is treated: cached, cached as missing for a while, or not cached at all
+FOUND = "found"
+MISSING = "missing"
+TRANSIENT = "transient"
+# memory_key -> (count, books, {enrichment: task}) while a fetched page is being enriched
+_partial_pages: dict = {}
+
+
+def parse_enrich(value: str) -> tuple:
+    """
+    "all" / "none" / comma list like "image" or "description,image".
+    Returns a sorted tuple so it can be used in cache keys. Raises ValueError on unknown names.
+    """
+    value = (value or "").strip().lower()
+    if value in ("", "none"):
+        return ()
+    if value == "all":
+        return ENRICHMENTS
+    names = {part.strip() for part in value.split(",") if part.strip()}
+    unknown = names - set(ENRICHMENTS)
+    if unknown:
+        raise ValueError(f"Unknown enrichment(s): {', '.join(sorted(unknown))}")
+    return tuple(sorted(names))
+
+
+def invalidate_search_cache(book_title: str = None, page: int = None) -> int:
+    """
+    Drop in-memory search entries for this process. No args clears everything,
+    a title without a page drops every page of that title.
+    """
+    if book_title is None:
+        return search_memory.invalidate()
+    title = canonical_query(book_title)
+    if page is not None:
+        return search_memory.invalidate(predicate=lambda key: key[0] == title and key[1] == page)
+    return search_memory.invalidate(predicate=lambda key: key[0] == title)
+
+
+def is_stale(doc: dict, soft_ttl: float) -> bool:
+    """Docs cached before fetched_at existed count as stale so they get refreshed once."""
+    fetched_at = doc.get("fetched_at")
+    if fetched_at is None:
+        return True
+    return datetime.utcnow() - fetched_at > timedelta(seconds=soft_ttl)
+
+
+async def _empty_lookup():
+    return {}, []
+
+
+async def _within(awaitable, deadline: float = None):
+    """Await with whatever is left of the deadline (loop time), raises asyncio.TimeoutError past it"""
+    if deadline is None:
+        return await awaitable
+    return await asyncio.wait_for(awaitable, max(0.0, deadline - asyncio.get_running_loop().time()))
+
+
+def classify_response(response) -> tuple[str, dict]:
+    """
+    Sort an OpenLibrary JSON response into (FOUND, data), (MISSING, None) or (TRANSIENT, None).
+    404 / 410 and deleted records are MISSING, anything that might work next time
+    (5xx, 429, an HTML error page with a 200) is TRANSIENT.
+    """
+    if response.status_code in (404, 410):
+        return MISSING, None
+    if response.status_code != 200:
+        return TRANSIENT, None
+    try:
+        data = response.json()
+    except ValueError:
+        return TRANSIENT, None
+    if not isinstance(data, dict):
+        return TRANSIENT, None
+    if (data.get("type") or {}).get("key") == "/type/delete":
+        return MISSING, None
+    return FOUND, data
+
+
+def search_cache_stats() -> dict:
+    return {
+        "memory": search_memory.stats(),
+        "mongo": dict(search_mongo_stats),
+        "prefetch": dict(prefetch_stats),
+        "local": {"mode": local_search.SEARCH_MODE, **local_stats, "memory": local_memory.stats()},
+        "upstream": dict(upstream_stats),
+        "deadline": {"default_ms": SEARCH_DEADLINE_MS, **deadline_stats},
+        "descriptions": dict(description_stats),
+    }
+
 
 class OpenBookAPI:
-    def __init__(self, db):
+    def __init__(self, db, client=None):
         self._root = "https://openlibrary.org/search.json"
         self.db = db
-        self.image_cache = ImageCacheService(db)
+        # One pooled client for all OpenLibrary traffic, owned by the app lifespan
+        self.client = client or http_client.get_client()
+        self.image_cache = ImageCacheService(db, client=self.client)
+
+    async def search(self, book_title: str, page: int = 1, enrich: tuple = ENRICHMENTS, page_size: int = DEFAULT_PAGE_SIZE,
+                     deadline_ms: int = None):
+        """
+        deadline_ms bounds everything that has to go upstream (SEARCH_DEADLINE_MS if not given, 0 for
+        none): a cold search, upgrading a lean cached page, enriching catalog results. Past it the
+        response carries "pending": the enrichments (or "results") that didn't make it in time.
+        """
+        deadline_ms = SEARCH_DEADLINE_MS if deadline_ms is None else deadline_ms
+        deadline = asyncio.get_running_loop().time() + deadline_ms / 1000 if deadline_ms > 0 else None
+
+        cache_key = self._cache_key(book_title, page, page_size)
+        return self._record_query(book_title, await self._search(book_title, cache_key, enrich, deadline))
+
+    async def _search(self, book_title: str, cache_key: dict, enrich: tuple, deadline: float = None) -> dict:
+        cached = await self._cached_search(book_title, cache_key, enrich, deadline)
+        if cached is not None:
+            return cached
+
+        if local_search.SEARCH_MODE == "local_first":
+            local = await self._local_search(book_title, cache_key, enrich, deadline)
+            if local["results"]:
+                return local
+
+        try:
+            if local_search.SEARCH_MODE == "race":
+                return await self._race_search(book_title, cache_key, enrich, deadline)
+            return await self._upstream_search(book_title, cache_key, enrich, deadline)
+        except Exception as e:
+            upstream_stats["failures"] += 1
+            if local_search.SEARCH_MODE == "upstream_first":
+                # OpenLibrary is down / throttling us, whatever the catalog has beats an error
+                local = await self._local_search(book_title, cache_key, enrich, deadline)
+                if local["results"]:
+                    upstream_stats["local_fallbacks"] += 1
+                    return local
+            if isinstance(e, CircuitOpenError):
+                return self._degraded()
+            raise
+
+    @staticmethod
+    def _record_query(book_title: str, output: dict) -> dict:
+        """Typeahead learns a query once it has found something, typos and junk never make it in"""
+        if output["results"]:
+            suggest_index.record_query(book_title)
+        return output
+
+    @staticmethod
+    def _degraded() -> dict:
+        """Answer for when OpenLibrary's breaker is open and nothing local matched"""
+        upstream_stats["degraded"] += 1
+        return {"count": 0, "results": [], "degraded": True}
+
+    async def _upstream_search(self, book_title: str, cache_key: dict, enrich: tuple, deadline: float = None):
+        # Identical cold searches share one upstream fetch instead of racing on the unique index
+        memory_key = self._memory_key(cache_key, enrich)
+        flight = _search_flight.do(memory_key, lambda: self._search_leased(book_title, cache_key, enrich))
+        try:
+            # the flight is shielded, timing out here leaves it running to fill the cache
+            output = await _within(flight, deadline)
+        except asyncio.TimeoutError:
+            return await self._partial_search(book_title, cache_key, enrich, deadline)
+
+        # People who look at page N usually want N+1 a few seconds later
+        self._prefetch_next_page(book_title, cache_key, enrich, output["count"])
+        return output
+
+    async def _unbacked_placeholders(self, books: list) -> list:
+        """
+        Catalog books showing the placeholder without a descriptions entry behind it: written
+        during an outage before failed fetches were kept as "". One $in, only those get refetched.
+        """
+        placeholders = [b for b in books if b["sypnosis"] == NO_DESCRIPTION]
+        if not placeholders:
+            return []
+        _, unknown = await self.lookup_descriptions([b["bID"] for b in placeholders])
+        return [b for b in placeholders if b["bID"] in unknown]
+
+    async def _race_search(self, book_title: str, cache_key: dict, enrich: tuple, deadline: float = None):
+        """
+        Local catalog and OpenLibrary at the same time, the first non-empty answer wins.
+        A losing upstream search keeps running in the background so search_cache still gets filled.
+        """
+        if not scheduler.available(self._root):
+            # no point racing a call the breaker will reject, same as local_first
+            local = await self._local_search(book_title, cache_key, enrich, deadline)
+            if local["results"]:
+                return local
+            return await self._upstream_search(book_title, cache_key, enrich, deadline)
+
+        memory_key = self._memory_key(cache_key, enrich)
+        upstream = tasks.spawn(self._upstream_search(book_title, cache_key, enrich, deadline), name=f"race-upstream:{memory_key}")
+        local = asyncio.ensure_future(self._local_search(book_title, cache_key, enrich, deadline))
+        try:
+            for next_done in asyncio.as_completed((upstream, local)):
+                try:
+                    output = await next_done
+                except Exception:
+                    continue
+                if output["results"]:
+                    return output
+        finally:
+            local.cancel()
+
+        # neither had anything, the upstream answer (or its error) is the real one
+        return await upstream
+
+    async def _partial_search(self, book_title: str, cache_key: dict, enrich: tuple, deadline: float = None) -> dict:
+        """
+        Deadline hit. If the upstream page is already here, return it with whatever enrichment
+        finished; otherwise the local catalog, otherwise an empty page marked pending.
+        """
+        partial = self._partial_page(self._memory_key(cache_key, enrich))
+        if partial is not None:
+            return partial
+
+        deadline_stats["no_results"] += 1
+        if local_search.SEARCH_MODE != "local_first":
+            local = await self._local_search(book_title, cache_key, enrich, deadline)
+            if local["results"]:
+                return {**local, "pending": ["results", *local.get("pending", [])]}
+        return {"count": 0, "results": [], "pending": ["results"]}
+
+    def _partial_page(self, memory_key: tuple) -> dict:
+        """The page a fetch or upgrade is still enriching, with the enrichments not done yet as pending"""
+        partial = _partial_pages.get(memory_key)
+        if partial is None:
+            return None
+        count, books, jobs = partial
+        deadline_stats["partial"] += 1
+        output = self._output(count, books)
+        output["pending"] = [e for e, job in jobs.items() if not job.done()]
+        return output
+
+    async def _local_search(self, book_title: str, cache_key: dict, enrich: tuple, deadline: float = None) -> dict:
+        """
+        Search the local books catalog (search results + ingested dumps), same response shape.
+        Requested enrichments the catalog doesn't have yet are filled in and written back; past
+        the deadline the page goes out with those marked pending and the write-back carries on.
+        Never raises, a broken local search is just an empty one.
+        """
+        memory_key = self._memory_key(cache_key, enrich)
+        hit = local_memory.get(memory_key)
+        if hit is not None:
+            return hit
+
+        try:
+            count, books = await local_search.search_catalog(
+                self.db, book_title, cache_key["page"], cache_key["page_size"]
+            )
+            pending = await self._enrich_catalog_page(books, enrich, memory_key, deadline)
+        except Exception as e:
+            print(f"Local search failed for {book_title!r}: {e}")
+            local_stats["errors"] += 1
+            return {"count": 0, "results": []}
+
+        output = self._output(count, books)
+        if pending:
+            output["pending"] = pending
+        elif books:
+            local_stats["served"] += 1
+            local_memory.set(memory_key, output)
+        return output
+
+    async def _enrich_catalog_page(self, books: list, enrich: tuple, memory_key: tuple, deadline: float = None) -> list:
+        """
+        Fill in the requested enrichments catalog books don't have yet and write them back.
+        Returns the ones still running at the deadline (the write-back carries on).
+        """
+        for book in books:
+            book.setdefault("sypnosis", "")
+            book.setdefault("image", "")
+
+        needs = {
+            "description": [b for b in books if not b["sypnosis"]],
+            "image": [b for b in books if not b["image"] and b.get("cover_id")],
+        }
+        if "description" in enrich:
+            needs["description"] += await self._unbacked_placeholders(books)
+        missing = tuple(e for e in enrich if needs[e])
+        jobs = {e: asyncio.ensure_future(self._enrich(needs[e], (e,))) for e in missing}
+        if not jobs:
+            return []
+
+        write_back = tasks.spawn(self._write_back_local(jobs, needs), name=f"local-enrich:{memory_key}")
+        try:
+            await _within(asyncio.shield(write_back), deadline)
+        except asyncio.TimeoutError:
+            deadline_stats["partial"] += 1
+            return [e for e, job in jobs.items() if not job.done()]
+        return []
+
+    async def refined_search(self, book_title: str, page: int = 1, enrich: tuple = ENRICHMENTS,
+                             page_size: int = DEFAULT_PAGE_SIZE, filters: dict = None,
+                             sort: tuple = ("relevance", False), facets: tuple = (), deadline_ms: int = None) -> dict:
+        """
+        Search with filters (see refine.make_filters), a sort order and facets, computed over
+        the whole local catalog in one aggregation and paginated after filtering, so "count"
+        is the filtered total. OpenLibrary's page for the query, with the filters pushed into
+        its q, is pulled into the catalog first (not in local_first mode, nor with the breaker
+        open). "pending": ["results"] if that didn't make the deadline.
+        """
+        filters = filters or {}
+        deadline_ms = SEARCH_DEADLINE_MS if deadline_ms is None else deadline_ms
+        deadline = asyncio.get_running_loop().time() + deadline_ms / 1000 if deadline_ms > 0 else None
+
+        memory_key = (canonical_query(book_title), page, page_size, enrich, tuple(sorted(filters.items())), sort, facets)
+        hit = local_memory.get(memory_key)
+        if hit is not None:
+            return self._record_query(book_title, hit)
+
+        pending = await self._seed_catalog(book_title, page, page_size, filters, deadline)
+        try:
+            count, books, facet_counts = await local_search.refine_catalog(
+                self.db, book_title, page, page_size, filters, sort, facets
+            )
+            pending += await self._enrich_catalog_page(books, enrich, memory_key, deadline)
+        except Exception as e:
+            print(f"Refined search failed for {book_title!r}: {e}")
+            local_stats["errors"] += 1
+            return {"count": 0, "results": []}
+
+        output = self._output(count, books)
+        if facets:
+            output["facets"] = facet_counts
+        if pending:
+            output["pending"] = pending
+        else:
+            local_memory.set(memory_key, output)
+        return self._record_query(book_title, output)
+
+    async def _seed_catalog(self, book_title: str, page: int, page_size: int, filters: dict, deadline: float = None) -> list:
+        """Bring upstream's filtered page into the catalog, ["results"] if it's not in by the deadline"""
+        if local_search.SEARCH_MODE == "local_first" or not scheduler.available(self._root):
+            return []
+        seed_key = ("seed", canonical_query(book_title), page, page_size, tuple(sorted(filters.items())))
+        if local_memory.get(seed_key) is not None:
+            return []
+
+        async def seed():
+            count, books = await self._search_upstream(book_title, page, page_size, filters=filters)
+            await self.store_books(books, ())
+            local_memory.set(seed_key, count)
+
+        try:
+            # shielded, a seed that misses the deadline still lands for the next request
+            await _within(_search_flight.do(seed_key, seed), deadline)
+        except asyncio.TimeoutError:
+            return ["results"]
+        except Exception as e:
+            # whatever the catalog already has is still an answer
+            print(f"Seeding the catalog for {book_title!r} failed: {e}")
+            upstream_stats["failures"] += 1
+        return []
+
+    async def _write_back_local(self, jobs: dict, needs: dict):
+        await asyncio.gather(*jobs.values())
+        updated = {b["bID"]: b for e in jobs for b in needs[e]}
+        await self.store_books(list(updated.values()), tuple(jobs))
+
+    async def search_stream(self, book_title: str, page: int = 1, enrich: tuple = ENRICHMENTS, page_size: int = DEFAULT_PAGE_SIZE):
+        """
+        Same search, but yields events as they become available:
+          {"type": "results", "count", "results"}   bare books (or the full page on a cache hit)
+          {"type": "patch", "bID", "sypnosis"|"image"}   one per enrichment as it resolves
+          {"type": "done"}
+        """
+        cache_key = self._cache_key(book_title, page, page_size)
+        memory_key = self._memory_key(cache_key, enrich)
+
+        cached = await self._cached_search(book_title, cache_key, enrich)
+        if cached is None and _search_flight.in_flight(memory_key):
+            # somebody is already fetching this page, just wait for the whole thing
+            cached = await _search_flight.do(memory_key, lambda: self._search_leased(book_title, cache_key, enrich))
+        if cached is None and local_search.SEARCH_MODE != "upstream_first":
+            # local_first and race alike: a catalog answer is already complete, nothing to patch in
+            local = await self._local_search(book_title, cache_key, enrich)
+            cached = local if local["results"] else None
+        if cached is not None:
+            yield {"type": "results", **self._record_query(book_title, cached)}
+            yield {"type": "done"}
+            return
+
+        try:
+            count, books = await self._search_upstream(book_title, page, page_size)
+        except Exception as e:
+            upstream_stats["failures"] += 1
+            local = {"results": []}
+            if local_search.SEARCH_MODE == "upstream_first":
+                local = await self._local_search(book_title, cache_key, enrich)
+            if local["results"]:
+                upstream_stats["local_fallbacks"] += 1
+            elif isinstance(e, CircuitOpenError):
+                local = self._degraded()
+            else:
+                raise
+            yield {"type": "results", **self._record_query(book_title, local)}
+            yield {"type": "done"}
+            return
+        self._prefetch_next_page(book_title, cache_key, enrich, count)
+        yield {"type": "results", **self._record_query(book_title, self._output(count, books))}
+
+        hits, pending, fetched, downloaded = await self._start_stream_enrichment(books, enrich)
+        try:
+            for patch in hits:
+                yield {"type": "patch", **patch}
+            for next_patch in asyncio.as_completed(pending):
+                yield {"type": "patch", **await next_patch}
+        finally:
+            # client may hang up mid-stream, let the enrichment finish and still fill the cache
+            tasks.spawn(
+                self._finish_stream(pending, fetched, downloaded, cache_key, count, books, enrich),
+                name=f"stream-finish:{memory_key}"
+            )
 
-    async def search(self, book_title: str, page: int = 1):
+        yield {"type": "done"}
 
-        cache_key = {
-            "title": book_title.lower(),
-            "page": page
+    async def _start_stream_enrichment(self, books: list, enrich: tuple):
+        """
+        Batched cache lookups up front (one query per collection), cache hits become patches
+        right away and each miss gets its own upstream task so it can be streamed when done.
+        Misses are collected into fetched / downloaded and written back in bulk by _finish_stream.
+        """
+        want_desc = "description" in enrich
+        want_image = "image" in enrich
+
+        desc_lookup = self.lookup_descriptions([b["bID"] for b in books]) if want_desc else _empty_lookup()
+        image_lookup = (
+            self.image_cache.lookup_images([b["cover_id"] for b in books if b.get("cover_id")])
+            if want_image else _empty_lookup()
+        )
+        (desc_found, desc_missing), (image_found, image_missing) = await asyncio.gather(desc_lookup, image_lookup)
+
+        hits = []
+        pending = set()
+        fetched = {}
+        downloaded = []
+
+        async def fetch_description(book):
+            try:
+                desc = await _description_flight.do(book["bID"], lambda: self._fetch_description(book["bID"]))
+                fetched[book["bID"]] = desc
+                book["sypnosis"] = desc or NO_DESCRIPTION
+            except Exception:
+                book["sypnosis"] = ""
+            return {"bID": book["bID"], "sypnosis": book["sypnosis"]}
+
+        async def download_image(book):
+            url, doc = await self.image_cache.download_image(book["cover_id"])
+            if doc:
+                downloaded.append(doc)
+            book["image"] = url
+            return {"bID": book["bID"], **self._image_fields(book)}
+
+        for book in books:
+            if want_desc:
+                if book["bID"] in desc_found:
+                    book["sypnosis"] = desc_found[book["bID"]] or NO_DESCRIPTION
+                    hits.append({"bID": book["bID"], "sypnosis": book["sypnosis"]})
+                else:
+                    pending.add(asyncio.ensure_future(fetch_description(book)))
+
+            cover_id = book.get("cover_id")
+            if want_image and cover_id:
+                if cover_id in image_found:
+                    book["image"] = image_found[cover_id]
+                    hits.append({"bID": book["bID"], **self._image_fields(book)})
+                else:
+                    pending.add(asyncio.ensure_future(download_image(book)))
+
+        return hits, pending, fetched, downloaded
+
+    async def _finish_stream(self, pending, fetched: dict, downloaded: list, cache_key: dict, count: int, books: list, enrich: tuple):
+        await asyncio.gather(*pending, return_exceptions=True)
+        await asyncio.gather(
+            self.store_descriptions(fetched),
+            self.image_cache.store_images(downloaded)
+        )
+        await self._store_search(cache_key, count, books, enrich)
+
+    @staticmethod
+    def _cache_key(book_title: str, page: int, page_size: int) -> dict:
+        return {
+            "title": canonical_query(book_title),
+            "page": page,
+            "page_size": page_size
         }
 
+    @staticmethod
+    def _memory_key(cache_key: dict, enrich: tuple) -> tuple:
+        return (cache_key["title"], cache_key["page"], cache_key["page_size"], enrich)
+
+    async def _cached_search(self, book_title: str, cache_key: dict, enrich: tuple, deadline: float = None):
+        memory_key = self._memory_key(cache_key, enrich)
+        hit = search_memory.get(memory_key)
+        if hit is not None:
+            return hit
+
         cached = await self.db.search_cache.find_one(cache_key)
-        if cached:
-            return cached["data"]
+        if not cached:
+            search_mongo_stats["misses"] += 1
+            return None
+
+        count, books = await self._load_page(cached)
+        if books is None:
+            # the page points at books that are gone from the catalog, treat it as a miss
+            search_mongo_stats["misses"] += 1
+            return None
+
+        search_mongo_stats["hits"] += 1
+        # Entries from before enrichment levels existed were always fully enriched
+        have = tuple(cached.get("enriched", ENRICHMENTS))
+        if is_stale(cached, SEARCH_SOFT_TTL):
+            self._revalidate_search(book_title, cache_key, have)
+
+        if not set(enrich) <= set(have):
+            # Lean entry, run just the missing enrichments and upgrade it in place
+            flight = _search_flight.do(memory_key, lambda: self._upgrade_search(cache_key, cached, count, books, enrich))
+            try:
+                return await _within(flight, deadline)
+            except asyncio.TimeoutError:
+                partial = self._partial_page(memory_key)
+                if partial is None:
+                    # the upgrade hasn't started its jobs yet, nothing new on the page
+                    deadline_stats["partial"] += 1
+                    partial = {**self._output(count, books), "pending": [e for e in enrich if e not in have]}
+                return partial
+
+        output = self._output(count, books)
+        search_memory.set(memory_key, output)
+        return output
+
+    async def _load_page(self, cached: dict) -> tuple[int, list]:
+        """
+        Rebuild a cached page from the books catalog with one $in, keeping the cached order.
+        Returns (count, None) if any of its books is missing from the catalog.
+        """
+        if "bids" not in cached:
+            # written before the catalog existed, the books are still embedded
+            return cached["data"]["count"], [dict(book) for book in cached["data"]["results"]]
+
+        bids = cached["bids"]
+        by_id = {}
+        if bids:
+            cursor = self.db.books.find({"bID": {"$in": bids}}, {"_id": 0, "updated_at": 0, "search_hits": 0})
+            async for book in cursor:
+                by_id[book["bID"]] = book
+
+        if len(by_id) < len(set(bids)):
+            return cached["count"], None
+        return cached["count"], [dict(by_id[bID]) for bID in bids]
+
+    def _prefetch_next_page(self, book_title: str, cache_key: dict, enrich: tuple, count: int):
+        """Queue page N+1 at the lowest priority. Dropped rather than queued when we're busy."""
+        if not PREFETCH_ENABLED or cache_key["page"] * cache_key["page_size"] >= count:
+            return
+
+        next_key = self._cache_key(book_title, cache_key["page"] + 1, cache_key["page_size"])
+        if _search_flight.in_flight(self._memory_key(next_key, enrich)):
+            return
+        if scheduler.busy() or not scheduler.available(self._root):
+            prefetch_stats["dropped_busy"] += 1
+            return
+        if prefetch_stats["in_flight"] >= PREFETCH_MAX_IN_FLIGHT or not prefetch_budget.try_acquire():
+            prefetch_stats["dropped_budget"] += 1
+            return
+
+        prefetch_stats["queued"] += 1
+        tasks.spawn(self._prefetch(book_title, next_key, enrich), name=f"prefetch:{self._memory_key(next_key, enrich)}")
+
+    async def _prefetch(self, book_title: str, cache_key: dict, enrich: tuple):
+        prefetch_stats["in_flight"] += 1
+        try:
+            if await self.db.search_cache.find_one(cache_key, {"_id": 1}):
+                prefetch_stats["already_cached"] += 1
+                return
+            memory_key = self._memory_key(cache_key, enrich)
+            await _search_flight.do(memory_key, lambda: self._search_leased(book_title, cache_key, enrich, PREFETCH))
+        finally:
+            prefetch_stats["in_flight"] -= 1
+
+    def _revalidate_search(self, book_title: str, cache_key: dict, enrich: tuple):
+        memory_key = self._memory_key(cache_key, enrich)
+        if _search_flight.in_flight(memory_key):
+            return
+        search_mongo_stats["stale"] += 1
+        # while the breaker is open the stale copy is the answer, don't queue doomed refreshes
+        if not scheduler.available(self._root):
+            return
+        tasks.spawn(
+            _search_flight.do(memory_key, lambda: self._search_leased(book_title, cache_key, enrich, PREFETCH)),
+            name=f"revalidate-search:{memory_key}"
+        )
+
+    async def _search_leased(self, book_title: str, cache_key: dict, enrich: tuple, priority: int = INTERACTIVE):
+        if not SEARCH_LEASES:
+            return await self._fetch_search(book_title, cache_key, enrich, priority)
+
+        lease = MongoLease(self.db.search_leases)
+        lease_key = f"{cache_key['title']}|{cache_key['page']}|{cache_key['page_size']}|{','.join(enrich)}"
+        if await lease.acquire(lease_key):
+            try:
+                return await self._fetch_search(book_title, cache_key, enrich, priority)
+            finally:
+                await lease.release(lease_key)
+
+        # Another worker is already on it, wait for its cache write
+        cached = await lease.wait(lease_key, lambda: self.db.search_cache.find_one(cache_key))
+        if cached and set(enrich) <= set(cached.get("enriched", ENRICHMENTS)):
+            count, books = await self._load_page(cached)
+            if books is not None:
+                return self._output(count, books)
+        return await self._fetch_search(book_title, cache_key, enrich, priority)
+
+    async def _fetch_search(self, book_title: str, cache_key: dict, enrich: tuple, priority: int = INTERACTIVE):
+        count, books = await self._search_upstream(book_title, cache_key["page"], cache_key["page_size"], priority)
+
+        # one task per enrichment so a caller past its deadline can see which ones are done
+        memory_key = self._memory_key(cache_key, enrich)
+        jobs = {e: asyncio.ensure_future(self._enrich(books, (e,), max(priority, ENRICHMENT))) for e in enrich}
+        _partial_pages[memory_key] = (count, books, jobs)
+        try:
+            await asyncio.gather(*jobs.values())
+        finally:
+            _partial_pages.pop(memory_key, None)
+
+        return await self._store_search(cache_key, count, books, enrich)
+
+    async def _upgrade_search(self, cache_key: dict, cached: dict, count: int, books: list, enrich: tuple):
+        have = tuple(cached.get("enriched", ENRICHMENTS))
+        missing = tuple(e for e in enrich if e not in have)
+
+        memory_key = self._memory_key(cache_key, enrich)
+        jobs = {e: asyncio.ensure_future(self._enrich(books, (e,))) for e in missing}
+        _partial_pages[memory_key] = (count, books, jobs)
+        try:
+            await asyncio.gather(*jobs.values())
+        finally:
+            _partial_pages.pop(memory_key, None)
+
+        search_mongo_stats["upgrades"] += 1
+        level = tuple(sorted(set(have) | set(enrich)))
+        # upstream data didn't change, keep the original fetched_at so SWR still kicks in
+        return await self._store_search(cache_key, count, books, level, cached.get("fetched_at"))
 
+    async def _enrich(self, books: list, enrich: tuple, priority: int = ENRICHMENT):
+        """Batched enrichment, a fixed number of Mongo calls per page however many books it has"""
+        jobs = []
+        if "description" in enrich:
+            jobs.append(self._enrich_descriptions(books, priority))
+        if "image" in enrich:
+            jobs.append(self._enrich_images(books, priority))
+
+        # Fetch descriptions and images in parallel for performance
+        await asyncio.gather(*jobs)
+
+    async def _search_upstream(self, book_title: str, page: int, page_size: int = DEFAULT_PAGE_SIZE, priority: int = INTERACTIVE,
+                               filters: dict = None):
+        """Upstream search only. Books come back bare, with cover_id still attached for enrichment."""
         q = sanitize_string(book_title)
-        url = f"{self._root}?q={q}&page={page}"
-        async with httpx.AsyncClient() as client:
-            r = await client.get(url)
-            data = r.json()
-
-            docs = data.get("docs", [])
-
-            book_ids = []
-            book_data = []
-
-            cover_ids = []
-            for doc in docs:
-                key = doc.get("key", "")
-                bID = key.split("/")[-1]
-
-                title = doc.get("title", "")
-                author_name = doc.get("author_name", [""])
-                full = author_name[0] if author_name else ""
-                parts = full.split()
-                authorF = parts[0] if parts else ""
-                authorL = parts[-1] if len(parts) > 1 else ""
-                date = doc.get("first_publish_year", None)
-
-                genre = ""
-                if "subject" in doc and len(doc["subject"]) > 0:
-                    genre = doc["subject"][0]
-
-                cover_id = doc.get("cover_i", None)
-                cover_ids.append(str(cover_id) if cover_id else None)
-
-                book_ids.append(bID)
-                book_data.append({
-                    "bID": bID,
-                    "title": title or "Unknown Title",
-                    "date": date,
-                    "authorF": authorF,
-                    "authorL": authorL,
-                    "genre": genre,
-                    "cover_id": cover_id,
-                })
-
-            # Batch fetch descriptions and images in parallel for performance
-            descriptions_task = asyncio.gather(
-                *[self.get_description_cached(bID, self.db) for bID in book_ids],
-                return_exceptions=True
-            )
-            images_task = self.image_cache.batch_cache_images(cover_ids)
+        if filters:
+            q = f"{q}+{quote_plus(upstream_terms(filters))}"
+        url = f"{self._root}?q={q}&page={page}&limit={page_size}&fields={SEARCH_FIELDS}"
+        r = await scheduler.get(self.client, url, priority=priority)
+        r.raise_for_status()
+        data = r.json()
 
-            descriptions, image_urls = await asyncio.gather(descriptions_task, images_task)
+        docs = data.get("docs", [])
 
-            # Combine data with descriptions and images before sending
-            results = []
-            for i, book in enumerate(book_data):
-                desc = descriptions[i] if not isinstance(descriptions[i], Exception) else ""
-                cover_id = book.pop("cover_id", None)
-                image_url = image_urls.get(str(cover_id), "") if cover_id else ""
+        book_data = []
+        for doc in docs:
+            key = doc.get("key", "")
+            bID = key.split("/")[-1]
 
-                book["sypnosis"] = desc or "No Description Available"
-                book["image"] = image_url
-                results.append(book)
+            title = doc.get("title", "")
+            author_name = doc.get("author_name", [""])
+            authorF, authorL = split_author(author_name[0] if author_name else "")
+            date = doc.get("first_publish_year", None)
 
-            output = {
-                "count": data.get("num_found", 0),
-                "results": results
-            }
+            genre = ""
+            if "subject" in doc and len(doc["subject"]) > 0:
+                genre = doc["subject"][0]
 
-            # Store new data in cache mDB
-            await self.db.search_cache.insert_one({
-                **cache_key,
-                "data": output
+            cover_id = doc.get("cover_i", None)
+
+            book_data.append({
+                "bID": bID,
+                "title": title or "Unknown Title",
+                "sypnosis": "",
+                "date": date,
+                "authorF": authorF,
+                "authorL": authorL,
+                "genre": genre,
+                "image": "",
+                "cover_id": str(cover_id) if cover_id else None,
             })
 
-            return output
+        return data.get("num_found", 0), book_data
 
-    
-    async def get_description(self, work_id: str):
-        url = f"https://openlibrary.org/works/{work_id}.json"
-        async with httpx.AsyncClient() as client:
-            r = await client.get(url)
-            data = r.json()
+    async def _enrich_descriptions(self, books: list, priority: int = ENRICHMENT):
+        try:
+            descriptions = await self.get_descriptions_cached([book["bID"] for book in books], priority=priority)
+        except Exception as e:
+            print(f"Failed to load descriptions: {e}")
+            descriptions = {}
+        for book in books:
+            if book["bID"] in descriptions:
+                book["sypnosis"] = descriptions[book["bID"]] or NO_DESCRIPTION
+            else:
+                # transient failure / open breaker, left for the next request to retry
+                book["sypnosis"] = ""
+
+    async def _enrich_images(self, books: list, priority: int = ENRICHMENT):
+        image_urls = await self.image_cache.batch_cache_images([book.get("cover_id") for book in books], priority=priority)
+        for book in books:
+            cover_id = book.get("cover_id")
+            if cover_id:
+                book["image"] = image_urls.get(cover_id, "")
+
+    def _image_fields(self, book: dict) -> dict:
+        """"image" stays the full size cover for older clients, "srcset" adds thumbnails for the grid"""
+        fields = {"image": book.get("image", "")}
+        if fields["image"].startswith("/static/images/"):
+            # pages served from the catalog never go through lookup_images, count them as use here
+            self.image_cache.touch(book.get("cover_id"))
+            srcset = self.image_cache.srcset(book.get("cover_id"))
+            if srcset:
+                fields["srcset"] = srcset
+        return fields
+
+    def _public(self, book: dict) -> dict:
+        public = {k: v for k, v in book.items() if k != "cover_id"}
+        if "image" in book:
+            public.update(self._image_fields(book))
+        return public
+
+    def _output(self, count: int, books: list) -> dict:
+        return {
+            "count": count,
+            "results": [self._public(book) for book in books]
+        }
+
+    async def _store_search(self, cache_key: dict, count: int, books: list, enrich: tuple, fetched_at=None):
+        # a fresh upstream page (not an enrichment upgrade) counts towards each book's popularity
+        await self.store_books(books, enrich, seen=fetched_at is None)
+
+        # a description that couldn't be fetched leaves the level unfinished, the next
+        # request for it upgrades the page (and retries just those works) instead of trusting it
+        complete = tuple(e for e in enrich if e != "description" or all(b.get("sypnosis") for b in books))
+
+        # The page itself is just the ordered bIDs, books live once in the catalog.
+        # Upsert so a late duplicate can't blow up on the unique index
+        await self.db.search_cache.update_one(
+            cache_key,
+            {
+                "$set": {
+                    "count": count,
+                    "bids": [book["bID"] for book in books],
+                    "enriched": list(complete),
+                    "fetched_at": fetched_at or datetime.utcnow()
+                },
+                "$unset": {"data": ""}
+            },
+            upsert=True
+        )
+
+        output = self._output(count, books)
+        if complete == tuple(enrich):
+            search_memory.set(self._memory_key(cache_key, enrich), output)
+        if fetched_at is None:
+            # fresh upstream page (not an enrichment upgrade), feed its titles / authors to typeahead
+            suggest_index.add_books(books)
 
-            desc = data.get("description")
-            if isinstance(desc, dict):
-                return desc.get("value")
-            return desc if desc else "No Description Available"
+        return output
+
+    async def store_books(self, books: list, enrich: tuple = ENRICHMENTS, seen: bool = False):
+        """
+        Upsert a page of books into the catalog in one bulk write. sypnosis / image are only
+        written when that enrichment ran and produced something, so neither a lean search nor
+        a failed fetch blanks out (or poisons) an enriched book.
+        cover_id is kept so a lean page can get its images later.
+        seen bumps search_hits, how many search pages a book has come up on (typeahead seeding).
+        """
+        if not books:
+            return
+
+        now = datetime.utcnow()
+        enriched_fields = {"description": "sypnosis", "image": "image"}
+        operations = []
+        for book in books:
+            update = {
+                "$set": {k: v for k, v in book.items() if k not in ("sypnosis", "image")},
+                "$setOnInsert": {},
+            }
+            update["$set"]["updated_at"] = now
+            for level, field in enriched_fields.items():
+                if level in enrich and book.get(field):
+                    update["$set"][field] = book[field]
+                else:
+                    update["$setOnInsert"][field] = ""
+            if not update["$setOnInsert"]:
+                del update["$setOnInsert"]
+            if seen:
+                update["$inc"] = {"search_hits": 1}
+            operations.append(UpdateOne({"bID": book["bID"]}, update, upsert=True))
+
+        await self.db.books.bulk_write(operations, ordered=False)
+
+    async def get_description(self, work_id: str):
+        desc = await self._fetch_description(work_id)
+        return desc if desc else NO_DESCRIPTION
 
     async def get_description_cached(self, work_id, db):
-        cached = await db.descriptions.find_one({"work_id": work_id})
-        if cached:
-            return cached["description"]
+        descriptions = await self.get_descriptions_cached([work_id], db)
+        return descriptions.get(work_id) or ""
 
-        url = f"https://openlibrary.org/works/{work_id}.json"
-        async with httpx.AsyncClient() as client:
-            r = await client.get(url)
-            data = r.json()
+    async def get_descriptions_cached(self, work_ids: list, db=None, priority: int = ENRICHMENT) -> dict:
+        """
+        Batched description lookup: one descriptions query for the whole list, upstream calls
+        only for the real misses, and a single bulk upsert to write them back.
+        Works OpenLibrary doesn't have map to None, works that couldn't be fetched are left out.
+        """
+        db = self.db if db is None else db
+        found, missing = await self.lookup_descriptions(work_ids, db)
+        if missing:
+            fetched = await self.fetch_descriptions(missing, priority)
+            await self.store_descriptions(fetched, db)
+            found.update(fetched)
+        return found
+
+    async def lookup_descriptions(self, work_ids: list, db=None) -> tuple[dict, list]:
+        """Returns ({work_id: description} from the cache, [work_ids not cached])"""
+        db = self.db if db is None else db
+        work_ids = list(dict.fromkeys(w for w in work_ids if w))
+        if not work_ids:
+            return {}, []
 
-            desc = data.get("description")
-            if isinstance(desc, dict):
-                desc = desc.get("value")
+        found = {}
+        stale = []
+        cursor = db.descriptions.find(
+            {"work_id": {"$in": work_ids}},
+            {"work_id": 1, "description": 1, "fetched_at": 1, "missing": 1, "source": 1}
+        )
+        async for cached in cursor:
+            if cached.get("missing"):
+                # negative entry, expires on its own via expires_at, never revalidated early
+                description_stats["negative_hits"] += 1
+                found[cached["work_id"]] = None
+                continue
+            found[cached["work_id"]] = cached["description"]
+            # ingested from a dump, that's as current as it gets until the next ingest
+            if cached.get("source") != DUMP_SOURCE and is_stale(cached, DESCRIPTION_SOFT_TTL):
+                stale.append(cached["work_id"])
+
+        if stale:
+            self._revalidate_descriptions(stale, db)
+
+        return found, [w for w in work_ids if w not in found]
+
+    async def fetch_descriptions(self, work_ids: list, priority: int = ENRICHMENT) -> dict:
+        results = await asyncio.gather(
+            *[_description_flight.do(w, lambda w=w: self._fetch_description(w, priority)) for w in work_ids],
+            return_exceptions=True
+        )
+        return {w: desc for w, desc in zip(work_ids, results) if not isinstance(desc, Exception)}
+
+    async def store_descriptions(self, descriptions: dict, db=None):
+        if not descriptions:
+            return
+        db = self.db if db is None else db
+        now = datetime.utcnow()
+        operations = []
+        for w, desc in descriptions.items():
             if desc is None:
-                desc = ""
+                update = {
+                    "$set": {
+                        "description": "", "missing": True, "fetched_at": now,
+                        "expires_at": now + timedelta(seconds=DESCRIPTION_MISSING_TTL)
+                    },
+                    "$unset": {"source": ""}
+                }
+            else:
+                update = {"$set": {"description": desc, "fetched_at": now}, "$unset": {"missing": "", "expires_at": "", "source": ""}}
+            operations.append(UpdateOne({"work_id": w}, update, upsert=True))
+        await db.descriptions.bulk_write(operations, ordered=False)
+        # Books already in the catalog pick up the new text on every page that lists them
+        await db.books.bulk_write(
+            [
+                UpdateOne({"bID": w}, {"$set": {"sypnosis": desc or NO_DESCRIPTION, "updated_at": now}})
+                for w, desc in descriptions.items()
+            ],
+            ordered=False
+        )
 
-            await db.descriptions.insert_one({
-                "work_id": work_id,
-                "description": desc
-            })
+    def _revalidate_descriptions(self, work_ids: list, db):
+        work_ids = [w for w in work_ids if not _description_flight.in_flight(w)]
+        if work_ids and scheduler.available(self._root):
+            tasks.spawn(self._refresh_descriptions(work_ids, db), name=f"revalidate-descriptions:{len(work_ids)}")
+
+    async def _refresh_descriptions(self, work_ids: list, db):
+        fetched = await self.fetch_descriptions(work_ids, PREFETCH)
+        await self.store_descriptions(fetched, db)
+
+    async def _fetch_description(self, work_id, priority: int = ENRICHMENT):
+        """Description text ("" if the work has none), None if the work doesn't exist. Raises on transient errors."""
+        url = f"https://openlibrary.org/works/{work_id}.json"
+        # small and idempotent, one slow works/{id}.json shouldn't set the pace for the whole page
+        r = await scheduler.get(self.client, url, priority=priority, hedge=True)
+        outcome, data = classify_response(r)
+        description_stats[outcome] += 1
+        if outcome == MISSING:
+            return None
+        if outcome == TRANSIENT:
+            # a 429 / error page must not end up cached as an empty description
+            raise httpx.HTTPStatusError(f"Transient error for {url}: {r.status_code}", request=r.request, response=r)
 
-            return desc
\ No newline at end of file
+        desc = data.get("description")
+        if isinstance(desc, dict):
+            desc = desc.get("value")
+        if desc is None:
+            desc = ""
+        return desc
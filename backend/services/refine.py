@@ -0,0 +1,155 @@
+import re
+from backend.services.util import canonical_query, text_search
+
+# Sort keys accepted by /books/{book_name}, "-" in front reverses. relevance keeps the search order.
+SORT_KEYS = ("relevance", "year", "title", "author")
+FACETS = ("genre", "decade", "author")
+# Facet values returned per facet, most common first
+FACET_LIMIT = 20
+
+
+def parse_sort(value: str) -> tuple[str, bool]:
+    """"-year" -> ("year", True). Raises ValueError on unknown keys."""
+    value = (value or "relevance").strip().lower()
+    descending = value.startswith("-")
+    key = value.lstrip("-")
+    if key not in SORT_KEYS:
+        raise ValueError(f"Unknown sort key: {key} (use one of {', '.join(SORT_KEYS)})")
+    return key, descending
+
+
+def parse_facets(value: str) -> tuple:
+    """"" / "none" / "all" / comma list, same rules as parse_enrich"""
+    value = (value or "").strip().lower()
+    if value in ("", "none"):
+        return ()
+    if value == "all":
+        return FACETS
+    names = {part.strip() for part in value.split(",") if part.strip()}
+    unknown = names - set(FACETS)
+    if unknown:
+        raise ValueError(f"Unknown facet(s): {', '.join(sorted(unknown))}")
+    return tuple(f for f in FACETS if f in names)
+
+
+def make_filters(year_from: int = None, year_to: int = None, genre: str = None, author: str = None) -> dict:
+    """The filters that were actually given, genre / author in canonical form"""
+    filters = {
+        "year_from": year_from,
+        "year_to": year_to,
+        "genre": canonical_query(genre) if genre else None,
+        "author": canonical_query(author) if author else None,
+    }
+    return {k: v for k, v in filters.items() if v not in (None, "")}
+
+
+def upstream_terms(filters: dict) -> str:
+    """The filters in OpenLibrary's query syntax, appended to q so upstream counts and pages the filtered set"""
+    terms = []
+    if "year_from" in filters or "year_to" in filters:
+        terms.append(f"first_publish_year:[{filters.get('year_from', '*')} TO {filters.get('year_to', '*')}]")
+    if "genre" in filters:
+        terms.append(f'subject:"{filters["genre"]}"')
+    if "author" in filters:
+        terms.append(f'author:"{filters["author"]}"')
+    return " ".join(terms)
+
+
+def _loose_pattern(value: str) -> str:
+    """Regex for a canonical value that ignores case and punctuation between its words, like canonical_query"""
+    return r"[\W_]+".join(re.escape(word) for word in value.split())
+
+
+_AUTHOR = {"$trim": {"input": {"$concat": [{"$ifNull": ["$authorF", ""]}, " ", {"$ifNull": ["$authorL", ""]}]}}}
+
+# Value each sort key orders by, "" / null sorts last whichever way round
+_SORT_VALUES = {
+    "year": "$date",
+    "title": {"$toLower": "$title"},
+    "author": {"$toLower": {"$cond": [{"$gt": [{"$ifNull": ["$authorL", ""]}, ""]}, "$authorL", {"$ifNull": ["$authorF", ""]}]}},
+}
+
+
+def catalog_match(filters: dict) -> dict:
+    """The filters as a $match on the books catalog"""
+    match = {}
+    if "year_from" in filters or "year_to" in filters:
+        match["date"] = {}
+        if "year_from" in filters:
+            match["date"]["$gte"] = filters["year_from"]
+        if "year_to" in filters:
+            match["date"]["$lte"] = filters["year_to"]
+    if "genre" in filters:
+        match["genre"] = {"$regex": f"^[\\W_]*{_loose_pattern(filters['genre'])}[\\W_]*$", "$options": "i"}
+    if "author" in filters:
+        match["$expr"] = {"$regexMatch": {"input": _AUTHOR, "regex": _loose_pattern(filters["author"]), "options": "i"}}
+    return match
+
+
+def _facet_stages(facet: str) -> list:
+    if facet == "genre":
+        return [
+            {"$match": {"genre": {"$nin": [None, ""]}}},
+            # "Science Fiction" and "science fiction" are one bucket, shown as first seen
+            {"$group": {"_id": {"$toLower": "$genre"}, "value": {"$first": "$genre"}, "count": {"$sum": 1}}},
+            {"$sort": {"count": -1, "_id": 1}},
+            {"$limit": FACET_LIMIT},
+        ]
+    if facet == "decade":
+        return [
+            {"$match": {"date": {"$type": "number"}}},
+            {"$group": {"_id": {"$subtract": ["$date", {"$mod": ["$date", 10]}]}, "count": {"$sum": 1}}},
+            {"$sort": {"count": -1, "_id": 1}},
+            {"$limit": FACET_LIMIT},
+        ]
+    return [
+        {"$addFields": {"_author": _AUTHOR}},
+        {"$match": {"_author": {"$ne": ""}}},
+        {"$group": {"_id": {"$toLower": "$_author"}, "value": {"$first": "$_author"}, "count": {"$sum": 1}}},
+        {"$sort": {"count": -1, "_id": 1}},
+        {"$limit": FACET_LIMIT},
+    ]
+
+
+def catalog_pipeline(book_title: str, filters: dict, sort: tuple, facets: tuple, page: int, page_size: int) -> list:
+    """
+    One aggregation over the books catalog: text match, filters, then a $facet with the
+    sorted page (paginated after filtering), the filtered total and the requested facets.
+    """
+    key, descending = sort
+    if key == "relevance":
+        ordering = [{"$sort": {"score": -1, "bID": 1}}]
+    else:
+        ordering = [
+            {"$addFields": {"_sort": _SORT_VALUES[key]}},
+            {"$addFields": {"_absent": {"$eq": [{"$ifNull": ["$_sort", ""]}, ""]}}},
+            {"$sort": {"_absent": 1, "_sort": -1 if descending else 1, "bID": 1}},
+        ]
+
+    branches = {
+        "results": ordering + [
+            {"$skip": (page - 1) * page_size},
+            {"$limit": page_size},
+            {"$project": {"_id": 0, "updated_at": 0, "search_hits": 0, "score": 0, "_sort": 0, "_absent": 0}},
+        ],
+        "total": [{"$count": "n"}],
+    }
+    for facet in facets:
+        branches[facet] = _facet_stages(facet)
+
+    return [
+        {"$match": {"$text": {"$search": text_search(book_title)}, **catalog_match(filters)}},
+        {"$addFields": {"score": {"$meta": "textScore"}}},
+        {"$facet": branches},
+    ]
+
+
+def facet_counts(row: dict, facets: tuple) -> dict:
+    """{facet: [{"value", "count"}, ...]} out of the $facet row"""
+    counts = {}
+    for facet in facets:
+        if facet == "decade":
+            counts[facet] = [{"value": f"{b['_id']}s", "count": b["count"]} for b in row.get(facet, [])]
+        else:
+            counts[facet] = [{"value": b["value"], "count": b["count"]} for b in row.get(facet, [])]
+    return counts
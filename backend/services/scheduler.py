@@ -0,0 +1,462 @@
+import asyncio
+import heapq
+import itertools
+import os
+import random
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+import httpx
+from backend.services.breaker import CircuitBreaker, CircuitOpenError
+
+# Priorities, lower goes first
+INTERACTIVE = 0   # the search call a user is waiting on
+ENRICHMENT = 1    # descriptions / covers for a page
+PREFETCH = 2      # speculative / background work
+
+MAX_CONCURRENCY = int(os.getenv("OUTBOUND_MAX_CONCURRENCY", "32"))
+DEFAULT_HOST_RATE = float(os.getenv("OUTBOUND_HOST_RATE", "20"))
+DEFAULT_HOST_BURST = float(os.getenv("OUTBOUND_HOST_BURST", "40"))
+# "host:rate:burst,host:rate:burst" to tune single hosts
+HOST_RATES = os.getenv("OUTBOUND_HOST_RATES", "openlibrary.org:15:30,covers.openlibrary.org:25:50")
+# Never sit on a Retry-After longer than this
+MAX_RETRY_AFTER = float(os.getenv("OUTBOUND_MAX_RETRY_AFTER", "60"))
+
+# Retries of idempotent calls on connection errors / 502 / 503 / 504, full-jitter exponential backoff
+MAX_RETRIES = int(os.getenv("OUTBOUND_MAX_RETRIES", "2"))
+RETRY_BASE = float(os.getenv("OUTBOUND_RETRY_BASE", "0.1"))
+RETRY_MAX_BACKOFF = float(os.getenv("OUTBOUND_RETRY_MAX_BACKOFF", "2"))
+RETRY_STATUSES = (502, 503, 504)
+# Hedging: a duplicate request goes out once the first is slower than this percentile of recent calls
+HEDGE_PERCENTILE = float(os.getenv("OUTBOUND_HEDGE_PERCENTILE", "0.95"))
+HEDGE_MIN_DELAY = float(os.getenv("OUTBOUND_HEDGE_MIN_DELAY", "0.05"))
+HEDGE_DEFAULT_DELAY = float(os.getenv("OUTBOUND_HEDGE_DEFAULT_DELAY", "1.0"))
+HEDGE_MIN_SAMPLES = int(os.getenv("OUTBOUND_HEDGE_MIN_SAMPLES", "20"))
+# Retries + hedges together may add at most this fraction of extra requests,
+# plus a small per-second floor so a quiet process can still retry at all
+RETRY_BUDGET_RATIO = float(os.getenv("OUTBOUND_RETRY_BUDGET_RATIO", "0.1"))
+RETRY_BUDGET_MIN_PER_SEC = float(os.getenv("OUTBOUND_RETRY_BUDGET_MIN_PER_SEC", "1"))
+
+
+def parse_host_rates(value: str) -> dict:
+    rates = {}
+    for item in (value or "").split(","):
+        parts = item.strip().split(":")
+        if len(parts) == 3:
+            rates[parts[0]] = (float(parts[1]), float(parts[2]))
+    return rates
+
+
+def parse_retry_after(value: str):
+    """Retry-After is either delay-seconds or an HTTP date. Returns seconds or None."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+class TokenBucket:
+    """
+    Plain token bucket: try_acquire takes a token only when one is there, wait_time says
+    how long until the next one. Waiters queue in the scheduler (by priority), never here.
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self) -> float:
+        """Seconds until a whole token is available, without taking it"""
+        self._refill()
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+    def try_acquire(self) -> bool:
+        """Take a token only if one is available right now, never goes into debt"""
+        self._refill()
+
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class RetryBudget:
+    """
+    Every original request deposits `ratio` of a token, every retry / hedge withdraws a whole one.
+    Caps extra load at roughly ratio * traffic however badly upstream is doing.
+    """
+
+    def __init__(self, ratio: float = RETRY_BUDGET_RATIO, min_per_sec: float = RETRY_BUDGET_MIN_PER_SEC):
+        self.ratio = ratio
+        self.cap = max(1.0, 100 * ratio)
+        self.balance = 0.0
+        self.floor = TokenBucket(min_per_sec, max(1.0, min_per_sec)) if min_per_sec > 0 else None
+
+    def deposit(self):
+        self.balance = min(self.cap, self.balance + self.ratio)
+
+    def withdraw(self) -> bool:
+        if self.balance >= 1:
+            self.balance -= 1
+            return True
+        return self.floor is not None and self.floor.try_acquire()
+
+
+def _failed(response: httpx.Response) -> bool:
+    """Counts against the host's breaker"""
+    return response.status_code >= 500 or response.status_code == 429
+
+
+def backoff(attempt: int, base: float = RETRY_BASE, cap: float = RETRY_MAX_BACKOFF) -> float:
+    """Full jitter: uniform over [0, base * 2^attempt], capped"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class OutboundScheduler:
+    """
+    Shared gate for every outbound call to OpenLibrary:
+      - global concurrency limit, freed slots go to the highest priority waiter
+      - per-host token bucket, tokens also go to the highest priority waiter first
+      - a host answering 429/503 with Retry-After is paused for that long
+      - per-host circuit breaker, calls to a failing / slow host fail fast with CircuitOpenError
+      - GETs are retried with jittered backoff and can be hedged, both paid for from one RetryBudget
+    """
+
+    def __init__(self, max_concurrency: int = MAX_CONCURRENCY, host_rates: dict = None,
+                 default_rate: float = DEFAULT_HOST_RATE, default_burst: float = DEFAULT_HOST_BURST,
+                 max_retries: int = MAX_RETRIES, retry_base: float = RETRY_BASE, retry_budget: RetryBudget = None):
+        self.max_concurrency = max_concurrency
+        self.host_rates = host_rates or {}
+        self.default_rate = default_rate
+        self.default_burst = default_burst
+        self.max_retries = max_retries
+        self.retry_base = retry_base
+        self.budget = retry_budget or RetryBudget()
+
+        self._active = 0
+        self._waiters = []  # heap of [priority, seq, future]
+        self._seq = itertools.count()
+        self._buckets: dict[str, TokenBucket] = {}
+        self._breakers: dict[str, CircuitBreaker] = {}
+        self._paused_until: dict[str, float] = {}
+        self._host_waiters: dict[str, list] = {}  # host -> heap of [priority, seq, future]
+        self._host_dispatchers: dict[str, asyncio.Task] = {}
+        self._host_waiting = 0
+        self._latencies: dict[str, deque] = {}
+
+        self.requests = 0
+        self.throttled = 0
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.budget_denied = 0
+
+    # --- public ---
+
+    async def request(self, client: httpx.AsyncClient, method: str, url: str, priority: int = ENRICHMENT,
+                      hedge: bool = False, **kwargs) -> httpx.Response:
+        """
+        hedge=True sends a duplicate once the call is slower than the host's usual p95 and takes
+        whichever answers first. Only use it for cheap idempotent GETs.
+        """
+        retries = self.max_retries if method == "GET" else 0
+        self.budget.deposit()
+
+        attempt = 0
+        while True:
+            try:
+                if hedge:
+                    response = await self._hedged(client, method, url, priority, **kwargs)
+                else:
+                    response = await self._send(client, method, url, priority, **kwargs)
+            except CircuitOpenError:
+                raise
+            except httpx.TransportError:
+                if attempt >= retries or not self._retry_allowed():
+                    raise
+            else:
+                # a Retry-After already paused the host, waiting it out here would hold the caller hostage
+                if (response.status_code not in RETRY_STATUSES or "Retry-After" in response.headers
+                        or attempt >= retries or not self._retry_allowed()):
+                    return response
+
+            attempt += 1
+            self.retries += 1
+            await asyncio.sleep(backoff(attempt, self.retry_base))
+
+    async def _send(self, client: httpx.AsyncClient, method: str, url: str, priority: int, **kwargs) -> httpx.Response:
+        host = httpx.URL(url).host
+        breaker = self.breaker(host)
+        # fail before queueing, waiting for a slot just to be rejected is what we want to avoid
+        breaker.before_call()
+        try:
+            await self._wait_for_host(host, priority)
+            await self._acquire_slot(priority)
+        except BaseException:
+            breaker.cancel()
+            raise
+
+        started = time.monotonic()
+        try:
+            self.requests += 1
+            response = await client.request(method, url, **kwargs)
+        except Exception:
+            breaker.record(True, time.monotonic() - started)
+            raise
+        except BaseException:
+            breaker.cancel()
+            raise
+        finally:
+            self._release_slot()
+        elapsed = time.monotonic() - started
+        breaker.record(_failed(response), elapsed)
+        self._observe(host, response, elapsed)
+        return response
+
+    @asynccontextmanager
+    async def stream(self, client: httpx.AsyncClient, method: str, url: str, priority: int = ENRICHMENT, **kwargs):
+        """
+        request() for big bodies: yields the response with the body still on the wire and keeps
+        the slot until the block exits, so a slow download counts against the concurrency limit
+        for as long as it actually runs. Not retried, a half-read body can't be replayed.
+        """
+        host = httpx.URL(url).host
+        breaker = self.breaker(host)
+        breaker.before_call()
+        try:
+            await self._wait_for_host(host, priority)
+            await self._acquire_slot(priority)
+        except BaseException:
+            breaker.cancel()
+            raise
+
+        started = time.monotonic()
+        elapsed = None
+        failed = cancelled = False
+        try:
+            self.requests += 1
+            async with client.stream(method, url, **kwargs) as response:
+                # judged on time to headers, a big body on a slow link isn't a slow host
+                elapsed = time.monotonic() - started
+                self._observe(host, response, elapsed)
+                failed = _failed(response)
+                yield response
+        except httpx.TransportError:
+            # the host dropped us, errors raised by the caller's own checks don't count
+            failed = True
+            raise
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+        finally:
+            self._release_slot()
+            if cancelled:
+                breaker.cancel()
+            else:
+                breaker.record(failed, time.monotonic() - started if elapsed is None else elapsed)
+
+    def _observe(self, host: str, response: httpx.Response, elapsed: float):
+        """Latency sample and Retry-After bookkeeping once the headers are in"""
+        if response.status_code < 500:
+            self._latencies.setdefault(host, deque(maxlen=200)).append(elapsed)
+
+        if response.status_code in (429, 503):
+            self.throttled += 1
+            self._note_retry_after(host, response.headers.get("Retry-After"))
+
+    async def _hedged(self, client: httpx.AsyncClient, method: str, url: str, priority: int, **kwargs) -> httpx.Response:
+        host = httpx.URL(url).host
+        first = asyncio.ensure_future(self._send(client, method, url, priority, **kwargs))
+        done, _ = await asyncio.wait({first}, timeout=self.hedge_delay(host))
+        if done or not self.breaker(host).available() or not self._retry_allowed():
+            return await first
+
+        self.hedges += 1
+        second = asyncio.ensure_future(self._send(client, method, url, priority, **kwargs))
+        pending = {first, second}
+        result = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None and task.result().status_code < 500:
+                        if task is second:
+                            self.hedge_wins += 1
+                        return task.result()
+                    result = task
+            # both failed, hand back the last failure so retry logic / the caller sees it
+            return result.result()
+        finally:
+            for task in pending:
+                task.cancel()
+            # let the loser give its slot back before we return
+            await asyncio.gather(*pending, return_exceptions=True)
+            for task in (first, second):
+                if task.done() and not task.cancelled():
+                    task.exception()  # the loser's error is expected, don't let asyncio log it
+
+    def hedge_delay(self, host: str) -> float:
+        samples = self._latencies.get(host)
+        if not samples or len(samples) < HEDGE_MIN_SAMPLES:
+            return HEDGE_DEFAULT_DELAY
+        ordered = sorted(samples)
+        index = min(len(ordered) - 1, int(HEDGE_PERCENTILE * len(ordered)))
+        return max(HEDGE_MIN_DELAY, ordered[index])
+
+    def _retry_allowed(self) -> bool:
+        if self.budget.withdraw():
+            return True
+        self.budget_denied += 1
+        return False
+
+    async def get(self, client: httpx.AsyncClient, url: str, priority: int = ENRICHMENT, **kwargs) -> httpx.Response:
+        return await self.request(client, "GET", url, priority=priority, **kwargs)
+
+    def available(self, url: str) -> bool:
+        """False while the host's breaker would reject a call, background work checks this first"""
+        return self.breaker(httpx.URL(url).host).available()
+
+    def queue_depth(self) -> int:
+        waiting_for_slot = sum(1 for _, _, fut in self._waiters if not fut.done())
+        return waiting_for_slot + self._host_waiting
+
+    def busy(self) -> bool:
+        return self._active >= self.max_concurrency or self.queue_depth() > 0
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        return {
+            "active": self._active,
+            "max_concurrency": self.max_concurrency,
+            "queue_depth": self.queue_depth(),
+            "requests": self.requests,
+            "throttled": self.throttled,
+            "paused_hosts": {
+                host: round(until - now, 2)
+                for host, until in self._paused_until.items() if until > now
+            },
+            "breakers": {host: breaker.stats() for host, breaker in self._breakers.items()},
+            "retries": self.retries,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "retry_budget": {"balance": round(self.budget.balance, 2), "denied": self.budget_denied},
+            "hedge_delay": {host: round(self.hedge_delay(host), 3) for host in self._latencies},
+        }
+
+    def breaker(self, host: str) -> CircuitBreaker:
+        breaker = self._breakers.get(host)
+        if breaker is None:
+            breaker = CircuitBreaker(host)
+            self._breakers[host] = breaker
+        return breaker
+
+    # --- internals ---
+
+    def _bucket(self, host: str) -> TokenBucket:
+        bucket = self._buckets.get(host)
+        if bucket is None:
+            rate, burst = self.host_rates.get(host, (self.default_rate, self.default_burst))
+            bucket = TokenBucket(rate, burst)
+            self._buckets[host] = bucket
+        return bucket
+
+    def _host_pause(self, host: str) -> float:
+        return self._paused_until.get(host, 0) - time.monotonic()
+
+    async def _wait_for_host(self, host: str, priority: int = ENRICHMENT):
+        """
+        Takes a host token. With a backlog on the host the call queues by priority, so an
+        interactive search goes ahead of a page's worth of enrichment instead of waiting
+        out the token debt it ran up.
+        """
+        loop = asyncio.get_running_loop()
+        waiters = self._host_waiters.setdefault(host, [])
+        while waiters and (waiters[0][2].done() or waiters[0][2].get_loop() is not loop):
+            heapq.heappop(waiters)
+        if not waiters and self._host_pause(host) <= 0 and self._bucket(host).try_acquire():
+            return
+
+        fut = loop.create_future()
+        heapq.heappush(waiters, [priority, next(self._seq), fut])
+        dispatcher = self._host_dispatchers.get(host)
+        if dispatcher is None or dispatcher.done() or dispatcher.get_loop() is not loop:
+            self._host_dispatchers[host] = asyncio.ensure_future(self._dispatch_host(host))
+
+        self._host_waiting += 1
+        try:
+            await fut
+        finally:
+            self._host_waiting -= 1
+
+    async def _dispatch_host(self, host: str):
+        """Hands out host tokens as they refill, always to the best waiter at that moment"""
+        loop = asyncio.get_running_loop()
+        waiters = self._host_waiters[host]
+        bucket = self._bucket(host)
+        while True:
+            # cancelled waiters, and leftovers from a previous event loop (tests)
+            while waiters and (waiters[0][2].done() or waiters[0][2].get_loop() is not loop):
+                heapq.heappop(waiters)
+            if not waiters:
+                return
+            delay = max(bucket.wait_time(), self._host_pause(host))
+            if delay > 0:
+                # re-check the top after sleeping, something more important may have arrived
+                await asyncio.sleep(delay)
+                continue
+            if bucket.try_acquire():
+                _, _, fut = heapq.heappop(waiters)
+                fut.set_result(None)
+
+    def _note_retry_after(self, host: str, header: str):
+        delay = parse_retry_after(header)
+        if delay is None:
+            return
+        until = time.monotonic() + min(delay, MAX_RETRY_AFTER)
+        self._paused_until[host] = max(until, self._paused_until.get(host, 0))
+
+    async def _acquire_slot(self, priority: int):
+        # free slots only exist while nobody live is queued, release hands them over directly
+        if self._active < self.max_concurrency:
+            self._active += 1
+            return
+
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, [priority, next(self._seq), fut])
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # the slot was handed over right as we got cancelled, pass it on
+                self._release_slot()
+            raise
+
+    def _release_slot(self):
+        while self._waiters:
+            _, _, fut = heapq.heappop(self._waiters)
+            if not fut.done():
+                # hand the slot straight over, _active stays the same
+                fut.set_result(None)
+                return
+        self._active -= 1
+
+
+# Process-wide, shared by every OpenBookAPI / ImageCacheService instance
+scheduler = OutboundScheduler(host_rates=parse_host_rates(HOST_RATES))
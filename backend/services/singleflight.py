@@ -0,0 +1,78 @@
+import asyncio
+import os
+import uuid
+from datetime import datetime, timedelta
+from pymongo.errors import DuplicateKeyError
+
+LEASE_TTL = float(os.getenv("SEARCH_LEASE_TTL", "30"))
+LEASE_POLL_INTERVAL = float(os.getenv("SEARCH_LEASE_POLL_INTERVAL", "0.1"))
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls for the same key inside one process.
+    The first caller runs the work, everyone else awaits the same task.
+    """
+
+    def __init__(self):
+        self._calls: dict = {}
+
+    def in_flight(self, key) -> bool:
+        return key in self._calls
+
+    async def do(self, key, fn):
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+
+        # shield so one client hanging up doesn't cancel the work for the rest
+        return await asyncio.shield(task)
+
+
+class MongoLease:
+    """
+    Cross-worker variant: a short-lived lease document per key.
+    Whoever holds the lease does the work, other workers poll for the result
+    until it shows up or the lease runs out.
+    Expired leases are purged by a TTL index on expires_at (see db_connect).
+    """
+
+    def __init__(self, collection, ttl: float = LEASE_TTL, poll_interval: float = LEASE_POLL_INTERVAL):
+        self.collection = collection
+        self.ttl = ttl
+        self.poll_interval = poll_interval
+        self.owner = uuid.uuid4().hex
+
+    async def acquire(self, key: str) -> bool:
+        now = datetime.utcnow()
+        try:
+            # Only matches a missing or expired lease, a live one makes the upsert collide on _id
+            await self.collection.update_one(
+                {"_id": key, "expires_at": {"$lte": now}},
+                {"$set": {"owner": self.owner, "expires_at": now + timedelta(seconds=self.ttl)}},
+                upsert=True
+            )
+            return True
+        except DuplicateKeyError:
+            return False
+
+    async def release(self, key: str):
+        await self.collection.delete_one({"_id": key, "owner": self.owner})
+
+    async def wait(self, key: str, check):
+        """Poll check() until it returns something or the lease is gone. Returns None on give up."""
+        give_up = datetime.utcnow() + timedelta(seconds=self.ttl)
+        while datetime.utcnow() < give_up:
+            result = await check()
+            if result:
+                return result
+
+            lease = await self.collection.find_one({"_id": key})
+            if not lease or lease["expires_at"] <= datetime.utcnow():
+                # holder finished or died, one last look before doing it ourselves
+                return await check()
+
+            await asyncio.sleep(self.poll_interval)
+        return None
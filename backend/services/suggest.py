@@ -0,0 +1,137 @@
+from bisect import bisect_left, insort
+import heapq
+import os
+from backend.services.util import canonical_query
+
+# Bound on distinct suggestion strings kept per process, past it the least popular go
+SUGGEST_MAX_ENTRIES = int(os.getenv("SUGGEST_MAX_ENTRIES", "200000"))
+# Share of the index evicted at once when full, so a stream of new keys doesn't rebuild it every time
+SUGGEST_EVICT_FRACTION = 0.1
+# Catalog books read at startup, most searched first
+SUGGEST_SEED_BOOKS = int(os.getenv("SUGGEST_SEED_BOOKS", "50000"))
+# How many prefix matches we look at before ranking, keeps 1-2 letter prefixes cheap
+SUGGEST_MAX_SCAN = int(os.getenv("SUGGEST_MAX_SCAN", "1000"))
+
+# Popularity weights: a search typed by a user counts more than a title seen on a result page
+QUERY_WEIGHT = 1.0
+RESULT_WEIGHT = 0.1
+
+
+class PrefixIndex:
+    """
+    Sorted array of canonical strings, prefix lookups are a bisect plus a bounded scan.
+    Each entry keeps the display text, what it is (query / title / author) and a popularity score.
+    """
+
+    def __init__(self, max_entries: int = SUGGEST_MAX_ENTRIES, max_scan: int = SUGGEST_MAX_SCAN):
+        self.max_entries = max_entries
+        self.max_scan = max_scan
+        self._keys = []
+        self._entries: dict[str, list] = {}  # key -> [score, text, kind]
+        self.evicted = 0
+
+    def add(self, text: str, kind: str, weight: float = 1.0, key: str = None):
+        """key lets one text be found under another spelling, e.g. an author by surname"""
+        key = canonical_query(key if key is not None else text or "")
+        if not key:
+            return
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            entry[0] += weight
+            # a real title / author name reads better than the normalized query
+            if entry[2] == "query" and kind != "query":
+                entry[1], entry[2] = text, kind
+            return
+
+        if len(self._entries) >= self.max_entries:
+            self._evict()
+        self._entries[key] = [weight, text, kind]
+        insort(self._keys, key)
+
+    def _evict(self):
+        """Drop the lowest scores in one pass, rebuilding the sorted keys once per batch"""
+        n = max(1, int(len(self._entries) * SUGGEST_EVICT_FRACTION))
+        for key in heapq.nsmallest(n, self._entries, key=lambda key: self._entries[key][0]):
+            del self._entries[key]
+        self._keys = [key for key in self._keys if key in self._entries]
+        self.evicted += n
+
+    def record_query(self, book_title: str):
+        self.add(canonical_query(book_title), "query", QUERY_WEIGHT)
+
+    def add_books(self, books: list, weight: float = RESULT_WEIGHT):
+        for book in books:
+            self.add(book.get("title", ""), "title", weight)
+            author = f"{book.get('authorF', '')} {book.get('authorL', '')}".strip()
+            if author:
+                self.add(author, "author", weight)
+                if book.get("authorF") and book.get("authorL"):
+                    self.add(author, "author", weight, key=book["authorL"])
+
+    def suggest(self, prefix: str, limit: int = 10) -> list[dict]:
+        prefix = canonical_query(prefix or "")
+        if not prefix:
+            return []
+
+        start = bisect_left(self._keys, prefix)
+        matches = []
+        for key in self._keys[start:start + self.max_scan]:
+            if not key.startswith(prefix):
+                break
+            matches.append(key)
+
+        suggestions = []
+        seen = set()
+        for key in sorted(matches, key=lambda key: self._entries[key][0], reverse=True):
+            _, text, kind = self._entries[key]
+            if text in seen:
+                continue
+            seen.add(text)
+            suggestions.append({"text": text, "kind": kind})
+            if len(suggestions) == limit:
+                break
+        return suggestions
+
+    def clear(self):
+        self._keys = []
+        self._entries = {}
+
+    def __len__(self):
+        return len(self._keys)
+
+    def stats(self) -> dict:
+        return {"entries": len(self._keys), "max_entries": self.max_entries, "evicted": self.evicted}
+
+
+async def build_suggest_index(database, index: "PrefixIndex" = None, max_books: int = SUGGEST_SEED_BOOKS) -> int:
+    """
+    Seed the index from what Mongo already knows: every cached search title (weighted by
+    how many pages of it were cached), the max_books catalog books that came up in the most
+    searches and books saved in collections.
+    """
+    index = suggest_index if index is None else index
+
+    cursor = database.search_cache.find({}, {"title": 1})
+    async for doc in cursor:
+        index.record_query(doc.get("title", ""))
+
+    # dump-only books have no search_hits and sort last
+    cursor = (
+        database.books.find({}, {"title": 1, "authorF": 1, "authorL": 1})
+        .sort([("search_hits", -1)])
+        .limit(max_books)
+    )
+    async for doc in cursor:
+        index.add_books([doc])
+
+    cursor = database.collections.find({}, {"books.title": 1, "books.authorF": 1, "books.authorL": 1})
+    async for doc in cursor:
+        # somebody cared enough to save it
+        index.add_books(doc.get("books", []), weight=QUERY_WEIGHT)
+
+    return len(index)
+
+
+# Process-wide, filled at startup and kept current from OpenBookAPI
+suggest_index = PrefixIndex()
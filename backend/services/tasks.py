@@ -0,0 +1,38 @@
+import asyncio
+
+# Strong refs, the event loop only keeps weak ones to running tasks
+_tasks: set = set()
+
+
+def spawn(coro, name: str = None) -> asyncio.Task:
+    """Fire-and-forget a coroutine. Errors get logged instead of vanishing."""
+    task = asyncio.ensure_future(coro)
+    if name:
+        task.set_name(name)
+    _tasks.add(task)
+    task.add_done_callback(_done)
+    return task
+
+
+def _done(task: asyncio.Task):
+    _tasks.discard(task)
+    if task.cancelled():
+        return
+    exc = task.exception()
+    if exc is not None:
+        print(f"Background task {task.get_name()} failed: {exc!r}")
+
+
+def running() -> int:
+    return len(_tasks)
+
+
+async def shutdown(timeout: float = 5.0):
+    """Give background work a moment to finish, then cancel whatever is left."""
+    if not _tasks:
+        return
+    _, pending = await asyncio.wait(list(_tasks), timeout=timeout)
+    for task in pending:
+        task.cancel()
+    if pending:
+        await asyncio.gather(*pending, return_exceptions=True)
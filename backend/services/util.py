@@ -1,11 +1,56 @@
+import multiprocessing
 import re
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import quote_plus
+
+
+def canonical_query(string: str) -> str:
+    """
+    Canonical form of a search query. Used for the search cache key and the upstream
+    query, so "Lord of the Rings", "lord  of the rings " and "lord+of+the+rings" are one entry.
+    """
+    string = unicodedata.normalize("NFKC", string)
+    # a literal + is how people (and some clients) spell a space in a query
+    string = string.replace("+", " ")
+    string = string.casefold()
+
+    # fold punctuation and symbols into spaces, keep letters / digits / combining marks of any script
+    string = "".join(ch if unicodedata.category(ch)[0] in "LNM" else " " for ch in string)
+    string = re.sub(r"\s+", " ", string).strip()
 
-def sanitize_string(string: str):
-    string = string.lower().strip()
-    string = re.sub(r"\s+", "+", string)
-        
     return string
 
 
+def text_search(string: str) -> str:
+    """
+    Mongo $text search string that needs every word: $text ORs plain terms,
+    while quoted phrases are ANDed. "Harry Potter" -> '"harry" "potter"'.
+    """
+    return " ".join(f'"{word}"' for word in canonical_query(string).split())
+
+
+def split_author(full: str) -> tuple[str, str]:
+    """"J. R. R. Tolkien" -> ("J.", "Tolkien"), single names only fill the first part"""
+    parts = (full or "").split()
+    authorF = parts[0] if parts else ""
+    authorL = parts[-1] if len(parts) > 1 else ""
+    return authorF, authorL
+
+
+def sanitize_string(string: str):
+    return quote_plus(canonical_query(string))
+
+
 if __name__ == "__main__":
-    print(sanitize_string("the    Lord  of the rings"))
\ No newline at end of file
+    print(sanitize_string("the    Lord  of the rings"))
+
+
+def process_pool(max_workers: int) -> ProcessPoolExecutor:
+    """
+    Process pool whose workers don't fork the running app: a forked child inherits the event
+    loop, open sockets and any lock another thread held at fork time. forkserver where the
+    platform has it, spawn elsewhere (Windows, macOS default).
+    """
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context(method))
@@ -16,6 +16,27 @@ def event_loop():
     loop.close()
 
 
+@pytest.fixture(autouse=True)
+def reset_service_state():
+    """Module-level caches and indexes outlive a test, start every test with them empty"""
+    from backend.services import openbook, local_search, image_cache
+    from backend.services.suggest import suggest_index
+
+    openbook.invalidate_search_cache()
+    openbook._partial_pages.clear()
+    local_search.local_memory.invalidate()
+    suggest_index.clear()
+    image_cache._rendering.clear()
+    yield
+
+
+@pytest.fixture
+async def app_client() -> AsyncGenerator[AsyncClient, None]:
+    """HTTP client for the app with no database behind it, for checks that never reach Mongo"""
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        yield ac
+
+
 @pytest.fixture(scope="function")
 async def test_db():
     """Create a test database connection"""
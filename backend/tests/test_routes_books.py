@@ -1,5 +1,6 @@
 import pytest
-from unittest.mock import patch, Mock
+from unittest.mock import patch, Mock, AsyncMock
+from backend.services.openbook import MAX_PAGE_SIZE
 
 
 @pytest.mark.asyncio
@@ -149,3 +150,67 @@ class TestBooksRoutes:
 
             assert response.status_code == 200
             # No 401 Unauthorized
+
+
+@pytest.mark.asyncio
+class TestBooksRouteParams:
+    """Test query parameter validation and routing, no database or OpenLibrary involved"""
+
+    @staticmethod
+    def mock_api():
+        api = Mock()
+        api.search = AsyncMock(return_value={"count": 0, "results": []})
+        api.refined_search = AsyncMock(return_value={"count": 0, "results": []})
+        return api
+
+    async def test_unknown_enrich_rejected(self, app_client):
+        """Test that an unknown enrich value is a 422, not a silent default"""
+        with patch("backend.routes.books.OpenBookAPI", return_value=self.mock_api()):
+            response = await app_client.get("/books/dune?enrich=covers")
+
+        assert response.status_code == 422
+
+    @pytest.mark.parametrize("page_size, status", [(0, 422), (1, 200), (MAX_PAGE_SIZE, 200), (MAX_PAGE_SIZE + 1, 422)])
+    async def test_page_size_bounds(self, app_client, page_size, status):
+        """Test that page_size is accepted from 1 up to MAX_PAGE_SIZE and passed through"""
+        api = self.mock_api()
+        with patch("backend.routes.books.OpenBookAPI", return_value=api):
+            response = await app_client.get(f"/books/dune?page_size={page_size}")
+
+        assert response.status_code == status
+        if status == 200:
+            assert api.search.await_args.kwargs["page_size"] == page_size
+
+    async def test_suggest_not_taken_as_book_name(self, app_client):
+        """Test that /books/suggest reaches the typeahead route, not a search for "suggest" """
+        from backend.services.suggest import suggest_index
+
+        suggest_index.add("Dune", "title")
+        api = self.mock_api()
+        with patch("backend.routes.books.OpenBookAPI", return_value=api):
+            response = await app_client.get("/books/suggest?prefix=du")
+
+        assert response.status_code == 200
+        assert response.json() == {"prefix": "du", "suggestions": [{"text": "Dune", "kind": "title"}]}
+        api.search.assert_not_awaited()
+
+    @pytest.mark.parametrize("query", ["sort=rating", "facets=publisher"])
+    async def test_unknown_sort_and_facets_rejected(self, app_client, query):
+        """Test that unknown sort / facets values are a 422"""
+        with patch("backend.routes.books.OpenBookAPI", return_value=self.mock_api()):
+            response = await app_client.get(f"/books/dune?{query}")
+
+        assert response.status_code == 422
+
+    async def test_refinement_goes_to_refined_search(self, app_client):
+        """Test that filters / sort / facets switch to the catalog-wide refined search"""
+        api = self.mock_api()
+        with patch("backend.routes.books.OpenBookAPI", return_value=api):
+            response = await app_client.get("/books/dune?year_from=1960&sort=-year&facets=decade")
+
+        assert response.status_code == 200
+        kwargs = api.refined_search.await_args.kwargs
+        assert kwargs["filters"] == {"year_from": 1960}
+        assert kwargs["sort"] == ("year", True)
+        assert kwargs["facets"] == ("decade",)
+        api.search.assert_not_awaited()
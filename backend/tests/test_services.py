@@ -1,9 +1,72 @@
+import asyncio
 import pytest
 from unittest.mock import Mock, patch, AsyncMock
-from backend.services.util import sanitize_string
+from backend.services.util import canonical_query, sanitize_string
 from backend.services.openbook import OpenBookAPI
 
 
+def mock_openlibrary_client(search_docs, descriptions=None, num_found=None):
+    """httpx client that answers search.json and works/{id}.json from canned data"""
+    import httpx
+
+    descriptions = descriptions or {}
+
+    def handler(request):
+        path = request.url.path
+        if path == "/search.json":
+            return httpx.Response(200, json={
+                "num_found": len(search_docs) if num_found is None else num_found,
+                "docs": search_docs,
+            })
+        if path.startswith("/works/"):
+            work_id = path.split("/")[-1].replace(".json", "")
+            if work_id in descriptions:
+                return httpx.Response(200, json={"description": descriptions[work_id]})
+            return httpx.Response(200, json={})
+        return httpx.Response(404)
+
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+class AsyncCursor:
+    """Stand-in for a motor cursor over a fixed list of docs"""
+
+    def __init__(self, docs):
+        self._docs = list(docs)
+
+    def __aiter__(self):
+        return self._iter()
+
+    async def _iter(self):
+        for doc in self._docs:
+            yield doc
+
+    def sort(self, *args, **kwargs):
+        return self
+
+    def skip(self, n):
+        return self
+
+    def limit(self, n):
+        return self
+
+
+def mock_search_db():
+    """Mongo stand-in with empty caches"""
+    db = Mock()
+    db.search_cache.find_one = AsyncMock(return_value=None)
+    db.search_cache.update_one = AsyncMock()
+    db.search_leases.update_one = AsyncMock()
+    db.search_leases.delete_one = AsyncMock()
+    db.descriptions.find = Mock(return_value=AsyncCursor([]))
+    db.descriptions.bulk_write = AsyncMock()
+    db.books.find = Mock(return_value=AsyncCursor([]))
+    db.books.bulk_write = AsyncMock()
+    db.image_cache.find = Mock(return_value=AsyncCursor([]))
+    db.image_cache.bulk_write = AsyncMock()
+    return db
+
+
 class TestUtilService:
     """Test utility functions"""
 
@@ -47,6 +110,24 @@ class TestUtilService:
         result = sanitize_string("     ")
         assert result == ""
 
+    def test_canonical_query_equivalent_spellings(self):
+        """Test that trivially different spellings share one canonical form"""
+        forms = {canonical_query(q) for q in ("Lord of the Rings", "lord  of the rings ", "lord+of+the+rings")}
+        assert forms == {"lord of the rings"}
+
+    def test_canonical_query_punctuation_and_unicode(self):
+        """Test that punctuation folds to spaces and compatibility forms are normalized"""
+        assert canonical_query("Harry Potter: the Philosopher's Stone!") == "harry potter the philosopher s stone"
+        assert canonical_query("ＳＴＲＡßＥ") == "strasse"
+        assert canonical_query("Café") == canonical_query("Cafe\u0301")
+
+    def test_text_search_requires_every_word(self):
+        """Test that each word becomes a quoted phrase, which Mongo's $text ANDs"""
+        from backend.services.util import text_search
+
+        assert text_search("Harry  Potter!") == '"harry" "potter"'
+        assert text_search("   ") == ""
+
 
 class TestOpenBookAPI:
     """Test OpenLibrary API integration"""
@@ -242,3 +323,1760 @@ class TestOpenBookAPI:
 
         book = result["results"][0]
         assert book["image"] == ""
+
+
+class TestHttpClient:
+    """Test the shared pooled HTTP client"""
+
+    async def test_host_limited_transport_caps_per_host(self):
+        """Test that in-flight requests are capped per host, not globally"""
+        import asyncio
+        import httpx
+        from backend.services.http_client import HostLimitedTransport
+
+        in_flight = {}
+        peak = {}
+
+        async def handler(request):
+            host = request.url.host
+            in_flight[host] = in_flight.get(host, 0) + 1
+            peak[host] = max(peak.get(host, 0), in_flight[host])
+            await asyncio.sleep(0.01)
+            in_flight[host] -= 1
+            return httpx.Response(200, json={"ok": True})
+
+        transport = HostLimitedTransport(httpx.MockTransport(handler), max_per_host=2)
+        async with httpx.AsyncClient(transport=transport) as client:
+            await asyncio.gather(
+                *[client.get("https://a.example/x") for _ in range(6)],
+                *[client.get("https://b.example/x") for _ in range(6)],
+            )
+
+        assert peak == {"a.example": 2, "b.example": 2}
+
+    async def test_host_limited_transport_releases_on_error(self):
+        """Test that a failed request gives its host slot back"""
+        import httpx
+        from backend.services.http_client import HostLimitedTransport
+
+        def handler(request):
+            raise httpx.ConnectError("boom")
+
+        transport = HostLimitedTransport(httpx.MockTransport(handler), max_per_host=1)
+        async with httpx.AsyncClient(transport=transport) as client:
+            for _ in range(3):
+                with pytest.raises(httpx.ConnectError):
+                    await client.get("https://a.example/x")
+
+
+class TestSingleFlight:
+    """Test request coalescing for identical searches"""
+
+    async def test_concurrent_calls_share_one_execution(self):
+        """Test that concurrent callers with the same key run the work once"""
+        import asyncio
+        from backend.services.singleflight import SingleFlight
+
+        flight = SingleFlight()
+        calls = 0
+
+        async def work():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return {"count": 1}
+
+        results = await asyncio.gather(*[flight.do(("gatsby", 1), work) for _ in range(5)])
+
+        assert calls == 1
+        assert all(r == {"count": 1} for r in results)
+        assert not flight.in_flight(("gatsby", 1))
+
+    async def test_cancelled_caller_does_not_cancel_shared_work(self):
+        """Test that one caller going away doesn't kill the work for the others"""
+        import asyncio
+        from backend.services.singleflight import SingleFlight
+
+        flight = SingleFlight()
+
+        async def work():
+            await asyncio.sleep(0.02)
+            return "done"
+
+        first = asyncio.ensure_future(flight.do("k", work))
+        second = asyncio.ensure_future(flight.do("k", work))
+        await asyncio.sleep(0)
+        first.cancel()
+
+        assert await second == "done"
+
+    async def test_mongo_lease_held_by_other_worker(self):
+        """Test that a live lease held elsewhere is not acquired"""
+        from pymongo.errors import DuplicateKeyError
+        from backend.services.singleflight import MongoLease
+
+        collection = AsyncMock()
+        collection.update_one.side_effect = DuplicateKeyError("dup")
+
+        lease = MongoLease(collection)
+        assert await lease.acquire("gatsby|1") is False
+
+        collection.update_one.side_effect = None
+        assert await lease.acquire("gatsby|1") is True
+
+
+class TestSearchMemoryCache:
+    """Test the in-process TTL/LRU tier in front of search_cache"""
+
+    def test_lru_eviction_by_entry_count(self):
+        """Test that the least recently used entry goes first"""
+        from backend.services.memory_cache import TTLCache
+
+        cache = TTLCache(max_entries=2, max_bytes=1024, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+
+        assert "a" in cache
+        assert "b" not in cache
+        assert cache.evictions == 1
+
+    def test_eviction_by_byte_size(self):
+        """Test that the byte budget is enforced"""
+        from backend.services.memory_cache import TTLCache
+
+        cache = TTLCache(max_entries=100, max_bytes=10, ttl=60)
+        cache.set("a", "x", size=6)
+        cache.set("b", "y", size=6)
+
+        assert len(cache) == 1
+        assert cache.bytes == 6
+        assert cache.get("b") == "y"
+
+    def test_expired_entries_count_as_miss(self):
+        """Test TTL expiry and hit/miss counters"""
+        from backend.services.memory_cache import TTLCache
+
+        cache = TTLCache(ttl=60)
+        cache.set("fresh", 1)
+        cache.set("stale", 2, ttl=-1)
+
+        assert cache.get("fresh") == 1
+        assert cache.get("stale") is None
+        assert cache.stats()["hits"] == 1
+        assert cache.stats()["misses"] == 1
+
+    async def test_search_served_from_memory_without_mongo(self):
+        """Test that a hot query doesn't touch Mongo and can be invalidated"""
+        from backend.services import openbook
+
+        from datetime import datetime
+
+        db = Mock()
+        db.search_cache.find_one = AsyncMock(return_value={
+            "data": {"count": 1, "results": []},
+            "fetched_at": datetime.utcnow(),
+        })
+
+        api = OpenBookAPI(db, client=Mock())
+        await api.search("Gatsby")
+        await api.search("gatsby")
+
+        assert db.search_cache.find_one.await_count == 1
+
+        assert openbook.invalidate_search_cache("GATSBY") == 1
+        await api.search("gatsby")
+        assert db.search_cache.find_one.await_count == 2
+
+
+class TestStaleWhileRevalidate:
+    """Test soft TTL refresh of cached searches and descriptions"""
+
+    def test_is_stale(self):
+        """Test soft TTL check, legacy docs without fetched_at are stale"""
+        from datetime import datetime, timedelta
+        from backend.services.openbook import is_stale
+
+        assert is_stale({}, 60)
+        assert is_stale({"fetched_at": datetime.utcnow() - timedelta(seconds=120)}, 60)
+        assert not is_stale({"fetched_at": datetime.utcnow()}, 60)
+
+    async def test_stale_description_served_and_refreshed(self):
+        """Test that a stale description is returned right away and refreshed in the background"""
+        from datetime import datetime, timedelta
+        from backend.services import tasks
+        from backend.services.scheduler import PREFETCH
+
+        db = mock_search_db()
+        db.descriptions.find = Mock(return_value=AsyncCursor([{
+            "work_id": "OL1W",
+            "description": "old",
+            "fetched_at": datetime.utcnow() - timedelta(days=365),
+        }]))
+
+        api = OpenBookAPI(db, client=Mock())
+        api._fetch_description = AsyncMock(return_value="new")
+
+        assert await api.get_description_cached("OL1W", db) == "old"
+        await tasks.shutdown()
+
+        # background refresh runs below interactive and enrichment traffic
+        api._fetch_description.assert_awaited_once_with("OL1W", PREFETCH)
+        update = db.descriptions.bulk_write.await_args[0][0][0]._doc["$set"]
+        assert update["description"] == "new"
+        assert "fetched_at" in update
+
+    async def test_fresh_description_not_refreshed(self):
+        """Test that a fresh description doesn't trigger an upstream call"""
+        from datetime import datetime
+
+        db = mock_search_db()
+        db.descriptions.find = Mock(return_value=AsyncCursor([{
+            "work_id": "OL2W",
+            "description": "fresh",
+            "fetched_at": datetime.utcnow(),
+        }]))
+
+        api = OpenBookAPI(db, client=Mock())
+        api._fetch_description = AsyncMock()
+
+        assert await api.get_description_cached("OL2W", db) == "fresh"
+        api._fetch_description.assert_not_awaited()
+
+    async def test_dump_description_never_revalidated(self):
+        """Test that an ingested description (no fetched_at) is served as is, not sent upstream"""
+        from backend.services import tasks
+
+        db = mock_search_db()
+        db.descriptions.find = Mock(return_value=AsyncCursor([{
+            "work_id": "OL3W",
+            "description": "from the dump",
+            "source": "dump",
+        }]))
+
+        api = OpenBookAPI(db, client=Mock())
+        api._fetch_description = AsyncMock()
+
+        assert await api.get_description_cached("OL3W", db) == "from the dump"
+        await tasks.shutdown()
+        api._fetch_description.assert_not_awaited()
+
+
+class TestSearchEnrichment:
+    """Test the cold search path against a mocked OpenLibrary"""
+
+    async def test_cold_search_enriches_and_caches(self):
+        """Test that a cold search fills in descriptions and images and writes the cache"""
+        db = mock_search_db()
+        client = mock_openlibrary_client(
+            [
+                {"key": "/works/OL123W", "title": "The Great Gatsby", "author_name": ["F. Scott Fitzgerald"],
+                 "first_publish_year": 1925, "subject": ["Fiction"], "cover_i": 12345},
+                {"key": "/works/OL456W", "title": "Unknown Book"},
+            ],
+            descriptions={"OL123W": {"value": "Jazz age"}},
+        )
+
+        api = OpenBookAPI(db, client=client)
+        api.image_cache.download_image = AsyncMock(return_value=(
+            "/static/images/12345.jpg", {"cover_id": "12345", "size_bytes": 10}
+        ))
+        result = await api.search("cold gatsby")
+
+        assert result["count"] == 2
+        gatsby, unknown = result["results"]
+        assert gatsby["sypnosis"] == "Jazz age"
+        assert gatsby["image"] == "/static/images/12345.jpg"
+        assert "cover_id" not in gatsby
+        assert unknown["sypnosis"] == "No Description Available"
+        assert unknown["image"] == ""
+        db.search_cache.update_one.assert_awaited_once()
+
+        # one query + one bulk write per collection, however many books are on the page
+        db.descriptions.find.assert_called_once()
+        db.descriptions.bulk_write.assert_awaited_once()
+        assert len(db.descriptions.bulk_write.await_args[0][0]) == 2
+        db.image_cache.find.assert_called_once()
+        db.image_cache.bulk_write.assert_awaited_once()
+
+    async def test_search_stream_sends_bare_results_then_patches(self):
+        """Test that the stream emits bare results first, then one patch per enrichment"""
+        db = mock_search_db()
+        client = mock_openlibrary_client(
+            [{"key": "/works/OL123W", "title": "The Great Gatsby", "cover_i": 12345}],
+            descriptions={"OL123W": "Jazz age"},
+        )
+
+        api = OpenBookAPI(db, client=client)
+        api.image_cache.download_image = AsyncMock(return_value=("/static/images/12345.jpg", None))
+        events = [event async for event in api.search_stream("stream gatsby")]
+
+        assert events[0]["type"] == "results"
+        assert events[0]["results"][0]["sypnosis"] == ""
+        assert events[0]["results"][0]["image"] == ""
+
+        patches = [e for e in events if e["type"] == "patch"]
+        assert {"type": "patch", "bID": "OL123W", "sypnosis": "Jazz age"} in patches
+        assert {"type": "patch", "bID": "OL123W", "image": "/static/images/12345.jpg"} in patches
+        assert events[-1] == {"type": "done"}
+
+
+class TestSearchEnrichmentLevels:
+    """Test enrich= selection and in-place upgrade of lean cache entries"""
+
+    def test_parse_enrich(self):
+        """Test parsing of the enrich query value"""
+        from backend.services.openbook import parse_enrich
+
+        assert parse_enrich("all") == ("description", "image")
+        assert parse_enrich("none") == ()
+        assert parse_enrich("image, description") == ("description", "image")
+        with pytest.raises(ValueError):
+            parse_enrich("synopsis")
+
+    async def test_lean_search_skips_enrichment(self):
+        """Test that enrich=none doesn't fan out and records its level in the cache"""
+        db = mock_search_db()
+        client = mock_openlibrary_client([{"key": "/works/OL1W", "title": "Lean", "cover_i": 7}])
+
+        api = OpenBookAPI(db, client=client)
+        api.get_descriptions_cached = AsyncMock()
+        api.image_cache.get_image_urls = AsyncMock()
+        result = await api.search("lean", enrich=())
+
+        assert result["results"][0]["sypnosis"] == ""
+        assert result["results"][0]["image"] == ""
+        api.get_descriptions_cached.assert_not_awaited()
+        api.image_cache.get_image_urls.assert_not_awaited()
+
+        stored = db.search_cache.update_one.await_args[0][1]["$set"]
+        assert stored["enriched"] == []
+        book = db.books.bulk_write.await_args[0][0][0]._doc
+        assert book["$set"]["cover_id"] == "7"
+        # a lean page must not blank out a catalog entry somebody else enriched
+        assert "sypnosis" not in book["$set"]
+        assert book["$setOnInsert"] == {"sypnosis": "", "image": ""}
+
+    async def test_lean_cache_entry_upgraded_in_place(self):
+        """Test that asking for images on a lean entry only runs the image enrichment"""
+        from datetime import datetime
+
+        db = mock_search_db()
+        db.search_cache.find_one = AsyncMock(return_value={
+            "title": "lean", "page": 1, "enriched": [], "fetched_at": datetime.utcnow(),
+            "data": {"count": 1, "results": [
+                {"bID": "OL1W", "title": "Lean", "sypnosis": "", "image": "", "cover_id": "7"}
+            ]},
+        })
+
+        api = OpenBookAPI(db, client=Mock())
+        api.get_descriptions_cached = AsyncMock()
+        api.image_cache.get_image_urls = AsyncMock(return_value={"7": "/static/images/7.jpg"})
+        result = await api.search("lean", enrich=("image",))
+
+        assert result["results"][0]["image"] == "/static/images/7.jpg"
+        assert "cover_id" not in result["results"][0]
+        api.get_descriptions_cached.assert_not_awaited()
+        stored = db.search_cache.update_one.await_args[0][1]["$set"]
+        assert stored["enriched"] == ["image"]
+
+
+class TestImageCacheService:
+    """Test cover caching"""
+
+    async def test_get_image_urls_batches_mongo_calls(self, tmp_path):
+        """Test that only disk misses hit Mongo, in one query, and downloads are written back in one bulk write"""
+        from backend.services.image_cache import ImageCacheService, cover_relpath, cover_url
+        from backend.services.scheduler import ENRICHMENT
+
+        (tmp_path / cover_relpath("1")).parent.mkdir(parents=True)
+        (tmp_path / cover_relpath("1")).write_bytes(b"on disk")
+        elsewhere = tmp_path / "elsewhere.jpg"
+        elsewhere.write_bytes(b"known to mongo")
+
+        db = mock_search_db()
+        db.image_cache.find = Mock(return_value=AsyncCursor([
+            {"cover_id": "2", "local_path": str(elsewhere)},
+        ]))
+
+        service = ImageCacheService(db, cache_dir=str(tmp_path), client=Mock())
+        service.download_image = AsyncMock(return_value=("/static/images/3.jpg", {"cover_id": "3"}))
+
+        urls = await service.get_image_urls(["1", "2", "3", None])
+
+        assert urls == {
+            "1": cover_url("1"),
+            # still in the old flat layout, served through the legacy URL
+            "2": "/static/images/2.jpg",
+            "3": "/static/images/3.jpg",
+        }
+        assert db.image_cache.find.call_args[0][0] == {"cover_id": {"$in": ["2", "3"]}}
+        service.download_image.assert_awaited_once_with("3", priority=ENRICHMENT)
+        db.image_cache.bulk_write.assert_awaited_once()
+
+    async def test_loaded_index_skips_disk_and_mongo_for_misses(self, tmp_path):
+        """Test that once the index is loaded misses cost no Mongo query and stale entries are dropped"""
+        from backend.services.image_cache import ImageCacheService, cover_relpath, cover_url
+
+        for cid in ("1", "2"):
+            (tmp_path / cover_relpath(cid)).parent.mkdir(parents=True, exist_ok=True)
+            (tmp_path / cover_relpath(cid)).write_bytes(b"on disk")
+        (tmp_path / "4.jpg").write_bytes(b"flat, waiting for the migration")
+        db = mock_search_db()
+        service = ImageCacheService(db, cache_dir=str(tmp_path), client=Mock())
+        assert await service.index.load() == 2
+
+        (tmp_path / cover_relpath("2")).unlink()
+        found, missing = await service.lookup_images(["1", "2", "3"])
+
+        assert found == {"1": cover_url("1")}
+        assert missing == ["2", "3"]
+        assert "2" not in service.index
+        db.image_cache.find.assert_not_called()
+
+    async def test_srcset_lists_rendered_thumbnails(self, tmp_path):
+        """Test that thumbnails found by the scan end up as srcset variants on search results"""
+        from backend.services.image_cache import ImageCacheService, cover_relpath, cover_url
+
+        for cid, variant in (("5", None), ("5", "s.webp"), ("5", "m.webp"), ("6", None)):
+            (tmp_path / cover_relpath(cid, variant)).parent.mkdir(parents=True, exist_ok=True)
+            (tmp_path / cover_relpath(cid, variant)).write_bytes(b"x")
+        db = mock_search_db()
+        api = OpenBookAPI(db, client=Mock())
+        api.image_cache = ImageCacheService(db, cache_dir=str(tmp_path), client=Mock())
+        await api.image_cache.index.load()
+
+        with_thumbs = api._public({"bID": "OL1W", "cover_id": "5", "image": cover_url("5")})
+        without = api._public({"bID": "OL2W", "cover_id": "6", "image": cover_url("6")})
+
+        assert with_thumbs["srcset"] == [
+            {"url": cover_url("5", "s.webp"), "width": 160, "type": "image/webp"},
+            {"url": cover_url("5", "m.webp"), "width": 320, "type": "image/webp"},
+        ]
+        assert "cover_id" not in with_thumbs
+        assert "srcset" not in without
+
+    def test_render_thumbnails(self, tmp_path):
+        """Test that every size is rendered, none wider than asked and none upscaled"""
+        pytest.importorskip("PIL")
+        from PIL import Image
+        from backend.services.image_cache import render_thumbnails
+
+        source = tmp_path / "9.jpg"
+        Image.new("RGB", (500, 750), "red").save(source, format="JPEG")
+
+        written = render_thumbnails(str(source), "9", {"s": 160, "l": 640}, ("webp",), 75)
+
+        assert set(written) == {"s.webp", "l.webp"}
+        with Image.open(tmp_path / "9-s.webp") as small, Image.open(tmp_path / "9-l.webp") as large:
+            assert small.width == 160
+            assert large.width == 500
+
+    @staticmethod
+    def covers_client(response):
+        import httpx
+        return httpx.AsyncClient(transport=httpx.MockTransport(lambda request: response))
+
+    async def test_download_streams_into_place(self, tmp_path):
+        """Test that a valid cover ends up on disk with no temp file left over"""
+        import httpx
+        from backend.services.image_cache import ImageCacheService, cover_relpath, cover_url
+
+        body = b"\xff\xd8" + b"x" * 200_000
+        client = self.covers_client(httpx.Response(200, headers={"Content-Type": "image/jpeg"}, content=body))
+        service = ImageCacheService(mock_search_db(), cache_dir=str(tmp_path), client=client)
+
+        url, doc = await service.download_image("42")
+
+        assert url == cover_url("42")
+        assert doc["size_bytes"] == len(body)
+        assert (tmp_path / cover_relpath("42")).read_bytes() == body
+        assert not list(tmp_path.rglob("*.part"))
+        assert "42" in service.index
+        await client.aclose()
+
+    async def test_thumbnails_rendered_after_download_returns(self, tmp_path):
+        """Test that the download doesn't wait for thumbnails, their metadata is written when they're done"""
+        import httpx
+        from backend.services import image_cache
+        from backend.services.image_cache import ImageCacheService
+
+        body = b"\xff\xd8" + b"x" * 1000
+        client = self.covers_client(httpx.Response(200, headers={"Content-Type": "image/jpeg"}, content=body))
+        db = mock_search_db()
+        db.image_cache.update_one = AsyncMock()
+        service = ImageCacheService(db, cache_dir=str(tmp_path), client=client)
+        rendered = asyncio.Event()
+
+        async def slow_render(cover_id):
+            await rendered.wait()
+            return {"s.webp": 30, "m.webp": 70}
+
+        with patch.object(image_cache, "THUMBNAILS_ENABLED", True), \
+                patch.object(service, "make_thumbnails", side_effect=slow_render):
+            url, doc = await service.download_image("43")
+            assert doc["size_bytes"] == len(body)
+            assert "variants" not in doc
+            db.image_cache.update_one.assert_not_awaited()
+
+            rendered.set()
+            await asyncio.sleep(0.01)
+
+        query, pipeline = db.image_cache.update_one.await_args[0]
+        assert query == {"cover_id": "43"}
+        assert pipeline[0]["$set"]["variants"] == ["m.webp", "s.webp"]
+        assert pipeline[0]["$set"]["thumbnail_bytes"] == 100
+        assert "43" not in image_cache._rendering
+        await client.aclose()
+
+    async def test_failed_render_not_retried_on_every_hit(self, tmp_path):
+        """Test that a cover Pillow can't render is queued once, while a broken pool is retried"""
+        from concurrent.futures import ThreadPoolExecutor
+        from concurrent.futures.process import BrokenProcessPool
+        from backend.services import image_cache
+        from backend.services.image_cache import ImageCacheService, cover_relpath
+
+        for cid in ("44", "45"):
+            (tmp_path / cover_relpath(cid)).parent.mkdir(parents=True, exist_ok=True)
+            (tmp_path / cover_relpath(cid)).write_bytes(b"not a jpeg")
+        service = ImageCacheService(mock_search_db(), cache_dir=str(tmp_path), client=Mock())
+        await service.index.load()
+        render = Mock(side_effect=OSError("cannot identify image file"))
+
+        async def hit(cid):
+            await service.lookup_images([cid])
+            await asyncio.sleep(0.01)
+
+        with ThreadPoolExecutor(1) as pool, patch.object(image_cache, "THUMBNAILS_ENABLED", True), \
+                patch.object(image_cache, "_get_thumbnail_pool", return_value=pool), \
+                patch.object(image_cache, "render_thumbnails", render):
+            await hit("44")
+            await hit("44")
+            assert render.call_count == 1
+            assert service.index.render_failed("44")
+
+            render.side_effect = BrokenProcessPool("worker died")
+            await hit("45")
+            await hit("45")
+            assert render.call_count == 3
+            assert not service.index.render_failed("45")
+
+        # a replaced file gets another go
+        service.index.discard("44")
+        assert not service.index.render_failed("44")
+
+    async def test_thumbnails_rendered_in_worker_process(self, tmp_path):
+        """Test the real pool: workers start clean (forkserver / spawn) and still find the renderer"""
+        pytest.importorskip("PIL")
+        from PIL import Image, features
+        if not features.check("webp"):
+            pytest.skip("Pillow built without webp")
+        from backend.services import image_cache
+        from backend.services.image_cache import ImageCacheService, cover_relpath
+
+        source = tmp_path / cover_relpath("46")
+        source.parent.mkdir(parents=True)
+        Image.new("RGB", (400, 600), "blue").save(source, format="JPEG")
+        service = ImageCacheService(mock_search_db(), cache_dir=str(tmp_path), client=Mock())
+
+        try:
+            with patch.object(image_cache, "THUMB_FORMATS", ("webp",)):
+                rendered = await service.make_thumbnails("46")
+        finally:
+            image_cache.shutdown_thumbnail_pool()
+
+        assert set(rendered) == {"s.webp", "m.webp", "l.webp"}
+        assert service.index.variants("46") == set(rendered)
+
+    async def test_invalid_downloads_leave_nothing_behind(self, tmp_path):
+        """Test that a truncated body or an HTML page falls back to the original URL without a file"""
+        import httpx
+        from backend.services.image_cache import ImageCacheService
+
+        for response in (
+            httpx.Response(200, headers={"Content-Type": "image/jpeg", "Content-Length": "1000"}, content=b"x" * 10),
+            httpx.Response(200, headers={"Content-Type": "text/html"}, content=b"<html>oops</html>"),
+        ):
+            client = self.covers_client(response)
+            service = ImageCacheService(mock_search_db(), cache_dir=str(tmp_path), client=client)
+
+            url, doc = await service.download_image("7")
+
+            assert url == "https://covers.openlibrary.org/b/id/7-L.jpg"
+            assert doc is None
+            assert [p for p in tmp_path.rglob("*") if p.is_file()] == []
+            await client.aclose()
+
+
+class TestOutboundScheduler:
+    """Test the shared outbound scheduler for OpenLibrary calls"""
+
+    def test_token_bucket_never_goes_into_debt(self):
+        """Test that a drained bucket refuses tokens and reports how long until the next one"""
+        from backend.services.scheduler import TokenBucket
+
+        bucket = TokenBucket(rate=10, burst=2)
+        assert bucket.wait_time() == 0
+        assert bucket.try_acquire()
+        assert bucket.try_acquire()
+        assert not bucket.try_acquire()
+        assert bucket.wait_time() == pytest.approx(0.1, abs=0.01)
+
+    def test_parse_retry_after(self):
+        """Test both Retry-After formats"""
+        from backend.services.scheduler import parse_retry_after
+
+        assert parse_retry_after("30") == 30
+        assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0
+        assert parse_retry_after("soon") is None
+        assert parse_retry_after(None) is None
+
+    async def test_freed_slot_goes_to_highest_priority(self):
+        """Test that interactive requests jump ahead of queued enrichment"""
+        import asyncio
+        import httpx
+        from backend.services.scheduler import OutboundScheduler, INTERACTIVE, ENRICHMENT
+
+        order = []
+        gate = asyncio.Event()
+
+        async def handler(request):
+            order.append(request.url.path)
+            if request.url.path == "/first":
+                await gate.wait()
+            return httpx.Response(200)
+
+        scheduler = OutboundScheduler(max_concurrency=1, default_rate=1000, default_burst=1000)
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            first = asyncio.ensure_future(scheduler.get(client, "https://a.example/first"))
+            await asyncio.sleep(0)
+            enrich = asyncio.ensure_future(scheduler.get(client, "https://a.example/enrich", priority=ENRICHMENT))
+            search = asyncio.ensure_future(scheduler.get(client, "https://a.example/search", priority=INTERACTIVE))
+            await asyncio.sleep(0)
+
+            assert scheduler.queue_depth() == 2
+            gate.set()
+            await asyncio.gather(first, enrich, search)
+
+        assert order == ["/first", "/search", "/enrich"]
+        assert scheduler.stats()["active"] == 0
+
+    async def test_host_tokens_go_to_highest_priority(self):
+        """Test that an interactive call doesn't wait out the token debt of an enrichment burst"""
+        import httpx
+        from backend.services.scheduler import OutboundScheduler, INTERACTIVE, ENRICHMENT
+
+        order = []
+
+        def handler(request):
+            order.append(request.url.path)
+            return httpx.Response(200)
+
+        scheduler = OutboundScheduler(max_concurrency=100, default_rate=100, default_burst=1)
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            burst = [
+                asyncio.ensure_future(scheduler.get(client, f"https://a.example/works/{i}", priority=ENRICHMENT))
+                for i in range(20)
+            ]
+            await asyncio.sleep(0.02)
+            search = asyncio.ensure_future(scheduler.get(client, "https://a.example/search", priority=INTERACTIVE))
+            await asyncio.gather(search, *burst)
+
+        # with tokens handed out in arrival order it would have come last
+        assert order.index("/search") <= 5
+
+    async def test_retry_after_pauses_host(self):
+        """Test that a 429 with Retry-After pauses further calls to that host"""
+        import httpx
+        from backend.services.scheduler import OutboundScheduler
+
+        def handler(request):
+            return httpx.Response(429, headers={"Retry-After": "30"})
+
+        scheduler = OutboundScheduler(default_rate=1000, default_burst=1000)
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            response = await scheduler.get(client, "https://a.example/x")
+
+        assert response.status_code == 429
+        stats = scheduler.stats()
+        assert stats["throttled"] == 1
+        assert 29 < stats["paused_hosts"]["a.example"] <= 30
+
+
+class TestSearchPageSize:
+    """Test the trimmed upstream request"""
+
+    async def test_upstream_request_has_fields_and_limit(self):
+        """Test that only needed fields are requested and page_size maps onto limit"""
+        import httpx
+
+        seen = []
+
+        def handler(request):
+            seen.append(request.url)
+            return httpx.Response(200, json={"num_found": 0, "docs": []})
+
+        db = mock_search_db()
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        api = OpenBookAPI(db, client=client)
+        await api.search("gatsby", page=2, page_size=20)
+
+        params = seen[0].params
+        assert params["limit"] == "20"
+        assert params["page"] == "2"
+        assert set(params["fields"].split(",")) == {
+            "key", "title", "author_name", "first_publish_year", "cover_i", "subject"
+        }
+        cache_key = db.search_cache.update_one.await_args[0][0]
+        assert cache_key == {"title": "gatsby", "page": 2, "page_size": 20}
+
+
+class TestSearchPrefetch:
+    """Test speculative prefetch of the next page"""
+
+    async def test_cold_search_prefetches_next_page(self):
+        """Test that a cold search warms page N+1 in the background"""
+        import httpx
+        from backend.services import tasks
+
+        pages = []
+
+        def handler(request):
+            pages.append(request.url.params["page"])
+            return httpx.Response(200, json={"num_found": 250, "docs": []})
+
+        db = mock_search_db()
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        api = OpenBookAPI(db, client=client)
+        await api.search("prefetch me", page=1)
+        await tasks.shutdown()
+
+        assert pages == ["1", "2"]
+        stored_keys = [call[0][0] for call in db.search_cache.update_one.await_args_list]
+        assert {"title": "prefetch me", "page": 2, "page_size": 100} in stored_keys
+
+    async def test_prefetch_dropped_when_scheduler_busy(self):
+        """Test that prefetch is skipped instead of queued behind real traffic"""
+        from backend.services import openbook
+
+        api = OpenBookAPI(mock_search_db(), client=Mock())
+        cache_key = {"title": "busy", "page": 1, "page_size": 100}
+        before = openbook.prefetch_stats["dropped_busy"]
+
+        with patch.object(openbook.scheduler, "busy", return_value=True):
+            api._prefetch_next_page("busy", cache_key, openbook.ENRICHMENTS, count=500)
+
+        assert openbook.prefetch_stats["dropped_busy"] == before + 1
+
+    def test_no_prefetch_past_last_page(self):
+        """Test that the last page doesn't trigger a prefetch"""
+        from backend.services import openbook
+
+        api = OpenBookAPI(mock_search_db(), client=Mock())
+        before = dict(openbook.prefetch_stats)
+        api._prefetch_next_page("last", {"title": "last", "page": 3, "page_size": 100}, (), count=300)
+
+        assert openbook.prefetch_stats == before
+
+
+class TestMergeSearchCacheMigration:
+    """Test the search_cache re-keying migration"""
+
+    async def test_duplicates_merged_into_best_entry(self):
+        """Test that the most enriched, freshest duplicate survives under the canonical title"""
+        from datetime import datetime
+        from backend.services.migrations import merge_search_cache_duplicates
+
+        docs = [
+            {"_id": 1, "title": "lord+of+the+rings", "page": 1, "page_size": 100,
+             "enriched": [], "fetched_at": datetime(2024, 5, 1)},
+            {"_id": 2, "title": "Lord of the Rings", "page": 1,
+             "enriched": ["description", "image"], "fetched_at": datetime(2024, 1, 1)},
+            {"_id": 3, "title": "lord of the rings", "page": 2, "page_size": 100},
+        ]
+        database = Mock()
+        database.search_cache.find = Mock(return_value=AsyncCursor(docs))
+        database.search_cache.delete_many = AsyncMock()
+        database.search_cache.update_one = AsyncMock()
+
+        result = await merge_search_cache_duplicates(database)
+
+        assert result == {"groups": 2, "merged": 1, "renamed": 1}
+        database.search_cache.delete_many.assert_awaited_once_with({"_id": {"$in": [1]}})
+        database.search_cache.update_one.assert_awaited_once_with(
+            {"_id": 2}, {"$set": {"title": "lord of the rings"}}
+        )
+
+
+class TestSuggestIndex:
+    """Test the typeahead prefix index"""
+
+    def test_prefix_matches_ranked_by_popularity(self):
+        """Test that matches come back most popular first and non-matches are left out"""
+        from backend.services.suggest import PrefixIndex
+
+        index = PrefixIndex()
+        index.record_query("harry potter")
+        index.add_books([{"title": "Harry Potter and the Goblet of Fire", "authorF": "J.K.", "authorL": "Rowling"}])
+        index.record_query("Harry Potter ")
+        index.record_query("hamlet")
+
+        suggestions = index.suggest("HAR")
+
+        assert [s["text"] for s in suggestions] == ["harry potter", "Harry Potter and the Goblet of Fire"]
+        assert index.suggest("row") == [{"text": "J.K. Rowling", "kind": "author"}]
+        assert index.suggest("zzz") == []
+
+    def test_title_display_wins_over_query(self):
+        """Test that a query matching a real title is shown with the title's casing"""
+        from backend.services.suggest import PrefixIndex
+
+        index = PrefixIndex()
+        index.record_query("dune")
+        index.add_books([{"title": "Dune"}])
+
+        assert index.suggest("du") == [{"text": "Dune", "kind": "title"}]
+        assert len(index) == 1
+
+    async def test_cache_write_updates_index(self):
+        """Test that a fresh search page feeds its titles into the index"""
+        from backend.services.suggest import suggest_index
+
+        client = mock_openlibrary_client([
+            {"key": "/works/OL1W", "title": "Neuromancer", "author_name": ["William Gibson"]}
+        ])
+
+        api = OpenBookAPI(mock_search_db(), client=client)
+        await api.search("neuro", enrich=())
+
+        texts = {s["text"] for s in suggest_index.suggest("neuro")}
+        assert texts == {"neuro", "Neuromancer"}
+        assert suggest_index.suggest("william") == [{"text": "William Gibson", "kind": "author"}]
+
+    async def test_build_from_mongo(self):
+        """Test seeding the index from search_cache, the catalog and saved collections"""
+        from backend.services.suggest import PrefixIndex, build_suggest_index
+
+        database = Mock()
+        database.search_cache.find = Mock(return_value=AsyncCursor([{"title": "tolkien"}]))
+        database.books.find = Mock(return_value=AsyncCursor([
+            {"title": "The Hobbit", "authorF": "J.R.R.", "authorL": "Tolkien"},
+        ]))
+        database.collections.find = Mock(return_value=AsyncCursor([
+            {"books": [{"title": "The Silmarillion"}]},
+        ]))
+
+        index = PrefixIndex()
+        assert await build_suggest_index(database, index) == 4
+        assert index.suggest("the") == [
+            {"text": "The Silmarillion", "kind": "title"},
+            {"text": "The Hobbit", "kind": "title"},
+        ]
+
+    async def test_build_reads_most_searched_books_only(self):
+        """Test that seeding from the catalog is a bounded, popularity-sorted read"""
+        from backend.services.suggest import PrefixIndex, build_suggest_index
+
+        database = Mock()
+        database.search_cache.find = Mock(return_value=AsyncCursor([]))
+        books = AsyncCursor([{"title": "Dune"}])
+        books.sort = Mock(return_value=books)
+        books.limit = Mock(return_value=books)
+        database.books.find = Mock(return_value=books)
+        database.collections.find = Mock(return_value=AsyncCursor([]))
+
+        await build_suggest_index(database, PrefixIndex(), max_books=500)
+
+        books.sort.assert_called_once_with([("search_hits", -1)])
+        books.limit.assert_called_once_with(500)
+
+    def test_full_index_evicts_least_popular(self):
+        """Test that a full index makes room by dropping its lowest scores, not by refusing new keys"""
+        from backend.services.suggest import PrefixIndex
+
+        index = PrefixIndex(max_entries=3)
+        index.add("popular", "query", weight=5)
+        index.add("rare", "query", weight=0.1)
+        index.add("middling", "query", weight=1)
+        index.add("newcomer", "query", weight=1)
+
+        assert len(index) == 3
+        assert index.suggest("rare") == []
+        assert index.suggest("new") == [{"text": "newcomer", "kind": "query"}]
+        assert index.suggest("pop") == [{"text": "popular", "kind": "query"}]
+        assert index.stats()["evicted"] == 1
+
+    async def test_empty_searches_not_recorded(self):
+        """Test that a query only becomes a suggestion once it found something"""
+        from backend.services.suggest import suggest_index
+
+        api = OpenBookAPI(mock_search_db(), client=mock_openlibrary_client([]))
+        await api.search("qwzxv", enrich=())
+
+        assert suggest_index.suggest("qwz") == []
+
+
+class TestBooksCatalog:
+    """Test search_cache pages stored as bID lists over the books catalog"""
+
+    async def test_cold_search_stores_bids_and_catalog(self):
+        """Test that the page only keeps ordered bIDs and the books go to the catalog in one bulk write"""
+        db = mock_search_db()
+        client = mock_openlibrary_client([
+            {"key": "/works/OL2W", "title": "Second"},
+            {"key": "/works/OL1W", "title": "First"},
+        ])
+
+        api = OpenBookAPI(db, client=client)
+        await api.search("catalog", enrich=())
+
+        update = db.search_cache.update_one.await_args[0][1]
+        assert update["$set"]["bids"] == ["OL2W", "OL1W"]
+        assert update["$set"]["count"] == 2
+        assert update["$unset"] == {"data": ""}
+        db.books.bulk_write.assert_awaited_once()
+        assert [op._filter for op in db.books.bulk_write.await_args[0][0]] == [{"bID": "OL2W"}, {"bID": "OL1W"}]
+
+    async def test_cached_page_rebuilt_with_one_in_query(self):
+        """Test that a cached page is rebuilt in its stored order from a single $in"""
+        from datetime import datetime
+
+        db = mock_search_db()
+        db.search_cache.find_one = AsyncMock(return_value={
+            "count": 40, "bids": ["OL2W", "OL1W"], "enriched": ["description", "image"],
+            "fetched_at": datetime.utcnow(),
+        })
+        db.books.find = Mock(return_value=AsyncCursor([
+            {"bID": "OL1W", "title": "First", "sypnosis": "one", "image": "", "cover_id": None},
+            {"bID": "OL2W", "title": "Second", "sypnosis": "two", "image": "", "cover_id": None},
+        ]))
+
+        api = OpenBookAPI(db, client=Mock())
+        result = await api.search("rebuilt")
+
+        assert result["count"] == 40
+        assert [b["title"] for b in result["results"]] == ["Second", "First"]
+        assert "cover_id" not in result["results"][0]
+        db.books.find.assert_called_once()
+        assert db.books.find.call_args[0][0] == {"bID": {"$in": ["OL2W", "OL1W"]}}
+        # bookkeeping fields stay out of responses, whichever tier the page came from
+        assert db.books.find.call_args[0][1]["search_hits"] == 0
+
+    async def test_page_with_missing_book_is_a_miss(self):
+        """Test that a page pointing at a book gone from the catalog is fetched again"""
+        from datetime import datetime
+
+        db = mock_search_db()
+        db.search_cache.find_one = AsyncMock(side_effect=[
+            {"count": 1, "bids": ["OL9W"], "enriched": [], "fetched_at": datetime.utcnow()},
+            None,
+        ])
+        client = mock_openlibrary_client([{"key": "/works/OL9W", "title": "Back Again"}])
+
+        api = OpenBookAPI(db, client=client)
+        result = await api.search("gone", enrich=())
+
+        assert result["results"][0]["title"] == "Back Again"
+        db.search_cache.update_one.assert_awaited_once()
+
+    async def test_normalize_search_cache_migration(self):
+        """Test that embedded pages move into the catalog without overwriting it"""
+        from backend.services.migrations import normalize_search_cache
+
+        database = Mock()
+        database.search_cache.find = Mock(return_value=AsyncCursor([
+            {"_id": 1, "data": {"count": 5, "results": [{"bID": "OL1W", "title": "One"}, {"bID": "OL2W", "title": "Two"}]}},
+        ]))
+        database.search_cache.update_one = AsyncMock()
+        database.books.bulk_write = AsyncMock()
+
+        assert await normalize_search_cache(database) == {"converted": 1, "books": 2}
+
+        op = database.books.bulk_write.await_args[0][0][0]._doc
+        assert set(op) == {"$setOnInsert"}
+        database.search_cache.update_one.assert_awaited_once_with(
+            {"_id": 1},
+            {"$set": {"count": 5, "bids": ["OL1W", "OL2W"]}, "$unset": {"data": ""}}
+        )
+
+
+class TestDumpIngest:
+    """Test offline loading of OpenLibrary dumps"""
+
+    @staticmethod
+    def write_dump(path, kind, records):
+        import gzip
+        import json
+
+        with gzip.open(path, "wt", encoding="utf-8") as f:
+            for record in records:
+                f.write(f"/type/{kind}\t{record.get('key', '')}\t1\t2024-01-01T00:00:00\t{json.dumps(record)}\n")
+            f.write("garbage line without json\n")
+
+    @staticmethod
+    def mock_ingest_db(checkpoint=None, authors=()):
+        database = Mock()
+        database.ingest_checkpoints.find_one = AsyncMock(return_value=checkpoint)
+        database.ingest_checkpoints.update_one = AsyncMock()
+        database.authors.find = Mock(return_value=AsyncCursor(authors))
+        database.authors.bulk_write = AsyncMock()
+        database.books.bulk_write = AsyncMock()
+        database.descriptions.bulk_write = AsyncMock()
+        return database
+
+    def test_parse_work(self):
+        """Test turning a dump work record into a catalog row"""
+        from backend.services.ingest import parse_work
+
+        row = parse_work({
+            "key": "/works/OL27448W", "title": "The Lord of the Rings",
+            "authors": [{"author": {"key": "/authors/OL26320A"}, "type": {"key": "/type/author_role"}}],
+            "description": {"type": "/type/text", "value": "One ring"},
+            "subjects": ["Fantasy"], "covers": [-1, 8739161], "first_publish_date": "July 29, 1954",
+        })
+
+        assert row == {
+            "bID": "OL27448W", "title": "The Lord of the Rings", "date": 1954, "genre": "Fantasy",
+            "cover_id": "8739161", "author_key": "OL26320A", "description": "One ring",
+        }
+        assert parse_work({"key": "/works/OL1W"}) is None
+
+    def test_placeholder_years_ignored(self):
+        """Test that zero-padded placeholder dates don't become year 0"""
+        from backend.services.ingest import parse_edition, parse_work
+
+        assert parse_work({"key": "/works/OL1W", "title": "T", "first_publish_date": "0000"})["date"] is None
+        assert parse_edition({"works": [{"key": "/works/OL1W"}], "publish_date": "0000"}) is None
+        assert parse_edition({"works": [{"key": "/works/OL1W"}], "publish_date": "0000, reprinted 1987"})["date"] == 1987
+
+    async def test_works_batched_and_checkpointed(self, tmp_path):
+        """Test that works become catalog + description upserts in batches, with a checkpoint per batch"""
+        from concurrent.futures import ThreadPoolExecutor
+        from backend.services.ingest import Ingestor
+
+        path = tmp_path / "works.txt.gz"
+        self.write_dump(path, "work", [
+            {"key": f"/works/OL{i}W", "title": f"Book {i}", "authors": [{"author": {"key": "/authors/OL1A"}}]}
+            for i in range(5)
+        ])
+        database = self.mock_ingest_db(authors=[{"_id": "OL1A", "name": "Ursula K. Le Guin"}])
+
+        with ThreadPoolExecutor(2) as executor:
+            result = await Ingestor(database, executor, batch_size=2).run("works", str(path))
+
+        assert result["rows"] == 5
+        assert result["lines"] == 6
+        assert database.books.bulk_write.await_count == 3
+        book = database.books.bulk_write.await_args_list[0][0][0][0]._doc
+        assert book["$set"]["authorF"] == "Ursula"
+        assert book["$set"]["authorL"] == "Guin"
+        assert book["$setOnInsert"]["sypnosis"] == "No Description Available"
+        assert database.descriptions.bulk_write.await_count == 3
+        # marked as dump text, out of both TTLs, and any negative entry cleared
+        description = database.descriptions.bulk_write.await_args_list[0][0][0][0]._doc
+        assert description["$set"]["source"] == "dump"
+        assert description["$unset"] == {"fetched_at": "", "missing": "", "expires_at": ""}
+        last = database.ingest_checkpoints.update_one.await_args[0][1]["$set"]
+        assert last["done"] is True and last["lines"] == 6
+
+    async def test_resume_skips_checkpointed_lines(self, tmp_path):
+        """Test that an interrupted run picks up after the last written line"""
+        from concurrent.futures import ThreadPoolExecutor
+        from backend.services.ingest import Ingestor
+
+        path = tmp_path / "authors.txt.gz"
+        self.write_dump(path, "author", [{"key": f"/authors/OL{i}A", "name": f"Author {i}"} for i in range(4)])
+        database = self.mock_ingest_db(checkpoint={"lines": 3, "done": False})
+
+        with ThreadPoolExecutor(1) as executor:
+            result = await Ingestor(database, executor, batch_size=100).run("authors", str(path))
+
+        assert result["rows"] == 1
+        ops = database.authors.bulk_write.await_args[0][0]
+        assert [op._filter for op in ops] == [{"_id": "OL3A"}]
+
+    async def test_finished_file_not_ingested_again(self, tmp_path):
+        """Test that a file marked done is skipped unless restarted"""
+        from concurrent.futures import ThreadPoolExecutor
+        from backend.services.ingest import Ingestor
+
+        path = tmp_path / "editions.txt.gz"
+        self.write_dump(path, "edition", [{"key": "/books/OL1M", "works": [{"key": "/works/OL1W"}], "publish_date": "1999"}])
+        database = self.mock_ingest_db(checkpoint={"lines": 2, "done": True})
+
+        with ThreadPoolExecutor(1) as executor:
+            ingestor = Ingestor(database, executor)
+            assert (await ingestor.run("editions", str(path)))["skipped"]
+            database.books.bulk_write.assert_not_awaited()
+
+            await ingestor.run("editions", str(path), restart=True)
+        ops = database.books.bulk_write.await_args[0][0]
+        # a year the work already has is never overwritten
+        assert [(op._filter, op._doc) for op in ops] == [
+            ({"bID": "OL1W", "date": None}, {"$set": {"date": 1999}})
+        ]
+
+
+class TestLocalSearch:
+    """Test search over the local catalog and the SEARCH_MODE switch"""
+
+    @staticmethod
+    def catalog_db(books, count=None):
+        db = mock_search_db()
+        db.books.find = Mock(return_value=AsyncCursor([dict(b, score=1.5) for b in books]))
+        db.books.count_documents = AsyncMock(return_value=count if count is not None else len(books))
+        return db
+
+    async def test_search_catalog_text_query(self):
+        """Test that the catalog is queried through the text index, same shape as upstream"""
+        from backend.services.local_search import search_catalog
+
+        db = self.catalog_db([{"bID": "OL1W", "title": "Dune"}], count=37)
+        count, books = await search_catalog(db, "DUNE!", page=2, page_size=1)
+
+        assert count == 37
+        assert books == [{"bID": "OL1W", "title": "Dune"}]
+        query, projection = db.books.find.call_args[0]
+        assert query == {"$text": {"$search": '"dune"'}}
+        assert projection["score"] == {"$meta": "textScore"}
+        assert projection["search_hits"] == 0
+
+    async def test_local_first_skips_upstream(self):
+        """Test that local_first answers from the catalog without calling OpenLibrary"""
+        from backend.services import local_search
+
+        db = self.catalog_db([{"bID": "OL1W", "title": "Dune", "sypnosis": "Spice", "image": "", "cover_id": None}])
+        client = Mock()
+
+        with patch.object(local_search, "SEARCH_MODE", "local_first"):
+            result = await OpenBookAPI(db, client=client).search("dune")
+
+        assert result == {"count": 1, "results": [{"bID": "OL1W", "title": "Dune", "sypnosis": "Spice", "image": ""}]}
+        client.request.assert_not_called()
+
+    async def test_local_search_repairs_outage_placeholders(self):
+        """Test that a placeholder with no descriptions entry behind it is fetched again"""
+        from backend.services import local_search
+
+        db = self.catalog_db([
+            {"bID": "OL1W", "title": "Dune", "sypnosis": "No Description Available", "image": "", "cover_id": None}
+        ])
+        client = mock_openlibrary_client([], descriptions={"OL1W": "Spice"})
+
+        with patch.object(local_search, "SEARCH_MODE", "local_first"):
+            result = await OpenBookAPI(db, client=client).search("dune repaired", enrich=("description",))
+
+        assert result["results"][0]["sypnosis"] == "Spice"
+        db.descriptions.find.assert_called()
+        book_update = db.books.bulk_write.call_args[0][0][0]._doc
+        assert book_update["$set"]["sypnosis"] == "Spice"
+        await client.aclose()
+
+    async def test_upstream_failure_falls_back_to_local(self):
+        """Test that upstream_first serves the catalog when OpenLibrary errors"""
+        import httpx
+
+        db = self.catalog_db([{"bID": "OL1W", "title": "Dune", "sypnosis": "Spice", "image": "/static/images/1.jpg"}])
+        client = httpx.AsyncClient(transport=httpx.MockTransport(lambda request: httpx.Response(500)))
+
+        result = await OpenBookAPI(db, client=client).search("dune fallback")
+
+        assert result["results"][0]["title"] == "Dune"
+        db.search_cache.update_one.assert_not_awaited()
+
+    async def test_race_returns_local_and_upstream_still_caches(self):
+        """Test that race answers with the faster side and lets upstream fill search_cache"""
+        import httpx
+        from backend.services import local_search, tasks
+
+        db = self.catalog_db([{"bID": "OL1W", "title": "Dune", "sypnosis": "Spice", "image": "/static/images/1.jpg"}])
+
+        async def slow(request):
+            await asyncio.sleep(0.05)
+            return httpx.Response(200, json={"num_found": 1, "docs": [{"key": "/works/OL1W", "title": "Dune"}]})
+
+        client = httpx.AsyncClient(transport=httpx.MockTransport(slow))
+        with patch.object(local_search, "SEARCH_MODE", "race"):
+            result = await OpenBookAPI(db, client=client).search("dune race", enrich=())
+        await tasks.shutdown()
+
+        assert result["results"][0]["sypnosis"] == "Spice"
+        db.search_cache.update_one.assert_awaited_once()
+
+    async def test_local_results_enriched_and_written_back(self):
+        """Test that catalog books missing a requested cover get it and the catalog is updated"""
+        from backend.services import local_search
+
+        db = self.catalog_db([{"bID": "OL1W", "title": "Dune", "sypnosis": "Spice", "image": "", "cover_id": "5"}])
+
+        api = OpenBookAPI(db, client=Mock())
+        api.image_cache.batch_cache_images = AsyncMock(return_value={"5": "/static/images/5.jpg"})
+        with patch.object(local_search, "SEARCH_MODE", "local_first"):
+            result = await api.search("dune covers")
+
+        assert result["results"][0]["image"] == "/static/images/5.jpg"
+        op = db.books.bulk_write.await_args[0][0][0]._doc
+        assert op["$set"]["image"] == "/static/images/5.jpg"
+        assert "sypnosis" not in op["$set"]
+
+
+class TestRefine:
+    """Test server-side filtering, sorting and facets over the catalog"""
+
+    def test_filters_for_upstream_and_catalog(self):
+        """Test that the filters become OpenLibrary query terms and a catalog $match"""
+        from backend.services.refine import make_filters, upstream_terms, catalog_match
+
+        filters = make_filters(year_from=1960, genre="Science-Fiction", author="Frank")
+
+        assert filters == {"year_from": 1960, "genre": "science fiction", "author": "frank"}
+        assert upstream_terms(filters) == 'first_publish_year:[1960 TO *] subject:"science fiction" author:"frank"'
+        match = catalog_match(filters)
+        assert match["date"] == {"$gte": 1960}
+        assert match["genre"]["$regex"] == r"^[\W_]*science[\W_]+fiction[\W_]*$"
+        assert match["$expr"]["$regexMatch"]["regex"] == "frank"
+        assert make_filters() == {}
+
+    def test_pipeline_filters_before_paginating(self):
+        """Test that the filters are in the first $match and sort / skip / limit only run on the page branch"""
+        from backend.services.refine import catalog_pipeline, make_filters, parse_sort, parse_facets
+
+        pipeline = catalog_pipeline("Dune", make_filters(year_to=1999), parse_sort("-year"), parse_facets("decade"), 3, 20)
+
+        assert pipeline[0]["$match"] == {"$text": {"$search": '"dune"'}, "date": {"$lte": 1999}}
+        branches = pipeline[-1]["$facet"]
+        assert set(branches) == {"results", "total", "decade"}
+        assert branches["total"] == [{"$count": "n"}]
+        # undated books go last whichever way round
+        assert branches["results"][2]["$sort"] == {"_absent": 1, "_sort": -1, "bID": 1}
+        assert branches["results"][3:5] == [{"$skip": 40}, {"$limit": 20}]
+        assert branches["results"][5]["$project"]["search_hits"] == 0
+        with pytest.raises(ValueError):
+            parse_sort("rating")
+        assert parse_facets("genre, decade") == ("genre", "decade")
+
+    async def test_refined_search_counts_filtered_total(self):
+        """Test that upstream gets the filters in q, the catalog answers with the filtered total and facets"""
+        import httpx
+        from backend.services.refine import make_filters, parse_facets
+
+        urls = []
+
+        def handler(request):
+            urls.append(str(request.url))
+            return httpx.Response(200, json={"num_found": 1, "docs": [{"key": "/works/OL1W", "title": "Dune"}]})
+
+        db = mock_search_db()
+        db.books.aggregate = Mock(return_value=AsyncCursor([{
+            "results": [{"bID": "OL1W", "title": "Dune", "date": 1965, "sypnosis": "Spice", "image": ""}],
+            "total": [{"n": 42}],
+            "decade": [{"_id": 1960, "count": 30}, {"_id": 1970, "count": 12}],
+        }]))
+
+        api = OpenBookAPI(db, client=httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+        result = await api.refined_search(
+            "dune", enrich=(), filters=make_filters(year_from=1960, author="herbert"), facets=parse_facets("decade")
+        )
+
+        assert result["count"] == 42
+        assert [b["bID"] for b in result["results"]] == ["OL1W"]
+        assert result["facets"] == {"decade": [{"value": "1960s", "count": 30}, {"value": "1970s", "count": 12}]}
+        assert "q=dune+first_publish_year%3A%5B1960+TO+%2A%5D+author%3A%22herbert%22" in urls[0]
+        # upstream's page went into the catalog before the aggregation ran
+        db.books.bulk_write.assert_awaited_once()
+
+        # same request again is served from memory, no second upstream call
+        assert await api.refined_search(
+            "dune", enrich=(), filters=make_filters(year_from=1960, author="herbert"), facets=parse_facets("decade")
+        ) == result
+        assert len(urls) == 1
+
+
+class TestCircuitBreaker:
+    """Test the per-host circuit breaker in front of OpenLibrary"""
+
+    def test_trips_on_error_rate_and_probes_half_open(self):
+        """Test closed -> open -> half_open -> closed"""
+        from backend.services.breaker import CircuitBreaker, CircuitOpenError
+
+        breaker = CircuitBreaker("a.example", min_calls=4, failure_rate=0.5, open_seconds=0, half_open_probes=2)
+        for failed in (False, True, False, True):
+            breaker.before_call()
+            breaker.record(failed, 0.01)
+        assert breaker.state == "open"
+
+        # open_seconds=0, so the next calls are the half-open probes
+        breaker.before_call()
+        breaker.before_call()
+        with pytest.raises(CircuitOpenError):
+            breaker.before_call()
+        breaker.record(False, 0.01)
+        breaker.record(False, 0.01)
+        assert breaker.state == "closed"
+
+    def test_slow_calls_trip_and_failed_probe_reopens(self):
+        """Test the latency threshold and that a failing probe reopens the breaker"""
+        from backend.services.breaker import CircuitBreaker, CircuitOpenError
+
+        breaker = CircuitBreaker("a.example", min_calls=2, slow_call=1, slow_rate=1.0, open_seconds=60)
+        breaker.record(False, 2.0)
+        breaker.record(False, 3.0)
+        assert breaker.state == "open"
+        assert not breaker.available()
+        with pytest.raises(CircuitOpenError):
+            breaker.before_call()
+
+        breaker._opened_at -= 61
+        breaker.before_call()
+        breaker.record(True, 0.1)
+        assert breaker.state == "open"
+        assert breaker.stats()["opened"] == 2
+
+    async def test_scheduler_fails_fast_when_open(self):
+        """Test that once a host trips, calls are rejected without reaching it"""
+        import httpx
+        from backend.services.breaker import CircuitOpenError
+        from backend.services.scheduler import OutboundScheduler
+
+        calls = []
+
+        def handler(request):
+            calls.append(request.url.path)
+            return httpx.Response(502)
+
+        scheduler = OutboundScheduler(default_rate=1000, default_burst=1000, max_retries=0)
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            for _ in range(10):
+                await scheduler.get(client, "https://a.example/x")
+            with pytest.raises(CircuitOpenError):
+                await scheduler.get(client, "https://a.example/x")
+
+        assert len(calls) == 10
+        assert scheduler.stats()["breakers"]["a.example"]["state"] == "open"
+        assert not scheduler.available("https://a.example/y")
+
+    async def test_search_degraded_when_open(self):
+        """Test that an open breaker with nothing cached or local gives an immediate degraded answer"""
+        from backend.services import openbook
+        from backend.services.breaker import CircuitOpenError
+
+        db = mock_search_db()
+        db.books.find = Mock(return_value=AsyncCursor([]))
+
+        api = OpenBookAPI(db, client=Mock())
+        with patch.object(openbook.scheduler, "get", AsyncMock(side_effect=CircuitOpenError("openlibrary.org", 30))):
+            result = await api.search("degraded")
+
+        assert result == {"count": 0, "results": [], "degraded": True}
+        assert openbook.search_cache_stats()["upstream"]["degraded"] >= 1
+
+
+class TestSearchDeadline:
+    """Test the latency budget on cold searches"""
+
+    async def test_slow_enrichment_returned_pending_and_finished_later(self):
+        """Test that enrichment past the deadline is marked pending and still lands in the cache"""
+        import httpx
+
+        async def handler(request):
+            if request.url.path.startswith("/works/"):
+                await asyncio.sleep(0.2)
+                return httpx.Response(200, json={"description": "Slow"})
+            return httpx.Response(200, json={"num_found": 1, "docs": [{"key": "/works/OL1W", "title": "Slow", "cover_i": 3}]})
+
+        db = mock_search_db()
+        api = OpenBookAPI(db, client=httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+        api.image_cache.download_image = AsyncMock(return_value=("/static/images/3.jpg", None))
+
+        result = await api.search("slow deadline", deadline_ms=50)
+
+        assert result["pending"] == ["description"]
+        assert result["results"][0]["sypnosis"] == ""
+        assert result["results"][0]["image"] == "/static/images/3.jpg"
+        db.search_cache.update_one.assert_not_awaited()
+
+        await asyncio.sleep(0.3)
+        db.search_cache.update_one.assert_awaited_once()
+        assert (await api.search("slow deadline"))["results"][0]["sypnosis"] == "Slow"
+
+    async def test_slow_upstream_search_pending_results(self):
+        """Test that a search that isn't back by the deadline answers with an empty pending page"""
+        import httpx
+
+        async def handler(request):
+            await asyncio.sleep(0.2)
+            return httpx.Response(200, json={"num_found": 0, "docs": []})
+
+        db = mock_search_db()
+        api = OpenBookAPI(db, client=httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+
+        result = await api.search("very slow", enrich=(), deadline_ms=20)
+
+        assert result == {"count": 0, "results": [], "pending": ["results"]}
+        await asyncio.sleep(0.3)
+        db.search_cache.update_one.assert_awaited_once()
+
+    async def test_slow_lean_upgrade_pending(self):
+        """Test that upgrading a lean cached page is bounded by the deadline too"""
+        from datetime import datetime
+
+        db = mock_search_db()
+        db.search_cache.find_one = AsyncMock(return_value={
+            "title": "lean", "page": 1, "enriched": [], "fetched_at": datetime.utcnow(),
+            "data": {"count": 1, "results": [
+                {"bID": "OL1W", "title": "Lean", "sypnosis": "", "image": "", "cover_id": "7"}
+            ]},
+        })
+
+        async def slow_images(cover_ids, priority=None):
+            await asyncio.sleep(0.2)
+            return {"7": "/static/images/7.jpg"}
+
+        api = OpenBookAPI(db, client=Mock())
+        api.image_cache.get_image_urls = slow_images
+        result = await api.search("lean slow", enrich=("image",), deadline_ms=50)
+
+        assert result["pending"] == ["image"]
+        assert result["results"][0]["title"] == "Lean"
+        db.search_cache.update_one.assert_not_awaited()
+
+        await asyncio.sleep(0.3)
+        stored = db.search_cache.update_one.await_args[0][1]["$set"]
+        assert stored["enriched"] == ["image"]
+
+    async def test_slow_local_enrichment_pending(self):
+        """Test that catalog results go out on time and their write-back finishes later"""
+        from backend.services import local_search
+
+        db = TestLocalSearch.catalog_db([{"bID": "OL1W", "title": "Dune", "sypnosis": "", "image": "", "cover_id": "9"}])
+
+        async def slow_images(cover_ids, priority=None):
+            await asyncio.sleep(0.2)
+            return {"9": "/static/images/9.jpg"}
+
+        api = OpenBookAPI(db, client=Mock())
+        api.image_cache.get_image_urls = slow_images
+        with patch.object(local_search, "SEARCH_MODE", "local_first"):
+            result = await api.search("dune slow", enrich=("image",), deadline_ms=50)
+
+        assert result["pending"] == ["image"]
+        assert result["results"][0]["title"] == "Dune"
+        db.books.bulk_write.assert_not_awaited()
+
+        await asyncio.sleep(0.3)
+        db.books.bulk_write.assert_awaited_once()
+
+
+class TestRetriesAndHedging:
+    """Test retries, hedged requests and the shared retry budget"""
+
+    async def test_retries_transient_errors(self):
+        """Test that a 503 without Retry-After and a connection error are retried"""
+        import httpx
+        from backend.services.scheduler import OutboundScheduler, RetryBudget
+
+        answers = [httpx.Response(503), None, httpx.Response(200)]
+
+        def handler(request):
+            answer = answers.pop(0)
+            if answer is None:
+                raise httpx.ConnectError("reset")
+            return answer
+
+        scheduler = OutboundScheduler(default_rate=1000, default_burst=1000, retry_base=0,
+                                      retry_budget=RetryBudget(ratio=1))
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            response = await scheduler.get(client, "https://a.example/x")
+
+        assert response.status_code == 200
+        assert scheduler.stats()["retries"] == 2
+
+    async def test_budget_caps_retries(self):
+        """Test that an empty budget turns retries off instead of amplifying an outage"""
+        import httpx
+        from backend.services.scheduler import OutboundScheduler, RetryBudget
+
+        calls = []
+
+        def handler(request):
+            calls.append(1)
+            return httpx.Response(502)
+
+        scheduler = OutboundScheduler(default_rate=1000, default_burst=1000, retry_base=0,
+                                      retry_budget=RetryBudget(ratio=0, min_per_sec=0))
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            response = await scheduler.get(client, "https://a.example/x")
+
+        assert response.status_code == 502
+        assert len(calls) == 1
+        assert scheduler.stats()["retry_budget"]["denied"] == 1
+
+    async def test_hedge_wins_over_slow_first_request(self):
+        """Test that a duplicate goes out after the hedge delay and the faster answer is used"""
+        import httpx
+        from backend.services.scheduler import OutboundScheduler, RetryBudget
+
+        calls = []
+
+        async def handler(request):
+            calls.append(1)
+            if len(calls) == 1:
+                await asyncio.sleep(1)
+                return httpx.Response(200, text="slow")
+            return httpx.Response(200, text="fast")
+
+        scheduler = OutboundScheduler(default_rate=1000, default_burst=1000, retry_budget=RetryBudget(ratio=1))
+        with patch.object(scheduler, "hedge_delay", return_value=0.02):
+            async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+                response = await scheduler.get(client, "https://a.example/x", hedge=True)
+
+        assert response.text == "fast"
+        stats = scheduler.stats()
+        assert stats["hedges"] == 1
+        assert stats["hedge_wins"] == 1
+        assert stats["active"] == 0
+
+    def test_hedge_delay_tracks_percentile(self):
+        """Test that the hedge delay follows the host's recent latency"""
+        from collections import deque
+        from backend.services.scheduler import OutboundScheduler, HEDGE_DEFAULT_DELAY
+
+        scheduler = OutboundScheduler()
+        assert scheduler.hedge_delay("a.example") == HEDGE_DEFAULT_DELAY
+
+        scheduler._latencies["a.example"] = deque([0.1] * 95 + [2.0] * 5, maxlen=200)
+        assert scheduler.hedge_delay("a.example") == 2.0
+
+
+class TestDescriptionNegativeCache:
+    """Test that missing works are cached briefly and transient errors not at all"""
+
+    @staticmethod
+    def works_client(response):
+        import httpx
+
+        calls = []
+
+        def handler(request):
+            calls.append(request.url.path)
+            return response
+
+        return httpx.AsyncClient(transport=httpx.MockTransport(handler)), calls
+
+    async def test_missing_work_is_negatively_cached(self):
+        """Test that a 404 is stored as missing with an expiry and read back without going upstream"""
+        import httpx
+
+        client, calls = self.works_client(httpx.Response(404))
+        db = mock_search_db()
+        api = OpenBookAPI(db, client=client)
+
+        assert await api.get_description_cached("OL404W", db) == ""
+        operation = db.descriptions.bulk_write.call_args[0][0][0]
+        update = operation._doc["$set"]
+        assert update["missing"] is True
+        assert update["expires_at"] > update["fetched_at"]
+
+        db.descriptions.find = Mock(return_value=AsyncCursor([
+            {"work_id": "OL404W", "description": "", "missing": True, "fetched_at": update["fetched_at"]}
+        ]))
+        assert await api.get_description_cached("OL404W", db) == ""
+        assert len(calls) == 1
+        await client.aclose()
+
+    async def test_transient_response_is_not_cached(self):
+        """Test that an HTML error page with a 200 is neither cached nor reported as found"""
+        import httpx
+
+        client, calls = self.works_client(httpx.Response(200, text="<html>busy</html>"))
+        db = mock_search_db()
+        api = OpenBookAPI(db, client=client)
+
+        assert await api.fetch_descriptions(["OL1W"]) == {}
+        await api.store_descriptions({}, db)
+        db.descriptions.bulk_write.assert_not_called()
+        await client.aclose()
+
+    async def test_unfetched_descriptions_are_not_stored_as_placeholder(self):
+        """Test that a work we couldn't fetch stays "" in the catalog and leaves the page unenriched"""
+        import httpx
+
+        def handler(request):
+            if request.url.path == "/search.json":
+                return httpx.Response(200, json={"num_found": 1, "docs": [{"key": "/works/OL5W", "title": "Outage"}]})
+            return httpx.Response(200, text="<html>busy</html>")
+
+        db = mock_search_db()
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        api = OpenBookAPI(db, client=client)
+
+        result = await api.search("outage unfetched", enrich=("description",))
+
+        assert result["results"][0]["sypnosis"] == ""
+        book_update = db.books.bulk_write.call_args[0][0][0]._doc
+        assert "sypnosis" not in book_update["$set"]
+        assert book_update["$setOnInsert"]["sypnosis"] == ""
+        page = db.search_cache.update_one.call_args[0][1]["$set"]
+        assert page["enriched"] == []
+        await client.aclose()
+
+    def test_classify_response(self):
+        """Test the found / missing / transient split"""
+        import httpx
+        from backend.services.openbook import classify_response, FOUND, MISSING, TRANSIENT
+
+        assert classify_response(httpx.Response(200, json={"description": "x"}))[0] == FOUND
+        assert classify_response(httpx.Response(410))[0] == MISSING
+        assert classify_response(httpx.Response(200, json={"type": {"key": "/type/delete"}}))[0] == MISSING
+        assert classify_response(httpx.Response(503))[0] == TRANSIENT
+        assert classify_response(httpx.Response(429))[0] == TRANSIENT
+
+
+class TestImageCacheSweeper:
+    """Test LRU eviction of the on-disk cover cache"""
+
+    @staticmethod
+    def sweeper_db(docs):
+        db = mock_search_db()
+        db.image_cache.aggregate = Mock(return_value=AsyncCursor([{"total": sum(d["size_bytes"] for d in docs)}]))
+        db.image_cache.find = Mock(return_value=AsyncCursor(docs))
+        db.image_cache.delete_many = AsyncMock()
+        db.books.update_many = AsyncMock()
+        return db
+
+    async def test_evicts_least_recently_used_down_to_low_water(self, tmp_path):
+        """Test that the oldest covers (and their thumbnails) go until the cache is under the low water mark"""
+        from backend.services.image_sweeper import ImageCacheSweeper
+
+        docs = []
+        for cid in ("1", "2", "3"):
+            (tmp_path / f"{cid}.jpg").write_bytes(b"x" * 100)
+            docs.append({"cover_id": cid, "local_path": str(tmp_path / f"{cid}.jpg"), "size_bytes": 100})
+        (tmp_path / "1-s.webp").write_bytes(b"x")
+        docs[0]["variants"] = ["s.webp"]
+        db = self.sweeper_db(docs)
+
+        sweeper = ImageCacheSweeper(db, cache_dir=str(tmp_path), max_bytes=250, low_water=0.5)
+        result = await sweeper.sweep()
+
+        assert result == {"evicted": 2, "freed_bytes": 200}
+        assert sorted(p.name for p in tmp_path.iterdir()) == ["3.jpg"]
+        db.image_cache.delete_many.assert_awaited_once_with({"cover_id": {"$in": ["1", "2"]}})
+        db.books.update_many.assert_awaited_once()
+
+    async def test_under_budget_and_touch_flush(self, tmp_path):
+        """Test that nothing is evicted under budget and served covers are flushed as last_accessed"""
+        from backend.services.image_cache import ImageCacheService
+        from backend.services.image_sweeper import ImageCacheSweeper
+
+        db = self.sweeper_db([{"cover_id": "1", "size_bytes": 100}])
+        service = ImageCacheService(db, cache_dir=str(tmp_path), client=Mock())
+        service.touch("1")
+        service.touch("1")
+
+        sweeper = ImageCacheSweeper(db, cache_dir=str(tmp_path), max_bytes=1000)
+        assert await sweeper.sweep() == {"evicted": 0, "freed_bytes": 0}
+
+        operations = db.image_cache.bulk_write.call_args[0][0]
+        assert len(operations) == 1
+        assert "$max" in operations[0]._doc
+        db.image_cache.delete_many.assert_not_called()
+
+
+class TestShardedImageLayout:
+    """Test the sharded, content-addressed cover layout and its migration"""
+
+    async def test_identical_covers_share_one_copy(self, tmp_path):
+        """Test that two covers with the same bytes are hard links to one blob"""
+        import httpx
+        from backend.services.image_cache import ImageCacheService, cover_relpath, blob_path
+
+        placeholder = b"GIF89a" + b"\x00" * 40
+        client = httpx.AsyncClient(transport=httpx.MockTransport(
+            lambda request: httpx.Response(200, headers={"Content-Type": "image/gif"}, content=placeholder)
+        ))
+        service = ImageCacheService(mock_search_db(), cache_dir=str(tmp_path), client=client)
+
+        _, first = await service.download_image("1")
+        _, second = await service.download_image("2")
+
+        assert first["content_hash"] == second["content_hash"]
+        one, two = (tmp_path / cover_relpath("1")).stat(), (tmp_path / cover_relpath("2")).stat()
+        assert one.st_ino == two.st_ino
+        assert blob_path(tmp_path, first["content_hash"]).stat().st_nlink == 3
+        await client.aclose()
+
+    async def test_shard_images_migration(self, tmp_path):
+        """Test that flat files move into shards, duplicates are linked and Mongo is pointed at them"""
+        from backend.services.image_cache import cover_relpath
+        from backend.services.migrations import shard_images
+
+        (tmp_path / "1.jpg").write_bytes(b"same")
+        (tmp_path / "1-s.webp").write_bytes(b"thumb")
+        (tmp_path / "2.jpg").write_bytes(b"same")
+        (tmp_path / "notes.txt").write_bytes(b"left alone")
+        db = Mock()
+        db.image_cache.bulk_write = AsyncMock()
+        db.books.bulk_write = AsyncMock()
+
+        result = await shard_images(db, cache_dir=tmp_path, dedupe=True)
+
+        assert result == {"covers": 2, "duplicates": 1}
+        assert (tmp_path / cover_relpath("1", "s.webp")).read_bytes() == b"thumb"
+        assert (tmp_path / cover_relpath("2")).stat().st_ino == (tmp_path / cover_relpath("1")).stat().st_ino
+        assert sorted(p.name for p in tmp_path.iterdir() if p.is_file()) == ["notes.txt"]
+        assert len(db.image_cache.bulk_write.call_args[0][0]) == 2
+        assert len(db.books.bulk_write.call_args[0][0]) == 2
+
+    async def test_legacy_urls(self, tmp_path):
+        """Test that flat URLs serve the sharded file and fall back to OpenLibrary once evicted"""
+        from fastapi.responses import FileResponse, RedirectResponse
+        from backend.routes import images
+        from backend.services.image_cache import cover_relpath
+
+        (tmp_path / cover_relpath("3")).parent.mkdir(parents=True)
+        (tmp_path / cover_relpath("3")).write_bytes(b"cover")
+
+        with patch.object(images, "CACHE_DIR", str(tmp_path)):
+            served = await images.legacy_image("3.jpg")
+            evicted = await images.legacy_image("4.jpg")
+
+        assert isinstance(served, FileResponse)
+        assert served.path == tmp_path / cover_relpath("3")
+        assert isinstance(evicted, RedirectResponse)
+        assert evicted.headers["location"] == "https://covers.openlibrary.org/b/id/4-L.jpg"
+
+    async def test_evicted_sharded_urls_redirect(self, tmp_path):
+        """Test that sharded URLs are served as static files and redirect once the cover is evicted"""
+        from starlette.exceptions import HTTPException
+        from backend.routes.images import CoverFiles
+        from backend.services.image_cache import cover_relpath
+
+        (tmp_path / cover_relpath("3")).parent.mkdir(parents=True)
+        (tmp_path / cover_relpath("3")).write_bytes(b"cover")
+        files = CoverFiles(directory=str(tmp_path))
+        scope = {"type": "http", "method": "GET", "headers": []}
+
+        served = await files.get_response(cover_relpath("3"), scope)
+        evicted = await files.get_response(cover_relpath("4"), scope)
+        thumbnail = await files.get_response(cover_relpath("4", "s.webp"), scope)
+
+        assert served.path == str(tmp_path / cover_relpath("3"))
+        assert evicted.status_code == 307
+        assert evicted.headers["location"] == "https://covers.openlibrary.org/b/id/4-L.jpg"
+        assert thumbnail.headers["location"] == "https://covers.openlibrary.org/b/id/4-M.jpg"
+        # a cover id under someone else's shard, or not a cover at all, is just missing
+        for path in (f"{cover_relpath('3').rsplit('/', 1)[0]}/4.jpg", "ab/cd/notes.txt"):
+            with pytest.raises(HTTPException) as raised:
+                await files.get_response(path, scope)
+            assert raised.value.status_code == 404
+
+    async def test_sharded_urls_reach_cover_files(self, app_client):
+        """Test that the app routes sharded cover URLs through the redirecting mount"""
+        from backend.services.image_cache import cover_url
+
+        response = await app_client.get(cover_url("999999999"))
+
+        assert response.status_code == 307
+        assert response.headers["location"] == "https://covers.openlibrary.org/b/id/999999999-L.jpg"